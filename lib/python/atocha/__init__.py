@@ -100,6 +100,10 @@ class AtochaError(Exception):
 class AtochaDelError(AtochaError):
     """
     Exception used within constructors and destructors.
+
+    Deprecated: this is not raised anymore, since the completeness checks are
+    not made in the destructors of the renderers (see FormRenderer.finish()).
+    It will be removed in a future version.
     """
     def __repr__(self):
         return ("<AtochaDelError for %s fields %s>" %
@@ -126,6 +130,7 @@ from fields import *
 from messages import *
 from parse import *
 from render import *
+from template import *
 
 # Note: we do not import the normalizers automatically.  You need to do that in
 # your glue code.
@@ -139,8 +144,10 @@ from renderers.rtext import *
 
 
 # Set this global to True if you want to indicate errors when forms are not
-# completely rendered or parsed.  This raises an exception in the destructor of
-# the renderer or parser.
+# completely rendered or parsed.  The checks are made when the renderers and
+# parsers are used as context managers (in a 'with' statement), or when you call
+# FormRenderer.finish().  This should be set before the renderers are created;
+# when it is not set, the renderers do not track the rendered fields at all.
 _completeness_errors = False
 
 
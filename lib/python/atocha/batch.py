@@ -0,0 +1,318 @@
+#
+# $Id$
+#
+#  Atocha -- A web forms rendering and handling Python library.
+#  Copyright (C) 2005  Martin Blais
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+"""
+Batch parsing of many submissions at once.
+
+The values are parsed one column (field) at a time rather than one submission
+at a time.  For the common types of fields, a batch kernel handles the valid
+values of a whole column with the attributes of the field looked up only once,
+and leaves the other values to the normal parsing of the form, so that the
+results are always the same as those of the parser.
+"""
+
+# stdlib imports
+import re, array
+
+# atocha imports
+from atocha import AtochaError
+from atocha.fields import *
+from atocha.fields.texts import _invalid_chars_re as _text_invalid_re
+
+
+__all__ = ('parse_batch', 'BatchResult', 'batch_kernels')
+
+
+
+class BatchResult:
+    """
+    The results of parse_batch(), by column.  'values' is a dict of the field
+    names to the lists of their parsed values, with None for the values which
+    had errors, and 'errors' a dict of the field names to dicts of the indexes
+    of the rows with errors to the (message, replacement value) pairs of the
+    errors, as returned by Form.parse_field().
+    """
+    def __init__(self, nrows, values, errors):
+        self.nrows = nrows
+        self.values = values
+        self.errors = errors
+
+    def haserrors(self):
+        """
+        Returns true if any of the rows had errors.
+        """
+        for errors in self.errors.itervalues():
+            if errors:
+                return True
+        return False
+
+    def row(self, index):
+        """
+        Returns a pair of a dict of the values and a dict of the errors for the
+        row at 'index', as for a single submission.
+        """
+        values, errors = {}, {}
+        for name, column in self.values.iteritems():
+            error = self.errors[name].get(index)
+            if error is None:
+                values[name] = column[index]
+            else:
+                errors[name] = error
+        return values, errors
+
+    def rows(self):
+        """
+        Generate the pairs of values and errors for all the rows.
+        """
+        for index in xrange(self.nrows):
+            yield self.row(index)
+
+    def array(self, name, missing=0):
+        """
+        Returns the parsed values of the numerical field 'name' in an
+        array.array, with the 'missing' value for the rows without a value or
+        with an error.
+        """
+        column = self.values[name]
+        if [x for x in column if isinstance(x, float)]:
+            typecode = 'd'
+        else:
+            typecode = 'l'
+        result = array.array(typecode, [missing]) * self.nrows
+        for i, value in enumerate(column):
+            if value is not None:
+                result[i] = value
+        return result
+
+
+
+def parse_batch(form, rows=None, columns=None, only=None, ignore=None):
+    """
+    Parse many submissions for 'form' at once.  The submitted values are given
+    either as 'rows', a list of dicts of arguments such as those given to the
+    parser, or as 'columns', a dict of the variable names to the lists of their
+    submitted values, with None for the missing values.  See the documentation
+    for method Form.select_fields() for the meaning of the 'only' and 'ignore'
+    arguments.  Returns a BatchResult.
+    """
+    if (rows is None) == (columns is None):
+        raise AtochaError("Error: specify one of rows or columns.")
+
+    if rows is not None:
+        nrows = len(rows)
+        def getcolumn(varname):
+            return [args.get(varname) for args in rows]
+    else:
+        lengths = set(map(len, columns.itervalues()))
+        if len(lengths) > 1:
+            raise AtochaError("Error: columns of different lengths.")
+        nrows = lengths and lengths.pop() or 0
+        def getcolumn(varname):
+            try:
+                return columns[varname]
+            except KeyError:
+                return [None] * nrows
+
+    allvalues, allerrors = {}, {}
+    for fi, varnames, decode, multi in form.get_parse_plan(only, ignore):
+        if multi:
+            # Parse the fields with many variables one row at a time.
+            cols = [(varname, getcolumn(varname)) for varname in varnames]
+            raw = [dict([(varname, col[i]) for varname, col in cols])
+                   for i in xrange(nrows)]
+            values, pending = [None] * nrows, xrange(nrows)
+        else:
+            raw = getcolumn(varnames)
+            kernel = batch_kernels.get(fi.__class__)
+            if kernel is None:
+                values, pending = [None] * nrows, xrange(nrows)
+            else:
+                values, pending = kernel(fi, _decode_column(raw, decode))
+
+        # Parse the values left by the kernel normally.
+        errors = {}
+        for i in pending:
+            args = multi and raw[i] or {varnames: raw[i]}
+            has_error, retvalue = form.parse_entry(fi, varnames, decode, multi,
+                                                   args)
+            if has_error:
+                values[i] = None
+                errors[i] = retvalue
+            else:
+                values[i] = retvalue
+
+        allvalues[fi.name] = values
+        allerrors[fi.name] = errors
+
+    return BatchResult(nrows, allvalues, allerrors)
+
+
+# Marker for the values that could not be decoded by _decode_column().
+_undecoded = object()
+
+def _decode_column(raw, decode):
+    """
+    Decode a column of submitted str values.  The values of other types and
+    those that cannot be decoded are replaced by a marker, so that the kernels
+    leave them to the normal parsing.
+    """
+    pvalues = []
+    append = pvalues.append
+    for value in raw:
+        if value is None:
+            append(None)
+        elif value.__class__ is str:
+            try:
+                append(decode(value)[0])
+            except UnicodeDecodeError:
+                append(_undecoded)
+        else:
+            append(_undecoded)
+    return pvalues
+
+
+#-------------------------------------------------------------------------------
+#
+# Batch kernels.
+#
+# A kernel is called with a field and the column of its decoded values, and
+# returns a list of the parsed values, and the indexes of the values that it
+# does not handle, which get parsed normally.  A kernel only handles the values
+# for which the results are certain to be the same as those of the field's
+# parse_value() method, usually the valid values.
+
+def parse_numerical_batch(field, pvalues):
+    numtype, minval, maxval = field._numtype, field.minval, field.maxval
+    required = field.required
+    values, pending = [], []
+    for i, pvalue in enumerate(pvalues):
+        if pvalue is None or pvalue == u'':
+            if required:
+                pending.append(i)
+            values.append(None)
+            continue
+        if pvalue.__class__ is not unicode:
+            pending.append(i)
+            values.append(None)
+            continue
+        try:
+            dvalue = numtype(pvalue)
+        except ValueError:
+            pending.append(i)
+            values.append(None)
+            continue
+        if (dvalue.__class__ is not numtype or
+            (minval is not None and dvalue < minval) or
+            (maxval is not None and dvalue > maxval)):
+            pending.append(i)
+            dvalue = None
+        values.append(dvalue)
+    return values, pending
+
+def parse_bool_batch(field, pvalues):
+    values, pending = [], []
+    for i, pvalue in enumerate(pvalues):
+        if pvalue is None:
+            values.append(False)
+        elif pvalue.__class__ is unicode:
+            values.append(pvalue != u'0' and bool(pvalue))
+        else:
+            pending.append(i)
+            values.append(None)
+    return values, pending
+
+def parse_onechoice_batch(field, pvalues):
+    # Map the valid values to their str versions once for the whole column.
+    valid = {}
+    for pvalue in set([x for x in pvalues if x.__class__ is unicode and x]):
+        try:
+            dvalue = pvalue.encode('ascii')
+        except UnicodeEncodeError:
+            continue
+        if field.nocheck or dvalue in field.choiceset:
+            valid[pvalue] = dvalue
+
+    values, pending = [], []
+    for i, pvalue in enumerate(pvalues):
+        try:
+            values.append(valid[pvalue])
+        except (KeyError, TypeError):
+            pending.append(i)
+            values.append(None)
+    return values, pending
+
+# Control characters that are not accepted in strings, which must also be on a
+# single line (see StringField.parse_value()).
+_string_invalid_re = re.compile('[\x00-\x1f]')
+
+def _parse_text_batch(field, pvalues, invalid_re, strip):
+    if field.encoding is not None:
+        # Leave the values to be encoded to the normal parsing.
+        return [None] * len(pvalues), range(len(pvalues))
+
+    minlen, maxlen, required = field.minlen, field.maxlen, field.required
+
+    # Check the whole column for control characters at once, and only check
+    # the values individually if there are any.
+    texts = [x for x in pvalues if x.__class__ is unicode]
+    check_chars = bool(invalid_re.search(u' '.join(texts)))
+
+    values, pending = [], []
+    for i, pvalue in enumerate(pvalues):
+        if pvalue is None:
+            pvalue = u''
+        elif pvalue.__class__ is not unicode:
+            pending.append(i)
+            values.append(None)
+            continue
+        elif strip:
+            pvalue = pvalue.strip()
+
+        if ((not pvalue and required) or
+            (pvalue and minlen is not None and minlen > len(pvalue)) or
+            (maxlen is not None and len(pvalue) > maxlen) or
+            (check_chars and invalid_re.search(pvalue))):
+            pending.append(i)
+            pvalue = None
+        values.append(pvalue)
+    return values, pending
+
+def parse_string_batch(field, pvalues):
+    return _parse_text_batch(field, pvalues, _string_invalid_re, field.strip)
+
+def parse_textarea_batch(field, pvalues):
+    return _parse_text_batch(field, pvalues, _text_invalid_re, False)
+
+
+batch_kernels = {
+    IntField: parse_numerical_batch,
+    FloatField: parse_numerical_batch,
+    BoolField: parse_bool_batch,
+    RadioField: parse_onechoice_batch,
+    MenuField: parse_onechoice_batch,
+    StringField: parse_string_batch,
+    PasswordField: parse_string_batch,
+    TextAreaField: parse_textarea_batch,
+    }
+"""The batch kernels for the field classes.  The kernels are looked up by the
+exact class of the fields, because the derived classes may parse differently.
+You can add your own kernels to this dict."""
+
@@ -0,0 +1,214 @@
+#
+# $Id$
+#
+#  Atocha -- A web forms rendering and handling Python library.
+#  Copyright (C) 2005  Martin Blais
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+"""
+Bulk rendering of reports and validation of submissions in a pool of
+processes.
+
+The rendering of a report and the parsing of many submissions are CPU-bound,
+and in a single process they cannot use more than one processor.  This module
+splits the records into chunks, processes the chunks in a pool of worker
+processes, and outputs the results in order.  This module is not imported
+automatically; you need to import atocha.bulk explicitly.
+"""
+
+# stdlib imports
+import multiprocessing
+from itertools import islice
+from collections import deque
+
+# atocha imports
+from atocha import AtochaError
+from atocha.renderers.rtext import TextDisplayRenderer
+from atocha.batch import parse_batch
+
+
+__all__ = ('render_report_bulk', 'render_report_bulk_iter',
+           'validate_bulk', 'validate_bulk_iter')
+
+
+
+def render_report_bulk(form, records, only=None, ignore=None, css_class=None,
+                       renderer=TextDisplayRenderer, processes=None,
+                       chunksize=1000, **kwds):
+    """
+    Render a report like TextDisplayRenderer.render_report(), in a pool of
+    'processes' worker processes (by default, one per processor).  The records
+    are sent to the workers in chunks of 'chunksize' records.  'renderer' is the
+    display renderer class to use, and the extra keyword arguments are given to
+    its constructor.
+    """
+    rdr, chunks = _report_bulk(form, records, only, ignore, css_class,
+                               renderer, processes, chunksize, kwds)
+    if rdr.outenc is None:
+        return u''.join(chunks)
+    return ''.join(chunks)
+
+
+def render_report_bulk_iter(form, records, only=None, ignore=None,
+                            css_class=None, renderer=TextDisplayRenderer,
+                            processes=None, chunksize=1000, **kwds):
+    """
+    Iterator version of render_report_bulk(), which produces the report one
+    chunk of records at a time, in order.  The records are consumed lazily, and
+    only a few chunks per worker are pending at any time, so this can be used
+    for reports of unbounded size.
+
+    The form and the renderer options are sent only once to each of the
+    workers, so they must be picklable, and so must be the records.
+    """
+    return _report_bulk(form, records, only, ignore, css_class,
+                        renderer, processes, chunksize, kwds)[1]
+
+
+def _report_bulk(form, records, only, ignore, css_class,
+                 renderer, processes, chunksize, kwds):
+    """
+    Returns the renderer of the report, which determines the type of the
+    chunks, and the iterator over the chunks.
+    """
+    _check_chunksize(chunksize)
+    rdr = renderer(form, **kwds)
+    columns = rdr.report_columns(only, ignore)
+    names = [name for field, name, memo in columns]
+    chunks = _imap_chunks(_render_rows, records, processes, chunksize,
+                          _init_renderer, (renderer, form, names, kwds))
+    return rdr, rdr.encode_chunks(_iter_report(rdr, columns, css_class,
+                                               chunks))
+
+
+def _iter_report(rdr, columns, css_class, chunks):
+    yield rdr.report_header(columns, css_class)
+    for chunk in chunks:
+        yield chunk
+    yield rdr.report_footer()
+
+
+def validate_bulk(form, records, only=None, ignore=None, processes=None,
+                  chunksize=1000):
+    """
+    Parse many submissions in a pool of 'processes' worker processes (by
+    default, one per processor).  'records' is an iterable of dicts of
+    arguments such as those given to the parser.  This returns a list of
+    (values, errors) pairs for each of the records, in order, as for
+    FormParser.parse_grid(), and a dict of the field names to their number of
+    errors.  See validate_bulk_iter() for details.
+    """
+    counts = {}
+    results = list(validate_bulk_iter(form, records, only, ignore, processes,
+                                      chunksize, counts))
+    return results, counts
+
+
+def validate_bulk_iter(form, records, only=None, ignore=None, processes=None,
+                       chunksize=1000, counts=None):
+    """
+    Iterator version of validate_bulk(), which generates the (values, errors)
+    pairs of the records in order, and consumes the records lazily.  If
+    'counts' is given, it must be a dict, in which the number of errors of
+    each field is accumulated.
+
+    The records are sent to the workers in chunks of 'chunksize' records, and
+    parsed with atocha.batch.parse_batch(), which gives the same results as the
+    parser.  The form is sent only once to each of the workers.
+    """
+    _check_chunksize(chunksize)
+    results = _imap_chunks(_validate_rows, records, processes, chunksize,
+                           _init_validator, (form, only, ignore))
+    return _iter_validated(results, counts)
+
+
+def _iter_validated(results, counts):
+    for chunk in results:
+        for values, errors in chunk:
+            if counts is not None:
+                for name in errors:
+                    counts[name] = counts.get(name, 0) + 1
+            yield values, errors
+
+
+def _check_chunksize(chunksize):
+    if chunksize < 1:
+        raise AtochaError("Error: invalid chunk size %r." % chunksize)
+
+
+def _imap_chunks(func, records, processes, chunksize, initializer, initargs):
+    """
+    Generate the results of calling 'func' on the chunks of 'records' in a pool
+    of worker processes, in order.  The workers are initialized by calling
+    'initializer' with 'initargs'.
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    pool = multiprocessing.Pool(processes, initializer, initargs)
+    try:
+        # Keep a bounded window of pending chunks, to avoid reading all the
+        # records in memory if the workers are slower than the reader.
+        pending = deque()
+        records = iter(records)
+        while 1:
+            chunk = list(islice(records, chunksize))
+            if chunk:
+                pending.append(pool.apply_async(func, (chunk,)))
+            if pending and (not chunk or len(pending) >= processes * 2):
+                yield pending.popleft().get()
+            if not chunk and not pending:
+                break
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+# The state of a worker process, set once by its initializer.
+_worker = None
+
+def _init_renderer(renderer, form, names, kwds):
+    """
+    Initialize a worker process with its own renderer.  The memoized cells of
+    the columns are reused for all the chunks that the worker renders.
+    """
+    global _worker
+    rdr = renderer(form, **kwds)
+    _worker = (rdr, rdr.report_columns(only=names))
+
+def _render_rows(records):
+    """
+    Render the rows of a chunk of records in a worker process.
+    """
+    rdr, columns = _worker
+    return rdr.encode(u'').join(rdr.report_rows(columns, records))
+
+def _init_validator(form, only, ignore):
+    """
+    Initialize a worker process with the form to parse with.
+    """
+    global _worker
+    _worker = (form, only, ignore)
+
+def _validate_rows(records):
+    """
+    Parse a chunk of records in a worker process.
+    """
+    form, only, ignore = _worker
+    return list(parse_batch(form, records, only=only, ignore=ignore).rows())
+
@@ -0,0 +1,164 @@
+#
+# $Id$
+#
+#  Atocha -- A web forms rendering and handling Python library.
+#  Copyright (C) 2005  Martin Blais
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+"""
+Import of CSV and TSV files, using a form as the schema of the rows.
+
+The rows of the file are parsed like submissions of the form, one at a time, so
+that files of any size can be imported in constant memory.  This module is not
+imported automatically; you need to import atocha.csvimport explicitly.
+"""
+
+# stdlib imports
+import csv, codecs
+
+# atocha imports
+from atocha import AtochaError
+from atocha.messages import msg_registry
+from atocha.parse import FormParser
+from atocha.renderers.rtext import TextDisplayRenderer
+
+
+__all__ = ('import_csv', 'ErrorReport')
+
+
+
+def import_csv(form, fileobj, varnames=None, only=None, ignore=None,
+               progress=None, progress_every=1000, error_sink=None,
+               **fmtparams):
+    """
+    Generate (line, values, errors) triples for the rows of the CSV file
+    'fileobj', where 'line' is the line number of the end of the row in the
+    file, and 'values' and 'errors' the dicts of the parsed values and of the
+    errors of the fields, as for FormParser.parse_grid().  The cells are
+    decoded with the accept-charset of the form and parsed as for a submission
+    of the form.
+
+    'varnames' is the list of the variable names of the columns; if it is not
+    given, the first row of the file is expected to contain them (a UTF-8 byte
+    order mark at the start of the file is ignored).  The columns
+    that do not correspond to a field are ignored.  See the documentation for
+    method Form.select_fields() for the meaning of the 'only' and 'ignore'
+    arguments.
+
+    If 'progress' is given, it is called with the number of rows processed
+    every 'progress_every' rows and at the end.  If 'error_sink' is given, its
+    add() method is called for each row with errors (see ErrorReport).  The
+    remaining keyword arguments are given to csv.reader(), e.g. use
+    dialect='excel-tab' to read TSV files.
+    """
+    if progress_every < 1:
+        raise AtochaError("Error: invalid progress interval %r." %
+                          progress_every)
+
+    reader = csv.reader(fileobj, **fmtparams)
+    if varnames is None:
+        try:
+            varnames = reader.next()
+        except StopIteration:
+            return
+        if varnames and varnames[0].startswith(codecs.BOM_UTF8):
+            varnames[0] = varnames[0][len(codecs.BOM_UTF8):]
+
+    plan = form.get_parse_plan(only, ignore)
+    parse_entry = form.parse_entry
+    nrows = 0
+    for row in reader:
+        args = dict(zip(varnames, row))
+        values, errors = {}, {}
+        for fi, fvarnames, decode, multi in plan:
+            has_error, retvalue = parse_entry(fi, fvarnames, decode, multi,
+                                              args)
+            if has_error:
+                errors[fi.name] = FormParser._normalize_error(retvalue)
+            else:
+                values[fi.name] = retvalue
+
+        if errors and error_sink is not None:
+            error_sink.add(reader.line_num, values, errors)
+
+        nrows += 1
+        if progress is not None and nrows % progress_every == 0:
+            progress(nrows)
+
+        yield reader.line_num, values, errors
+
+    if progress is not None and nrows % progress_every != 0:
+        progress(nrows)
+
+
+
+class ErrorReport:
+    """
+    An error sink for import_csv(), which renders the rows with errors to a
+    file object as they come, as a report of TextDisplayRenderer with the
+    messages of the errors below each row.  Call close() at the end of the
+    import to finish the report.  The extra keyword arguments are given to the
+    renderer.
+    """
+
+    # CSS class for the cells of the messages.
+    css_messages = u'atoerr'
+
+    def __init__(self, form, fileobj, only=None, ignore=None, css_class=None,
+                 renderer=TextDisplayRenderer, **kwds):
+        self._ofile = fileobj
+        self._css_class = css_class
+        self._rdr = rdr = renderer(form, **kwds)
+        self._columns = rdr.report_columns(only, ignore)
+
+        # The fragments that are not encoded in advance are encoded as they
+        # get written out, with a single encoder for stateful encodings.
+        self._encoder = None
+        if rdr.outenc is not None and isinstance(rdr.encode(u''), unicode):
+            self._encoder = codecs.getincrementalencoder(rdr.outenc)()
+
+        self.count = 0
+        "The number of rows with errors."
+
+    def _write(self, chunk):
+        if self._encoder is not None:
+            chunk = self._encoder.encode(chunk)
+        self._ofile.write(chunk)
+
+    def add(self, line, values, errors):
+        """
+        Render the row at 'line' in the imported file, with its 'values' and
+        'errors'.
+        """
+        rdr = self._rdr
+        if self.count == 0:
+            self._write(rdr.report_header(self._columns, self._css_class))
+        self.count += 1
+
+        for chunk in rdr.report_rows(self._columns, [values]):
+            self._write(chunk)
+        self._write(rdr.report_errors(self._columns, errors,
+                                      msg_registry['import-line'] % line,
+                                      self.css_messages))
+
+    def close(self):
+        """
+        Finish the report, if there were errors.
+        """
+        if self.count:
+            self._write(self._rdr.report_footer())
+
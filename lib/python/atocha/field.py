@@ -141,6 +141,10 @@ class Field:
 
     # State definition enums.
     _states = NORMAL, READONLY, DISABLED, HIDDEN = range(1, 5)
+
+    # Counter that gets incremented when the field is modified, so that the
+    # values that the renderers cache from the field can be invalidated.
+    _version = 0
     
     #---------------------------------------------------------------------------
     #
@@ -288,12 +292,25 @@ class Field:
         self.starred = attribs.pop('starred', False)
         assert isinstance(self.starred, bool)
 
+        self._caches = {}
+        """Values that the renderers compute from the definition of this field
+        and cache, e.g. the rendered lists of choices.  This is cleared when
+        the field is modified (see touch())."""
+
         # Check that all attributes have been popped.
         if attribs:
             raise AtochaError(
                 "Error: unsupported attributes '%s' in field '%s'." %
                 (', '.join(attribs.keys()), self.name))
 
+    def __getstate__(self):
+        """
+        Copy and pickle support: the cached values are not carried over.
+        """
+        state = self.__dict__.copy()
+        state['_caches'] = {}
+        return state
+
     def __str__(self):
         """
         Returns a human-readable version of the field.
@@ -328,6 +345,20 @@ class Field:
             isreq = False
         return isreq
 
+    def get_constraints(self):
+        """
+        Returns a dict of the constraints that the parsing checks on the input
+        of this field and that the browser can check as well, before the form
+        is submitted.  The keys are the names of the corresponding HTML5
+        attributes ('required', 'minlength', 'maxlength', 'min', 'max', 'step',
+        and 'type' for the type of input), or 'atleast' for the minimum number
+        of choices.  Derived classes add the constraints for their own options.
+        """
+        constraints = {}
+        if getattr(self, 'required', False):
+            constraints['required'] = True
+        return constraints
+
     def set_state(self, new_state):
         """
         Set the new state of the field.  Use this with care.  This is provided
@@ -336,6 +367,17 @@ class Field:
         ## FIXME: this may require doing some more checks; where are the
         ## restrictions applied from the state?
         self.state = new_state
+        self.touch()
+
+    def touch(self):
+        """
+        Mark the field as modified.  The renderers cache some of the output that
+        they compute from the field definition (labels, attributes, etc.), so
+        you must call this if you modify the attributes of a field directly
+        after it has been used.
+        """
+        self._version += 1
+        self._caches = {}
 
     def parse_value(self, pvalue):
         """
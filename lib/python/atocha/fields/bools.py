@@ -121,6 +121,11 @@ class AgreeField(BoolField):
         """
         return True
 
+    def get_constraints(self):
+        constraints = BoolField.get_constraints(self)
+        constraints['required'] = True
+        return constraints
+
     def render_value(self, dvalue):
         # Always render False, to be accepted.
         return False
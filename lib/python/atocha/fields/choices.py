@@ -163,6 +163,19 @@ class _MultipleField(Field):
 
         return choices, choiceset
 
+    def __getstate__(self):
+        """
+        Copy and pickle support: the set of choices is rebuilt from the list of
+        choices.
+        """
+        state = Field.__getstate__(self)
+        del state['choiceset']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.choiceset = dict(self.choices)
+
     def setchoices(self, choices, accept_unicode=False):
         """
         Set the choices that this field renders and parses.  'choices' is of the
@@ -173,6 +186,9 @@ class _MultipleField(Field):
         self.choices, self.choiceset = self.parse_choices(choices,
                                                           accept_unicode)
 
+        # Invalidate the choices that the renderers may have cached.
+        self.touch()
+
     def checkvalues(self, values):
         """
         Cross-check values agains the set of possible choices for this field.
@@ -359,6 +375,13 @@ class _ManyChoicesField(_MultipleField):
         # Initialize base classes, always set as required.
         _MultipleField.__init__(self, name, choices, label, attribs)
 
+    def get_constraints(self):
+        constraints = _MultipleField.get_constraints(self)
+        # Note: this may not be set on single-choice listboxes.
+        if getattr(self, 'atleast', 0):
+            constraints['atleast'] = self.atleast
+        return constraints
+
     def check_at_least(self, numvalues):
         """
         Check that we have the number of required values.
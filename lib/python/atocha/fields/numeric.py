@@ -103,6 +103,15 @@ class _NumericalField(Field, OptRequired):
 
         return dvalue
 
+    def get_constraints(self):
+        constraints = Field.get_constraints(self)
+        constraints['type'] = 'number'
+        if self.minval is not None:
+            constraints['min'] = self.minval
+        if self.maxval is not None:
+            constraints['max'] = self.maxval
+        return constraints
+
     def render_value(self, dvalue):
         if dvalue is None:
             return u''
@@ -148,3 +157,8 @@ class FloatField(_NumericalField):
 
         _NumericalField.__init__(self, name, label, attribs)
 
+    def get_constraints(self):
+        constraints = _NumericalField.get_constraints(self)
+        constraints['step'] = 'any'
+        return constraints
+
@@ -262,11 +262,24 @@ class DateMenuField(MenuField):
         self.extra_choices, self.extra_choiceset = \
             self.parse_choices(extra_choices)
 
+        self._dates_base = None
+        "The date at which the current set of choices starts."
+
         # Note: The set of dates will be filled in every time we render this
         # field, rather than at initialization time, to avoid long-running
         # children eventually having invalid dates, so we do not initialize the
         # menu's choices in the constructor.
 
+    def __getstate__(self):
+        """
+        Copy and pickle support: the dates are not carried over, they are
+        recomputed on the next rendering.
+        """
+        state = MenuField.__getstate__(self)
+        state['_dates_base'] = None
+        state['choices'] = list(self.extra_choices)
+        return state
+
     def parse_value(self, pvalue):
         value = MenuField.parse_value(self, pvalue)
 
@@ -315,12 +328,18 @@ class DateMenuField(MenuField):
 
     def _reset_dates(self):
         """
-        Reset the list of dates (choices) for this menu.
+        Reset the list of dates (choices) for this menu.  The choices are only
+        changed when the date changes, so that the renderers can cache them.
         """
+        today = datetime.date.today()
+        if today == self._dates_base:
+            return
+        self._dates_base = today
+
         choices = list(self.extra_choices)
 
         # Set the list of dates to this choice field.
-        for d in date_range(self.nbdays):
+        for d in date_range(self.nbdays, today):
             choices.append( (d.strftime(self.__value_fmt),
                              time_to_string(d, self._def_display_fmt)) )
 
@@ -35,6 +35,10 @@ __all__ = ('StringField', 'TextAreaField', 'PasswordField',
            'EmailField', 'URLField',)
 
 
+# Control characters that are not accepted in the texts (newlines are).
+_invalid_chars_re = re.compile('[\x00-\x09\x0b\x0c\x0e-\x1f]')
+
+
 
 class _TextField(Field, OptRequired):
     """
@@ -110,6 +114,12 @@ class _TextField(Field, OptRequired):
             # Otherwise we simply use the unicode value.
             dvalue = pvalue
 
+        # Check the maximum length first, so that large values get rejected
+        # before they are scanned.
+        if self.maxlen is not None and len(dvalue) > self.maxlen:
+            raise FieldError(msg_registry['text-maxlen'],
+                             self.render_value(dvalue))
+
         # Check the minimum length.
         if dvalue:
             # Note: we only check the minlen if there is a value, so that fields
@@ -119,32 +129,24 @@ class _TextField(Field, OptRequired):
                 raise FieldError(msg_registry['text-minlen'],
                                  self.render_value(dvalue))
 
-        # Check the maximum length.
-        if self.maxlen is not None and len(dvalue) > self.maxlen:
-            raise FieldError(msg_registry['text-maxlen'],
-                             self.render_value(dvalue))
-
-        # Make sure that the value does not contain control chars.
-        v, dvalue_chars = None, []
-        for ch in dvalue:
-            o = ord(ch)
-            if o < 0x20 and o != 10 and o != 13:
-                v = FieldError(msg_registry['text-invalid-chars'])
-            else:
-                # We're also building a clean version of the string for
-                # rendering back when the error returns.
-                dvalue_chars.append(ch)
-        if self.encoding is None:
-            dvalue_clean = u''.join(dvalue_chars)
-        else:
-            dvalue_clean = ''.join(dvalue_chars)
-        if v is not None:
-            v.args = v.args + (dvalue_clean,)
-            raise v
+        # Make sure that the value does not contain control chars.  If it does,
+        # we build a clean version of the string for rendering back.
+        if _invalid_chars_re.search(dvalue) is not None:
+            dvalue_clean = _invalid_chars_re.sub(dvalue[:0], dvalue)
+            raise FieldError(msg_registry['text-invalid-chars'],
+                             _TextField.display_value(self, dvalue_clean))
 
         # Return the parsed valid value.
         return dvalue
 
+    def get_constraints(self):
+        constraints = Field.get_constraints(self)
+        if self.minlen is not None:
+            constraints['minlength'] = self.minlen
+        if self.maxlen is not None:
+            constraints['maxlength'] = self.maxlen
+        return constraints
+
     def render_value(self, dvalue):
         if dvalue is None:
             return u''
@@ -238,12 +240,13 @@ class TextAreaField(_TextField):
     def render_value(self, dvalue):
         rvalue = _TextField.render_value(self, dvalue)
 
-        if self.encoding:
-            # Make sure the DOS CR-LF are converted into simple Unix newlines
-            # for the browser, in case some data value is set wrongly.
-            return rvalue.replace('\r\n', '\n')
-        else:
-            return rvalue.replace(u'\r\n', u'\n')
+        # Make sure the DOS CR-LF are converted into simple Unix newlines for
+        # the browser, in case some data value is set wrongly.  Note: the
+        # rendered value is always unicode, and we avoid copying large texts
+        # that have no CR.
+        if u'\r' in rvalue:
+            rvalue = rvalue.replace(u'\r\n', u'\n')
+        return rvalue
 
     display_value = render_value
 
@@ -276,3 +276,11 @@ class SetFileField(FileUploadField):
             # The field is to be reset. Return False object.
             return False
 
+    def render_value(self, dvalue):
+        # The file is never rendered, but the reset checkbox is checked when the
+        # file is to be removed, e.g. when the form is rendered again with
+        # errors.
+        if dvalue is False:
+            return u'1'
+        return u''
+
@@ -28,6 +28,18 @@ import sys
 from types import NoneType
 import keyword
 import copy
+import codecs
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+try:
+    import json
+except ImportError:
+    try:
+        import simplejson as json
+    except ImportError:
+        json = None # The constraints manifest will not be available.
 
 # atocha imports
 from atocha import AtochaError, AtochaInternalError
@@ -36,7 +48,7 @@ from fields.uploads import FileUploadField, FileUpload
 from messages import msg_registry, msg_type
 
 
-__all__ = ('Form',)
+__all__ = ('Form', 'DecodedArgs')
 
 
 
@@ -120,6 +132,25 @@ class Form:
         self._fieldsmap = {}
         "A map of all the fields."
 
+        self._positions = {}
+        "A map of the field names to their position in the list of fields."
+
+        self._varnames = []
+        "The list of the variable names of all the fields, in order."
+
+        self._varnamesmap = {}
+        """A map of the variable names to their fields, for checking collisions
+        in constant time."""
+
+        self._version = 0
+        """A counter that is incremented every time the form definition is
+        modified."""
+
+        self._caches = {}
+        """Values computed from the form definition by the renderers and parsers
+        (e.g. render skeletons).  This is cleared when the form is modified.
+        See getcache()."""
+
         self._initialize(name, *fields, **kwds)
 
 
@@ -195,7 +226,35 @@ class Form:
         # with the fields variable names, otherwise the form submit will not be
         # able to do its thing reliably due to collisions in the names.
         for val in self.__get_submit_values():
-            assert val not in self._fieldsmap
+            assert val not in self._varnamesmap
+
+        # The definition has changed (this matters for copy_extend()).
+        self.touch()
+
+    def __getstate__(self):
+        """
+        Copy and pickle support: the cached values and the indexes of the
+        fields are not carried over, they are rebuilt from the list of fields.
+        """
+        state = self.__dict__.copy()
+        state['_caches'] = {}
+        for name in self._indexes:
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._fieldsmap, self._positions = {}, {}
+        self._varnamesmap, self._varnames = {}, []
+        for position, field in enumerate(self._fields):
+            self._fieldsmap[field.name] = field
+            self._positions[field.name] = position
+            for varname in field.varnames:
+                self._varnamesmap[varname] = field
+            self._varnames.extend(field.varnames)
+
+    # The attributes that index the fields, which are not pickled.
+    _indexes = ('_fieldsmap', '_positions', '_varnamesmap', '_varnames')
 
     def __getitem__(self, name):
         """
@@ -221,10 +280,14 @@ class Form:
         Returns a list of the variable names that the fields encompass.
         This will normally be the same as the field names.
         """
-        varnames = []
-        for fi in self._fields:
-            varnames.extend(fi.varnames)
-        return varnames
+        return list(self._varnames)
+
+    def getposition(self, name):
+        """
+        Returns the position of the field 'name' in the list of fields, or None
+        if there is no such field.
+        """
+        return self._positions.get(name)
 
     def labels(self, *fieldnames):
         """
@@ -312,15 +375,118 @@ class Form:
                 'Error: Field name %s is already used.' % field.name)
 
         # Check variable name collisions.
-        for fi in self._fields:
-            for varname in field.varnames:
-                if varname in fi.varnames:
-                    raise AtochaError(
-                        'Error: Collision in varnames between %s and %s.' %
-                        (fi.name, field.name))
-        
+        for varname in field.varnames:
+            fi = self._varnamesmap.get(varname)
+            if fi is not None:
+                raise AtochaError(
+                    'Error: Collision in varnames between %s and %s.' %
+                    (fi.name, field.name))
+
+        self._positions[field.name] = len(self._fields)
         self._fields.append(field)
         self._fieldsmap[field.name] = field
+        for varname in field.varnames:
+            self._varnamesmap[varname] = field
+        self._varnames.extend(field.varnames)
+        self.touch()
+
+    def touch(self):
+        """
+        Mark the form definition as modified, discarding the values that the
+        renderers and parsers have cached from it.  This is done automatically
+        when fields are added.  Call this if you modify the attributes of a form
+        directly after it has been used (see also Field.touch()).
+        """
+        self._version += 1
+        self._caches = {}
+
+    # Maximum number of cached values kept on a form.  Caches are keyed on
+    # things like the renderer class and the language, so this bounds the memory
+    # used by applications which render a form in many different ways.
+    _cache_limit = 64
+
+    def getcache(self, key, build):
+        """
+        Returns the value cached under 'key' for this form, calling 'build' (with
+        no arguments) to compute it if it is not present.  The cache is cleared
+        when the form is modified.
+        """
+        try:
+            return self._caches[key]
+        except KeyError:
+            if len(self._caches) >= self._cache_limit:
+                self._caches.clear()
+            value = self._caches[key] = build()
+            return value
+
+    def getfieldscache(self, key, build):
+        """
+        Same as getcache(), but the value is also recomputed when one of the
+        fields gets modified (see Field.touch()).  Use this for values computed
+        from the attributes of the fields that are not otherwise invalidated.
+        """
+        versions = [x._version for x in self._fields]
+        cached = self.getcache(key, lambda: [None, None])
+        if cached[0] != versions:
+            cached[:] = [versions, build()]
+        return cached[1]
+
+    def get_digest(self):
+        """
+        Returns a digest (a hex str) of the definition of the form and of its
+        fields, which changes when they get modified.  Note that this is
+        computed from the representations of the attributes, so it is only
+        stable across processes if these do not include addresses.  This is
+        computed once and cached.
+        """
+        return self.getfieldscache(('digest',), self._build_digest)
+
+    # Attributes that are not part of the definition of a form or field.
+    _digest_ignore = ('_caches', '_version', '_fields', '_fieldsmap')
+
+    def _build_digest(self):
+        digest = md5()
+        for obj in [self] + self._fields:
+            digest.update(obj.__class__.__name__)
+            for name, value in sorted(obj.__dict__.iteritems()):
+                if name not in self._digest_ignore:
+                    digest.update('%s=%r\n' % (name, value))
+        return digest.hexdigest()
+
+    def get_constraints_manifest(self):
+        """
+        Returns a JSON document (a str) that describes the constraints of the
+        visible fields of this form (see Field.get_constraints()), for
+        client-side code that checks the inputs before submitting the form.  It
+        is an object with the name of the form and a list of fields, each with
+        its name, the names of its variables and its constraints, e.g.::
+
+          {"fields":[{"constraints":{"maxlength":20,"required":true},
+                      "name":"name","varnames":["name"]}],
+           "form":"person"}
+
+        This is computed once and cached, until the form or one of its fields
+        gets modified.
+        """
+        return self.getfieldscache(('constraints-manifest',),
+                                   self._build_constraints_manifest)
+
+    def _build_constraints_manifest(self):
+        if json is None:
+            raise AtochaError(
+                'Error: You need the json or simplejson module to use this.')
+
+        fields = []
+        for field in self._fields:
+            if field.ishidden():
+                continue
+            constraints = field.get_constraints()
+            if constraints:
+                fields.append({'name': field.name,
+                               'varnames': list(field.varnames),
+                               'constraints': constraints})
+        manifest = {'form': self.name, 'fields': fields}
+        return json.dumps(manifest, sort_keys=True, separators=(',', ':'))
 
     def select_fields(self, only=None, ignore=None):
         """
@@ -336,12 +502,23 @@ class Form:
           - 'ignore' -> list of str: specifies a list of field names to be
             ignored from this list.
 
+        The selection is cached on the form for each combination of 'only' and
+        'ignore', so the returned list must not be modified.
         """
+        if only is not None:
+            assert isinstance(only, (list, tuple))
+            only = tuple(only)
+        if ignore is not None:
+            assert isinstance(ignore, (list, tuple))
+            ignore = tuple(ignore)
+        return self.getcache(('select', only, ignore),
+                             lambda: self._select_fields(only, ignore))
+
+    def _select_fields(self, only, ignore):
         # Select fields to be parsed.
         if only is None:
             fields = self._fields
         else:
-            assert isinstance(only, (list, tuple))
             try:
                 fields = [self._fieldsmap[x] for x in only]
             except KeyError, e:
@@ -350,8 +527,6 @@ class Form:
 
         # Remove fields to be ignored.
         if ignore is not None:
-            assert isinstance(ignore, (list, tuple))
-
             # Note: we're making sure that all the fields specified to be
             # ignored are actually found in the list of fields, by tracking them
             # with a dict.
@@ -369,6 +544,26 @@ class Form:
 
         return fields
 
+    def get_parse_plan(self, only=None, ignore=None):
+        """
+        Returns the plan for parsing the fields selected by 'only' and 'ignore'
+        (see select_fields()), as a list of (field, varnames, decode, multi)
+        entries, where 'varnames' is the variable name of the field if 'multi'
+        is false, or a tuple of its variable names otherwise, and 'decode' the
+        function that decodes the submitted strings.  The plan is cached on the
+        form, and is meant to be used with parse_entry().
+        """
+        if only is not None:
+            only = tuple(only)
+        if ignore is not None:
+            ignore = tuple(ignore)
+        key = ('parse-plan', only, ignore, self.accept_charset)
+        return self.getcache(key, lambda: self._build_parse_plan(only, ignore))
+
+    def _build_parse_plan(self, only, ignore):
+        fields = self.select_fields(only, ignore)
+        decode = _getdecoder(self.accept_charset)
+        return [_plan_entry(fi, decode) for fi in fields]
 
     def parse_field(self, fi, args):
         """
@@ -416,79 +611,39 @@ class Form:
 
         """
         assert isinstance(fi.varnames, list) # Sanity check.
+        decode = _getdecoder(self.accept_charset)
+        if len(fi.varnames) == 1:
+            return self.parse_entry(fi, fi.varnames[0], decode, False, args)
+        else:
+            return self.parse_entry(fi, tuple(fi.varnames), decode, True, args)
 
-        # Accumulate the parsed value of each of the varnames for the field.
-        pvalues = {}
-        for varname in fi.varnames:
-            try:
-                argvalue = args[varname]
-
-                # Internal sanity check, to make sure that values of None are
-                # always set by use to indicate that an argument is missing,
-                # then letting the fields deal with the specific meaning of that
-                # themselves.
-                assert argvalue is not None
-
-            except KeyError:
-                # The argument value was not present/found...  we simply set the
-                # output parsed argument to None, thus indicating that the
-                # argument value was not present nor parsed.
-                argvalue = None
-
-            # Decoding.
-            #
-            # Decode the argument string or contained argument strings according
-            # to the accept-charset specified for the form, and assuming that
-            # the form has been rendered using this encoding specification.  The
-            # argument can be either a str, a list or tuple or str, or a
-            # FileUploadField object.
-            if argvalue is None:
-                # No decoding necessary for missing values.
-                pvalue = None
-
-            elif isinstance(argvalue, FileUpload):
-                # Do nothing for file uploads, its encoding is separate.
-                pvalue = argvalue
-
-            elif isinstance(argvalue, str):
-                # The value is a string, directly. Decode that.
-                try:
-                    pvalue = argvalue.decode(self.accept_charset)
-                except UnicodeDecodeError, e:
-                    # Broken client browser?  There is not much we can do if
-                    # the browser cannot send the data in the appropriate
-                    # encoding.
-                    return (1, (msg_registry['error-invalid-encoding'],
-                                None, None))
-
-            elif isinstance(argvalue, list):
-                # The raw argument type is a list of strings.
-                # Decode each string individually to unicode before parsing.
-                vallist = []
-                for val in argvalue:
-                    try:
-                        vallist.append(val.decode(self.accept_charset))
-                    except UnicodeDecodeError, e:
-                        # (Same decoding error as above.)
-                        return (1, (msg_registry['error-invalid-encoding'],
-                                    None, None))
-
-                pvalue = vallist
-
+    def parse_entry(self, fi, varnames, decode, multi, args):
+        """
+        Parse and validate the incoming arguments for a single entry of a parse
+        plan (see get_parse_plan()).  See parse_field() for details.  If 'args'
+        is a DecodedArgs for the charset of the plan, its decoded values are
+        used.
+        """
+        try:
+            if args.__class__ is DecodedArgs and args.decode is decode:
+                getdecoded = args.getdecoded
+                if multi:
+                    pvalue = {}
+                    for varname in varnames:
+                        pvalue[varname] = getdecoded(varname)
+                else:
+                    pvalue = getdecoded(varnames)
+            elif multi:
+                # Pass a dict of the values of the varnames to the field.
+                pvalue = {}
+                for varname in varnames:
+                    pvalue[varname] = _decode_arg(args.get(varname), decode)
             else:
-                raise AtochaInternalError(
-                    'Internal error with types: unexpected type: %s.' %
-                    type(argvalue))
-
-            pvalues[varname] = pvalue
-
-        # If there is a single pvalue, unwrap it form the list.
-        if len(pvalues) == 1:
-            # Use last set pvalue from the loop above.
-            pass
-        else:
-            # Pass the dict to the field for parsing.
-            pvalue = pvalues
+                pvalue = _decode_arg(args.get(varnames), decode)
+        except UnicodeDecodeError, e:
+            # Broken client browser?  There is not much we can do if the
+            # browser cannot send the data in the appropriate encoding.
+            return (1, (msg_registry['error-invalid-encoding'], None))
 
         # Now we check that we're always giving the field an expected value
         # type for the stuff to be parsed.
@@ -546,6 +701,32 @@ class Form:
         # Return succesfully parsed value.
         return (0, parsed_dvalue)
 
+    def validate_field(self, name, raw):
+        """
+        Parse and validate the submitted value 'raw' of the single field 'name',
+        without creating a parser, e.g. to check a value as it is being edited.
+        For a field with many variables, 'raw' must be a dict of the submitted
+        arguments instead.  The return value is the same as for parse_field().
+        """
+        fi, varnames, decode, multi = _plan_entry(
+            self[name], _getdecoder(self.accept_charset))
+        if multi:
+            args = raw
+        else:
+            args = {varnames: raw}
+        return self.parse_entry(fi, varnames, decode, multi, args)
+
+    def decode_args(self, args):
+        """
+        Returns a DecodedArgs for the submitted arguments 'args' and the
+        accept-charset of this form.  If 'args' already is one, it is returned
+        as it is, so that its decoded values are reused.
+        """
+        charset = _canonical_charset(self.accept_charset)
+        if args.__class__ is DecodedArgs and args.charset == charset:
+            return args
+        return DecodedArgs(args, charset)
+
 
     def __get_submit_values(self):
         """
@@ -609,3 +790,114 @@ class Form:
                     scripts[fn] = notice
         return scripts
 
+
+
+class DecodedArgs(dict):
+    """
+    A dict of submitted arguments, which decodes their values from a given
+    charset only once, the first time they are parsed, and then keeps them.
+    The values of the dict itself remain the submitted ones.
+
+    Give one of these to the parsers instead of a dict of arguments, so that
+    parsing the same arguments many times (e.g. with different 'only' and
+    'ignore' options, or with many parsers) does not decode them again.  Note
+    that this is a copy of the given arguments, so they should be complete
+    before it is created.
+    """
+    def __init__(self, args, charset):
+        dict.__init__(self, args)
+
+        self.charset = _canonical_charset(charset)
+        "The canonical name of the charset of the submitted values."
+
+        self.decode = _getdecoder(self.charset)
+        "The decoding function of the charset."
+
+        self._decoded = {}
+
+    def getdecoded(self, varname):
+        """
+        Returns the decoded value for 'varname', or None if it was not
+        submitted.  This raises a UnicodeDecodeError if the value cannot be
+        decoded.
+        """
+        try:
+            return self._decoded[varname]
+        except KeyError:
+            pvalue = self._decoded[varname] = \
+                     _decode_arg(self.get(varname), self.decode)
+            return pvalue
+
+
+def _canonical_charset(charset):
+    """
+    Returns the canonical name of 'charset', so that the different aliases of
+    the same charset use the same decoder.
+    """
+    try:
+        return _canonical_charsets[charset]
+    except KeyError:
+        try:
+            name = codecs.lookup(charset).name
+        except (TypeError, LookupError):
+            # Leave an invalid charset (or None) as it is, see _getdecoder().
+            return charset
+        _canonical_charsets[charset] = name
+        return name
+
+_canonical_charsets = {}
+
+def _getdecoder(charset):
+    """
+    Returns the decoding function for 'charset'.  If the charset is invalid (or
+    None), the function fails like str.decode() only when something actually
+    gets decoded, so that the forms without values to decode can be parsed.
+    """
+    charset = _canonical_charset(charset)
+    try:
+        return codecs.getdecoder(charset)
+    except (TypeError, LookupError):
+        def decode(value):
+            return value.decode(charset), len(value)
+        return decode
+
+def _plan_entry(fi, decode):
+    """
+    Returns the entry of a parse plan for field 'fi' (see
+    Form.get_parse_plan()).
+    """
+    assert isinstance(fi.varnames, list) # Sanity check.
+    if len(fi.varnames) == 1:
+        return (fi, fi.varnames[0], decode, False)
+    else:
+        return (fi, tuple(fi.varnames), decode, True)
+
+def _decode_arg(argvalue, decode):
+    """
+    Decode a submitted argument according to the accept-charset specified for
+    the form, assuming that the form has been rendered using this encoding
+    specification.  The argument can be either a str, a list of str, a
+    FileUpload object, or None if it was not submitted.
+    """
+    if argvalue is None:
+        # No decoding necessary for missing values.
+        return None
+
+    elif isinstance(argvalue, str):
+        # The value is a string, directly. Decode that.
+        return decode(argvalue)[0]
+
+    elif isinstance(argvalue, list):
+        # The raw argument type is a list of strings.
+        # Decode each string individually to unicode before parsing.
+        return [_decode_arg(val, decode) for val in argvalue]
+
+    elif isinstance(argvalue, FileUpload):
+        # Do nothing for file uploads, its encoding is separate.
+        return argvalue
+
+    else:
+        raise AtochaInternalError(
+            'Internal error with types: unexpected type: %s.' %
+            type(argvalue))
+
@@ -53,8 +53,10 @@ __all__ = ['msg_registry']
 # If they're not set, we will set them to noop functions here, so that at least
 # we can run the tests outside the environment and so that this library still
 # works even if the app is not i18n'ed.
+def _default_gettext(x):
+    return x.decode('iso-8859-1') # Input coding in latin-1.
 if not hasattr(__builtin__, '_'):
-    __builtin__._ = lambda x: x.decode('iso-8859-1') # Input coding in latin-1.
+    __builtin__._ = _default_gettext
 if not hasattr(__builtin__, 'N_'):
     __builtin__.N_ = lambda x: x
 
@@ -106,6 +108,9 @@ msg_registry = TranslatorDict({
     'display-true': N_("Yes"),
     'display-false': N_("No"),
 
+    # Prefix of the errors of a row in the reports of the CSV imports.
+    'import-line': N_("Line %d:"),
+
     #
     # Field-specific error messages.
     #
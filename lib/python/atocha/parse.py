@@ -24,8 +24,12 @@ Form parsing.
 See class FormParser (below).
 """
 
+# stdlib imports
+import weakref, warnings
+
 # atocha imports
 import atocha
+from form import DecodedArgs
 from fields.uploads import FileUpload
 from messages import msg_registry
 
@@ -33,6 +37,24 @@ from messages import msg_registry
 __all__ = ('FormParser',)
 
 
+# The weak references to the parsers that have not been ended yet, when
+# completeness errors are enabled.
+_unfinished_parsers = set()
+
+def _warn_unfinished(formname):
+    """
+    Returns the callback of the weak reference to a parser, which warns if the
+    parser gets destroyed without having been ended (or cancelled).  (The check
+    used to be made in the destructor of the parser, which could not report it
+    otherwise.)
+    """
+    def callback(ref):
+        if ref in _unfinished_parsers:
+            _unfinished_parsers.discard(ref)
+            warnings.warn("Form parser for form named '%s' was destroyed "
+                          "without being ended." % formname, RuntimeWarning)
+    return callback
+
 
 class FormParser:
     """
@@ -148,6 +170,10 @@ class FormParser:
     # Function called to perform redirection if present.
     redirect_func = None
 
+    # Whether the fields are parsed only when their values are accessed.  This
+    # can also be set for each parser in the constructor.
+    lazy = False
+
     # Callable that will get invoked to normalize the types before parsing.
     # This is used to adapt the incoming arguments from a variety of web
     # application frameworks to the kinds of generic arguments that this library
@@ -179,7 +205,7 @@ class FormParser:
     parse = staticmethod(parse)
 
 
-    def __init__(self, form, args=None, redir=None, redirfun=None):
+    def __init__(self, form, args=None, redir=None, redirfun=None, lazy=None):
         """
         Create a parser with the given form, and error redirection URL.
 
@@ -202,6 +228,14 @@ class FormParser:
           (Specifying the 'redirfun' here is not the most convenient way to do
           this.)
 
+        - 'lazy' -> bool (optional): if true, parse_args() does not parse the
+          fields, they get parsed when their values are first accessed.  All
+          the remaining fields get parsed when the errors are checked or
+          signaled (e.g. by haserrors(), error() or end()) and when all the
+          values are fetched, so that the results are the same as if they were
+          parsed by parse_args().  Use this if you usually access only a few
+          of the values of a large form before deciding what to do.
+
         If you have some custom argument checking code, you should specify call
         this constructor directly to continue the validation protocol and
         eventually call the end() method.  This is the way that you're supposed
@@ -257,6 +291,24 @@ class FormParser:
         This is used internally to insure that a parser always gets completed
         properly."""
 
+        self._unfinished = None
+        """A weak reference to this parser, whose callback warns if it gets
+        dropped without having been ended, if completeness errors are
+        enabled."""
+        if atocha._completeness_errors:
+            self._unfinished = weakref.ref(self, _warn_unfinished(form.name))
+            _unfinished_parsers.add(self._unfinished)
+
+        if lazy is not None:
+            self.lazy = lazy
+
+        self._pending = {}
+        """In lazy mode, a dict of the names of the fields that have not been
+        parsed yet, to their entries in the parse plan and their arguments."""
+
+        self._pending_order = []
+        "The names of the pending fields, in the order of the parse plans."
+
         if redirfun is not None:
             self.redirect_func = redirfun
         """An object that will get called to process the redirection with the
@@ -271,14 +323,28 @@ class FormParser:
         if args is not None:
             self.parse_args(args)
 
-    def __del__(self):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
         """
-        Destructor override that just makes sure that we ended the parser.
+        Call finish() at the end of a 'with' statement.  Note that the check is
+        not made if an exception is being raised, e.g. by the redirection.
         """
-        if atocha._completeness_errors:
-            if not self._ended:
-                raise atocha.AtochaDelError("Form parser not ended properly.",
-                                            self._form.name)
+        if exc_type is None:
+            self.finish()
+
+    def finish(self):
+        """
+        Check that the parser was ended (or cancelled), if completeness errors
+        are enabled.  This is called automatically at the end of a 'with'
+        statement.
+        """
+        _unfinished_parsers.discard(self._unfinished)
+        if atocha._completeness_errors and not self._ended:
+            raise atocha.AtochaError(
+                "Error: Form parser for form named '%s' not ended "
+                "properly." % self._form.name)
 
 
     def parse_args(self, args, only=None, ignore=None):
@@ -309,7 +375,8 @@ class FormParser:
 
           - 'args' -> dict of str to str: for each field varname, contains a str
             in the form's specified encoding for the unparsed submitted value
-            for that field.
+            for that field.  This can be a DecodedArgs, to reuse its decoded
+            values.
 
           See the documentation for method Form.select_fields() for the meaning
           of the 'only' and 'ignore' arguments.
@@ -322,34 +389,213 @@ class FormParser:
             args = self.normalizer(args)
         assert isinstance(args, dict)
 
-        # Select the fields.
-        fields = self._form.select_fields(only, ignore)
+        # Reuse the decoded values of the arguments if they are given as
+        # DecodedArgs (this checks that they are for the charset of the form).
+        if args.__class__ is DecodedArgs:
+            args = self._form.decode_args(args)
+
+        # Get the plan for parsing the selected fields.
+        plan = self._form.get_parse_plan(only, ignore)
 
         # Parse the arguments using the form parsing algorithm.
-        for fi in fields:
-            has_error, retvalue = self._form.parse_field(fi, args)
-            if has_error == 0:
-                # Accept this parsed value.
-                self._values[fi.name] = retvalue
-            elif has_error == 1:
-                # Check the types of the returned values.
-                message, repl_rvalue = retvalue
-                assert repl_rvalue is None or \
-                       isinstance(repl_rvalue, fi.types_render)
-
-                # Indicate an error.
-                #
-                # Use generic status for errors.  Maybe in the future a field
-                # error will be able to indicate a specific status as well.
-                #
-                # Note: if there is a single error, we could decide to use the
-                # error's message for the UI message.
-                self.error(**{'_status': self.__generic_status,
-                              fi.name: retvalue})
+        if self.lazy:
+            # Complete the previous parsing first, for the errors to be
+            # signaled in the same order.
+            self._parse_pending()
+            pending, order = self._pending, self._pending_order
+            for entry in plan:
+                name = entry[0].name
+                if name not in pending:
+                    order.append(name)
+                pending[name] = (entry, args)
+        else:
+            for entry in plan:
+                self._parse_planned(entry, args)
+
+        # Parse the submit buttons.
+        self.parse_submit(args)
+
+    def _parse_planned(self, entry, args):
+        """
+        Parse the field of an entry of a parse plan from 'args', and accept its
+        value or signal its error.
+        """
+        fi, varnames, decode, multi = entry
+        has_error, retvalue = self._form.parse_entry(fi, varnames, decode,
+                                                     multi, args)
+        if has_error == 0:
+            # Accept this parsed value.
+            self._values[fi.name] = retvalue
+        elif has_error == 1:
+            # Check the types of the returned values.
+            message, repl_rvalue = retvalue
+            assert repl_rvalue is None or \
+                   isinstance(repl_rvalue, fi.types_render)
+
+            # Indicate an error.
+            #
+            # Use generic status for errors.  Maybe in the future a field
+            # error will be able to indicate a specific status as well.
+            #
+            # Note: if there is a single error, we could decide to use the
+            # error's message for the UI message.
+            self.error(**{'_status': self.__generic_status,
+                          fi.name: retvalue})
+
+    def _parse_pending(self):
+        """
+        Parse all the fields that have not been parsed yet, in lazy mode.
+        """
+        if not self._pending:
+            return
+        # Note: we reset the pending fields first, because signaling errors
+        # checks the errors, which calls this method.
+        pending, self._pending = self._pending, {}
+        order, self._pending_order = self._pending_order, []
+        for name in order:
+            try:
+                entry, args = pending[name]
+            except KeyError:
+                continue # Already parsed on access.
+            self._parse_planned(entry, args)
+
+    def parse_grid(self, args, nrows=None, only=None, ignore=None):
+        """
+        Parse the arguments submitted from a form rendered by FormGridRenderer,
+        where the variable names are suffixed with the index of their row.  This
+        returns a list of (values, errors) pairs for each row, where 'values'
+        is a dict of the successfully parsed values and 'errors' a dict of the
+        errors, as for geterrors().
+
+        'nrows' is the number of rows to return, by default one more than the
+        largest index found in the arguments.  See the documentation for method
+        Form.select_fields() for the meaning of the 'only' and 'ignore'
+        arguments.
+
+        If there are errors in any of the rows, the parser is put in an error
+        state, but the errors of each row are only available from the return
+        value.
+        """
+        # Normalize the submitted arguments if required.
+        if self.normalizer:
+            args = self.normalizer(args)
+        assert isinstance(args, dict)
+
+        # Split the arguments per row.
+        varnames = set(self._form.varnames())
+        rowargs = {}
+        for name, value in args.iteritems():
+            parts = name.rsplit('_', 1)
+            if len(parts) != 2:
+                continue
+            varname, index = parts
+            if not (varname in varnames and index.isdigit()):
+                continue
+            try:
+                rowargs[int(index)][varname] = value
+            except KeyError:
+                rowargs[int(index)] = {varname: value}
+
+        if nrows is None:
+            nrows = rowargs and max(rowargs) + 1 or 0
+
+        # Parse each row.
+        form = self._form
+        plan = form.get_parse_plan(only, ignore)
+        results = []
+        for index in xrange(nrows):
+            rargs = rowargs.get(index, {})
+            values, errors = {}, {}
+            for fi, varnames, decode, multi in plan:
+                has_error, retvalue = form.parse_entry(fi, varnames, decode,
+                                                       multi, rargs)
+                if has_error == 0:
+                    values[fi.name] = retvalue
+                else:
+                    errors[fi.name] = self._normalize_error(retvalue)
+            results.append( (values, errors) )
+
+        # Signal the errors globally.
+        if [x for x in results if x[1]]:
+            self.error(_status=self.__generic_status)
 
         # Parse the submit buttons.
         self.parse_submit(args)
 
+        return results
+
+    def revalidate(self, values, errors, delta, only=None, ignore=None,
+                   base=None, skipped=None):
+        """
+        Update the results of a previous parsing of the form with a 'delta' of
+        the submitted arguments that changed since, e.g. for the partial
+        submissions of a form that gets saved automatically while it is being
+        edited.  'values' and 'errors' are the dicts of the parsed values and
+        of the errors of the previous parsing, as returned by getvalues() and
+        geterrors(), and they are updated in place.
+
+        Only the fields with a variable in 'delta' are parsed again, the other
+        values and errors are kept as they are.  See the documentation for
+        method Form.select_fields() for the meaning of the 'only' and 'ignore'
+        arguments.
+
+        The fields with many variables (e.g. DateField) can only be parsed
+        again with all of their variables.  For those that have only some of
+        their variables in 'delta', the others are taken from 'base', the
+        arguments that were previously submitted, if it is given.  Otherwise,
+        these fields are skipped, and their names are appended to the
+        'skipped' list, if one is given.
+
+        Returns a dict of the names of the fields whose errors have changed, to
+        their new errors, or to None for the errors that were fixed.  The state
+        of this parser is not changed, so it can be reused for many deltas.
+        """
+        # Normalize the submitted arguments if required.
+        if self.normalizer:
+            delta = self.normalizer(delta)
+            if base is not None:
+                base = self.normalizer(base)
+        assert isinstance(delta, dict)
+
+        form = self._form
+        changed = {}
+        for entry in form.get_parse_plan(only, ignore):
+            fi, varnames, decode, multi = entry
+            name = fi.name
+            args = delta
+            if multi:
+                present = [x for x in varnames if x in delta]
+                if not present:
+                    continue
+                if len(present) < len(varnames):
+                    if base is None:
+                        if skipped is not None:
+                            skipped.append(name)
+                        continue
+                    args = {}
+                    for varname in varnames:
+                        if varname in delta:
+                            args[varname] = delta[varname]
+                        elif varname in base:
+                            args[varname] = base[varname]
+            elif varnames not in delta:
+                continue
+
+            has_error, retvalue = form.parse_entry(fi, varnames, decode, multi,
+                                                   args)
+            olderror = errors.get(name)
+            if has_error == 0:
+                values[name] = retvalue
+                if olderror is not None:
+                    del errors[name]
+                    changed[name] = None
+            else:
+                values.pop(name, None)
+                error = self._normalize_error(retvalue)
+                if error != olderror:
+                    errors[name] = changed[name] = error
+        return changed
+
     def parse_submit(self, args):
         """
         Parse only for the submit value and nothing else.
@@ -378,6 +624,12 @@ class FormParser:
         is just a convenience. We recommend that you instead use the accessor
         object where you can access the parsed values via attribute names.
         """
+        if self._pending:
+            try:
+                entry, args = self._pending.pop(fname)
+                self._parse_planned(entry, args)
+            except KeyError:
+                pass
         try:
             return self._values[fname]
         except KeyError:
@@ -398,6 +650,7 @@ class FormParser:
         """
         Membership test.
         """
+        self._parse_pending()
         return fname in self._values
 
     def store(self, name, value):
@@ -417,12 +670,14 @@ class FormParser:
         # assert name not in self._form.names()
 
         # Store along with the values dict.
+        self._parse_pending()
         self._values[name] = value
 
     def clear(self, name):
         """
         Clear the given value.
         """
+        self._parse_pending()
         try:
             del self._values[name]
         except KeyError:
@@ -452,6 +707,7 @@ class FormParser:
         #
         # Note: we make sure to also copy the extra values data that was added
         # via the store() method.
+        self._parse_pending()
         if not cullfiles:
             # Note: we don't return a copy for efficiency and because we think
             # that at that point the user will not use the parser anymore, so
@@ -472,6 +728,7 @@ class FormParser:
         Returns false if the given field has an error associated to it.
         See haserror() below.
         """
+        self._parse_pending()
         return fieldname not in self._errors
 
     def haserror(self, fieldname):
@@ -479,12 +736,14 @@ class FormParser:
         Returns true if the given field has an error associated to it.
         See ok() above.
         """
+        self._parse_pending()
         return fieldname in self._errors
 
     def haserrors(self):
         """
         Returns true if some errors have already been signaled.
         """
+        self._parse_pending()
         return bool(self._errors or self._message or self._status)
 
     def geterrors(self):
@@ -493,12 +752,14 @@ class FormParser:
         tuples for each field name.  This can be used by the form renderer to
         render the errors near the corresponding input values in the HTML form.
         """
+        self._parse_pending()
         return self._errors
 
     def geterrorfields(self):
         """
         Returns a list of the fields which have had errors (a list of str):
         """
+        self._parse_pending()
         return self._errors.keys()
 
     def geterrorlabels(self):
@@ -507,6 +768,7 @@ class FormParser:
         """
         # Note: this should always work, unless an error would be specified for
         # a field that is not in the form, which would be an error.
+        self._parse_pending()
         return [self._form[x].label for x in self._errors.iterkeys()]
 
 
@@ -603,6 +865,7 @@ class FormParser:
         """
         Clear the errors associated with the given fields.
         """
+        self._parse_pending()
         for name in names:
             try:
                 del self._errors[name]
@@ -656,6 +919,8 @@ class FormParser:
 
         # Mark the parser protocol as complete.
         self._ended = 1
+        _unfinished_parsers.discard(self._unfinished)
+        self._parse_pending()
 
         # If we have errors, redirect to be rendered with errors.
         if self.haserrors():
@@ -673,6 +938,7 @@ class FormParser:
         was not complete.
         """
         self._ended = 1  # Mark as ended.
+        _unfinished_parsers.discard(self._unfinished)
 
     def redirect(self, redir=None):
         """
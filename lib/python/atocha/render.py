@@ -30,10 +30,14 @@ rendering to a tree of elements which gets flattenned out later.
 """
 
 # stdlib imports
-import sys
+import sys, inspect, gettext, weakref, warnings
 if sys.version_info[:2] < (2, 4):
     from sets import Set as set
 from types import ClassType
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
 
 # atocha imports
 import atocha
@@ -42,7 +46,7 @@ from atocha.form import Form
 from field import Field
 import fields
 from atocha.fields.uploads import FileUploadField
-from messages import msg_registry # Used for _() setup.
+from messages import msg_registry, _default_gettext # Used for _() setup.
 from parse import FormParser
 
 
@@ -50,6 +54,10 @@ __all__ = ('FormRenderer',)
 
 
 
+# Counter that gets incremented every time a rendering routine is registered,
+# so that the dispatch tables computed from the registries get invalidated.
+_registry_generation = 0
+
 def register_render_routine(renderer_cls, field_cls, fun, override=False):
     """
     Register a rendering routine for a specific renderer class and specific
@@ -76,11 +84,18 @@ def register_render_routine(renderer_cls, field_cls, fun, override=False):
     # Add the function to the registry.
     reg[field_cls] = fun
 
+    global _registry_generation
+    _registry_generation += 1
+
 
 def lookup_render_routine(renderer_cls, field_cls):
     """
     Lookup the rendering routine associated with render 'renderer_cls' and field
-    'field_cls', or with 'field_cls.render_as', if present.
+    'field_cls', or with 'field_cls.render_as', if present, or else with the
+    nearest base class of 'field_cls' that has one.
+
+    Note: this search is somewhat expensive; the renderers cache its results in
+    dispatch tables (see FormRenderer._dispatch_table()).
     """
     assert isinstance(renderer_cls, ClassType)
     assert isinstance(field_cls, ClassType)
@@ -89,29 +104,65 @@ def lookup_render_routine(renderer_cls, field_cls):
     # registry.
     try:
         reg = renderer_cls.renderers_registry
-    except KeyError:
+    except AttributeError:
         raise AtochaInternalError(
             "Missing renderers registry for '%s'." % renderer_cls.__name__)
 
-    # Fetch the function.
-    try:
-        renfun = reg[field_cls]
-    except KeyError:
+    # Search for the function.
+    search = [field_cls]
+    render_as = getattr(field_cls, 'render_as', None)
+    if render_as is not None:
+        search.append(render_as)
+    search.extend(inspect.getmro(field_cls)[1:])
+    for cls in search:
         try:
-            # Try to lookup the render_as class if not found.
-            renfun = reg[field_cls.render_as]
+            return reg[cls]
+        except KeyError:
+            pass
 
-            # Cache the value for next time (this has repercussions on how
-            # dynamic the registries can be, but they are usually statically
-            # defined so we can do this for efficiency).
-            register_render_routine(renderer_cls, field_cls, renfun)
+    raise AtochaInternalError(
+        "Missing rendering routine for renderer '%s', field '%s'." %
+        (renderer_cls.__name__, field_cls.__name__))
 
-        except AttributeError:
-            raise AtochaInternalError(
-                "Missing rendering routine for renderer '%s', field '%s'." %
-                (renderer_cls.__name__, field_cls.__name__))
 
-    return renfun
+# The weak references to the renderers that check the completeness of their
+# rendering and that have not been finished yet.
+_unfinished_renderers = set()
+
+def _warn_unfinished(form, rendered):
+    """
+    Returns the callback of the weak reference to a renderer, which warns if the
+    renderer gets destroyed before finish() is called and some fields of 'form'
+    have not been rendered, according to the 'rendered' bitmap.  (The checks
+    used to be made in the destructor of the renderer, which could not report
+    them otherwise.)
+    """
+    def callback(ref):
+        if ref not in _unfinished_renderers:
+            return # Finished.
+        _unfinished_renderers.discard(ref)
+        missing = _missing_fields(form, rendered)
+        if missing:
+            warnings.warn(
+                "Form renderer for form named '%s' was destroyed without "
+                "calling finish(), and did not render form completely, "
+                "missing: %s." % (form.name, ', '.join(missing)),
+                RuntimeWarning)
+    return callback
+
+def _missing_fields(form, rendered):
+    """
+    Returns the names of the fields of 'form' that have not been marked in the
+    'rendered' bitmap.
+    """
+    # Account for the fields added to the form since the bitmap was created.
+    nfields = len(form.fields())
+    if len(rendered) < nfields:
+        rendered.extend(bytearray(nfields - len(rendered)))
+
+    return [field.name
+            for field, done in zip(form.fields(), rendered)
+            if not done]
 
 
 
@@ -122,8 +173,14 @@ class FormRenderer:
 
     This class is instantiated to oversee the process of rendering a specific
     form, given certain initial values to fill the widgets with.  It can also
-    check to make sure that all the fields in a form have been renderer before
-    it gets deleted.
+    check to make sure that all the fields in a form have been rendered, if
+    completeness errors are enabled (see atocha._completeness_errors), when it
+    is used as a context manager::
+
+      with TextFormRenderer(form, values) as rdr:
+          ...
+
+    or when you call finish() explicitly.
     """
 
     action_evaluator = None
@@ -135,8 +192,33 @@ class FormRenderer:
     registry of the URLs of your application and want to specify those rather
     than actual URLs.  See project Ranvier for an example of this."""
 
-
-    def __init__(self, form, values=None, errors=None, incomplete=False):
+    locale_evaluator = None
+    """Function that returns a hashable key identifying the language that is
+    active for the current request (it gets called with the renderer).  The
+    renderers cache the translated output that they compute from the form
+    definitions (labels, buttons, etc.) under this key.  If this is not set,
+    the renderers cannot tell the languages apart, since the translation
+    function _() may select the language of each request itself, so nothing
+    that gets translated is cached.  The key is also included in the fingerprints of the output
+    (see FormRenderer.fingerprint()), so it should have a representation that
+    is the same in all processes, e.g. a language code."""
+
+    vary_headers = ('Accept-Language',)
+    """The names of the request headers that select the language, for the Vary
+    header returned by cache_headers().  Change this if you select the language
+    differently, e.g. with a cookie."""
+
+    constraints = False
+    """Whether the renderers output the constraints of the fields as HTML5
+    attributes (see Field.get_constraints()), so that the browsers can refuse
+    invalid inputs before the form gets submitted.  This is off by default,
+    since the browsers then also block the submit buttons that do not need
+    valid inputs (e.g. 'Cancel'), and refuse the numbers of fields with a custom
+    format.  This can be overridden with the 'constraints' option of the
+    constructor."""
+
+    def __init__(self, form, values=None, errors=None, incomplete=False,
+                 constraints=None):
         assert isinstance(form, Form)
         self._form = form
         "The form instance that we're rendering."
@@ -155,27 +237,79 @@ class FormRenderer:
         """Whether we allow the rendering to be an incomplete set of the form's
         fields."""
 
-        self._rendered = set()
-        """Set of field names that have already been rendered. This is used to
-        make sure that all of a form's fields are rendered."""
+        self._rendered = None
+        """A bitmap of the fields of the form that have already been rendered,
+        by index in the form, used to make sure that all of a form's fields are
+        rendered.  This is only kept if completeness errors are enabled."""
+        if atocha._completeness_errors:
+            self._rendered = bytearray(len(form.fields()))
+
+        self._unfinished = None
+        """A weak reference to this renderer, whose callback warns if it gets
+        dropped without finish() having been called.  See _warn_unfinished()."""
+        if self._rendered is not None and not incomplete:
+            self._unfinished = weakref.ref(
+                self, _warn_unfinished(form, self._rendered))
+            _unfinished_renderers.add(self._unfinished)
+
+        self._dispatch = None
+        """The dispatch table for the form, fetched on the first render.  See
+        _dispatch_table()."""
+
+        self._renctx = RenderContext(None, None, None, False)
+        """The rendering context, which gets reused for each field."""
 
-    def __del__(self):
+        if constraints is not None:
+            self.constraints = bool(constraints)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Don't hide the original error if there was one.
+        if exc_type is None:
+            self.finish()
+
+    def finish(self):
         """
-        Destructor override that just makes sure that we rendered all the fields
-        of the given form before we got destroyed.
+        Check that all the fields of the form have been rendered (or ignored),
+        if completeness errors are enabled and the renderer was not created for
+        an incomplete rendering.  This is called automatically at the end of a
+        'with' statement.
+
+        If completeness errors are enabled, the renderers that get destroyed
+        without this having been called warn about their missing fields.
         """
-        if atocha._completeness_errors:
-            if (not self._incomplete and
-                set(self._form.names()) != self._rendered):
+        _unfinished_renderers.discard(self._unfinished)
+        rendered = self._rendered
+        if rendered is None or self._incomplete:
+            return
 
-                # This gets ignored to some extent, because it is called within
-                # the destructor, and only outputs a message to stderr, but it
-                # should be ugly enough in the program's logs to show up.
-                msg = ("Error: Form renderer for form named '%s' did not "
-                       "render form completely.") % self._form.name
+        missing = _missing_fields(self._form, rendered)
+        if missing:
+            raise AtochaError(
+                "Error: Form renderer for form named '%s' did not render "
+                "form completely, missing: %s." %
+                (self._form.name, ', '.join(missing)))
 
-                missing = ', '.join(set(self._form.names()) - self._rendered)
-                raise atocha.AtochaDelError(msg, self._form.name, missing)
+    def _mark_rendered(self, name, check=True):
+        """
+        Mark the field 'name' as rendered in the bitmap, checking that it was
+        not already rendered, unless 'check' is false.  Only call this if the
+        bitmap is kept.
+        """
+        index = self._form.getposition(name)
+        if index is None:
+            return # Not a field of the form.
+
+        rendered = self._rendered
+        if index >= len(rendered):
+            # The form has been extended since we were created.
+            rendered.extend(bytearray(index + 1 - len(rendered)))
+        elif check and rendered[index]:
+            raise AtochaError(
+                "Error: field '%s' being rendered more than once." % name)
+        rendered[index] = 1
 
     def getform(self):
         """
@@ -293,11 +427,8 @@ class FormRenderer:
         output = self._dispatch_render(field, rvalue, errmsg, state)
 
         # Mark this field as having been rendered.
-        if field.name in self._rendered:
-            raise AtochaError(
-                "Error: field '%s' being rendered more than once." %
-                field.name)
-        self._rendered.add(field.name)
+        if self._rendered is not None:
+            self._mark_rendered(field.name)
 
         # Return output from the field-specific rendering code.
         return output
@@ -324,10 +455,9 @@ class FormRenderer:
             output = renderer.renderHidden(field, rvalue)
 
         else:
-            # Dispatch to functions for (renderer class, field class).  No
-            # search is performed in the inheritance tree, so every class must
-            # be registered to be able to render (we avoid this for now in the
-            # interest of speed).
+            # Dispatch to functions for (renderer class, field class).  The
+            # search in the inheritance tree of the field class is performed
+            # once per form, the results are kept in a dispatch table.
             #
             # This allows us some freedom in terms of where to place extension
             # code for new fields and/or new renderers.  In this code the
@@ -341,8 +471,25 @@ class FormRenderer:
             # The rendering routines have to be registered using the appropriate
             # function for this in this file.
 
-            renfun = lookup_render_routine(renderer.__class__, field.__class__)
-            renctx = RenderContext(state, rvalue, errmsg, field.isrequired())
+            table = self._dispatch
+            if table is None:
+                table = self._dispatch = self._dispatch_table()
+            renfun = table.get(field.name)
+            if renfun is None:
+                # Raise the lookup error, or support fields that are not from
+                # the form.
+                renfun = lookup_render_routine(renderer.__class__,
+                                               field.__class__)
+
+            renctx = self._renctx
+            renctx.state = state
+            renctx.rvalue = rvalue
+            renctx.errmsg = errmsg
+            try:
+                renctx.required = field._caches['required']
+            except KeyError:
+                renctx.required = field._caches['required'] = \
+                                  field.isrequired()
             try:
                 output = renfun(renderer, field, renctx)
             except AssertionError, e:
@@ -354,6 +501,57 @@ class FormRenderer:
 
         return output
 
+    def _dispatch_table(self):
+        """
+        Returns a dict of the names of the fields of the form to their rendering
+        routines for this renderer class.  This is computed once and cached on
+        the form, and recomputed if more rendering routines get registered.
+        """
+        key = ('dispatch', self.__class__, _registry_generation)
+        return self._form.getcache(key, self._build_dispatch_table)
+
+    def _build_dispatch_table(self):
+        table = {}
+        for field in self._form.fields():
+            try:
+                table[field.name] = lookup_render_routine(self.__class__,
+                                                          field.__class__)
+            except AtochaInternalError:
+                # Fields may be rendered hidden only, we raise the error at the
+                # time of rendering if necessary.
+                pass
+        return table
+
+    # The constraints that are output as HTML5 attributes, in order.  Note that
+    # the renderers output 'maxlength' for the inputs regardless, from the
+    # 'maxlen' attribute of the fields.
+    _html5_constraints = ('required', 'minlength', 'min', 'max', 'step')
+
+    def _html5_attributes(self, field):
+        """
+        Returns a pair of the HTML5 input type for the given field, or None, and
+        a list of (name, value) pairs of the attributes for its constraints,
+        with str values.  These are cached on the field.
+        """
+        if not self.constraints:
+            return None, []
+        try:
+            return field._caches['html5']
+        except KeyError:
+            pass
+
+        constraints = field.get_constraints()
+        attribs = []
+        for name in self._html5_constraints:
+            value = constraints.get(name)
+            if value is True:
+                attribs.append( (name, name) )
+            elif value is not None and value is not False:
+                attribs.append( (name, str(value)) )
+
+        result = field._caches['html5'] = (constraints.get('type'), attribs)
+        return result
+
     def _get_label(self, field):
         """
         Returns a printable label for the given field.
@@ -400,10 +598,114 @@ class FormRenderer:
             action = self.action_evaluator(action)
         return action
 
+    def eval_locale(self):
+        """
+        Returns the key for the language of the current request, or None if
+        there is no locale_evaluator, in which case the translated output must
+        not be cached.
+        """
+        if self.locale_evaluator is not None:
+            return self.locale_evaluator()
+        return None
+
 
     #---------------------------------------------------------------------------
     # Public methods that you can use.
 
+    def fingerprint(self, only=None, ignore=None, action=None, submit=None):
+        """
+        Returns a fingerprint (a hex str) of the output that render() would
+        produce with the same arguments, computed without rendering, from the
+        definition of the form (see Form.get_digest()), the values and errors,
+        the active language, and the renderer class and options.  You can use
+        this to avoid rendering a form that a client already has, see etag() and
+        not_modified().
+
+        Note: the values and errors are included from their representations, so
+        objects which do not define a __repr__() method will produce a different
+        fingerprint in each process.  See _locale_id() for the language.
+        """
+        form = self._form
+        digest = md5(form.get_digest())
+        for value in (self.__class__.__module__,
+                      self.__class__.__name__,
+                      self._locale_id(),
+                      self._fingerprint_options(),
+                      (only, ignore, submit),
+                      self.eval_action(action or form.action)):
+            digest.update('%r\n' % (value,))
+        for values in (self._values, self._errors):
+            if values is not None:
+                values = sorted(values.iteritems())
+            digest.update('%r\n' % (values,))
+        return digest.hexdigest()
+
+    def _locale_id(self):
+        """
+        Returns an identifier of the active language for fingerprint(), which
+        is the same in all processes.  This is the key returned by the
+        locale_evaluator if there is one.  Otherwise, the translation function
+        _() must be the default one, which does not translate, or a method of a
+        gettext translations object, identified by its language.  Any other
+        function may select the language of each request by itself, so we
+        cannot identify its language.
+        """
+        if self.locale_evaluator is not None:
+            return self.locale_evaluator()
+        if _ is _default_gettext:
+            return None
+
+        trans = getattr(_, 'im_self', None)
+        if isinstance(trans, gettext.NullTranslations):
+            language = trans.info().get('language')
+            if (language is not None or
+                trans.__class__ is gettext.NullTranslations):
+                return (trans.__class__.__name__, language)
+
+        raise AtochaError(
+            "Error: cannot identify the language of the translations for "
+            "the fingerprint, you need to set a locale_evaluator.")
+
+    def _fingerprint_options(self):
+        """
+        Returns the options of the renderer that affect its output, for
+        fingerprint().  By default, these are its public attributes.
+        """
+        return sorted([(k, v) for k, v in self.__dict__.iteritems()
+                       if not k.startswith('_')])
+
+    def etag(self, *args, **kwds):
+        """
+        Returns a value for an ETag header for the output of render() with the
+        same arguments.  See fingerprint().
+        """
+        return '"%s"' % self.fingerprint(*args, **kwds)
+
+    def cache_headers(self, *args, **kwds):
+        """
+        Returns a list of (name, value) pairs for the ETag and Vary headers that
+        go with the output of render() with the same arguments.
+        """
+        return [('ETag', self.etag(*args, **kwds)),
+                ('Vary', ', '.join(self.vary_headers))]
+
+    def not_modified(self, if_none_match, *args, **kwds):
+        """
+        Returns true if the value of an If-None-Match request header matches the
+        output of render() with the same arguments, in which case you can
+        respond with a 304 status instead of rendering the form.
+        """
+        if not if_none_match:
+            return False
+        etag = self.etag(*args, **kwds)
+        for tag in if_none_match.split(','):
+            tag = tag.strip()
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            if tag == etag or tag == '*':
+                return True
+        return False
+
     def update_values(self, newvalues):
         """
         Update the renderer's values with the new values.
@@ -459,20 +761,28 @@ class FormRenderer:
 
         - 'css_class': can be used to add a custom CSS class to this table.
 
+        """
+        ofields, css_class = self._select_table(fieldnames, kwds)
+
+        # Render the table given the fields.
+        return self.do_render_table(ofields, css_class=css_class)
+
+    def _select_table(self, fieldnames, kwds):
+        """
+        Process the arguments of render_table(), returning the list of fields to
+        render and the custom CSS class.
         """
         for fname in fieldnames:
             assert isinstance(fname, str)
 
         # Process only/ignore field selection.
         only = fieldnames
-        if only in kwds:
+        if 'only' in kwds:
             only = only + tuple(kwds.pop('only'))
         ignore = kwds.pop('ignore', None)
         ofields = self._form.select_fields(only, ignore)
 
-        # Render the table given the fields.
-        css_class = kwds.pop('css_class', None)
-        return self.do_render_table(ofields, css_class=css_class)
+        return ofields, kwds.pop('css_class', None)
 
     def table(self, pairs=(), css_class=None):
         """
@@ -511,8 +821,10 @@ class FormRenderer:
         """
         Mark field as rendered, for insuring completion of the form.
         """
+        if self._rendered is None:
+            return
         for fname in fieldnames:
-            self._rendered.add(fname)
+            self._mark_rendered(fname, False)
 
     def render_submit(self, submit=None):
         """
@@ -531,6 +843,57 @@ class FormRenderer:
         scripts = self._form.getscripts()
         return self.do_render_scripts(scripts)
 
+    def render_iter(self, only=None, ignore=None, action=None, submit=None):
+        """
+        Same as render(), but returns an iterator over the successive chunks of
+        the rendered form rather than the entire form at once.  The fields are
+        rendered as the iterator gets consumed, so you can start sending the
+        beginning of a page before the entire form has been rendered, e.g. from
+        a WSGI application.  The chunks are encoded strings if the renderer has
+        an output encoding.
+
+        Note that the fields are only marked as rendered when the iterator
+        reaches them, so you need to consume it entirely for the form to be
+        considered complete.
+        """
+        ofields = self._form.select_fields(only, ignore)
+        return self.do_render_iter(ofields,
+                                   action or self._form.action,
+                                   submit or self._form.submit)
+
+    def render_into(self, fp, only=None, ignore=None, action=None,
+                    submit=None):
+        """
+        Render the form into the given file object, chunk by chunk, rather than
+        returning it.  The arguments are the same as for render().  Note that
+        some output may have been written if an error occurs.
+        """
+        write = fp.write
+        for chunk in self.render_iter(only, ignore, action, submit):
+            write(chunk)
+
+    def render_container_iter(self, action=None):
+        """
+        Iterator version of render_container().  See render_iter().
+        """
+        action_url = self.eval_action(action or self._form.action)
+        return self.do_render_container_iter(action_url)
+
+    def render_table_iter(self, *fieldnames, **kwds):
+        """
+        Iterator version of render_table(), which produces one chunk for each
+        visible field, and the hidden fields at the end.  See render_iter().
+        """
+        ofields, css_class = self._select_table(fieldnames, kwds)
+        return self.do_render_table_iter(ofields, css_class=css_class)
+
+    def render_submit_iter(self, submit=None):
+        """
+        Iterator version of render_submit().  See render_iter().
+        """
+        return self.do_render_submit_iter(submit or self._form.submit,
+                                          self._form.reset)
+
     #---------------------------------------------------------------------------
     # Abstract methods that must get implemented by the derived class.
     # Normally the client should not call any of these directly.
@@ -589,6 +952,35 @@ class FormRenderer:
         """
         raise NotImplementedError
 
+    # Note: the iterator versions of the methods above have default
+    # implementations that produce their result in a single chunk.  Renderers
+    # that output text should override these to produce their output
+    # incrementally.
+
+    def do_render_iter(self, ofields, action=None, submit=None):
+        """
+        Implementation of render_iter().
+        """
+        yield self.do_render(ofields, action, submit)
+
+    def do_render_container_iter(self, action_url):
+        """
+        Implementation of render_container_iter().
+        """
+        yield self.do_render_container(action_url)
+
+    def do_render_table_iter(self, ofields, css_class=None):
+        """
+        Implementation of render_table_iter().
+        """
+        yield self.do_render_table(ofields, css_class=css_class)
+
+    def do_render_submit_iter(self, submit, reset):
+        """
+        Implementation of render_submit_iter().
+        """
+        yield self.do_render_submit(submit, reset)
+
     def renderHidden(self, field, rvalue):
         """
         You must override this method to render a hidden field.  Since all the
@@ -707,11 +1099,8 @@ class DisplayRendererBase:
         output = self._dispatch_render(field, uvalue, None, Field.NORMAL)
 
         # Mark this fields as having been rendered.
-        if field.name in self._rendered:
-            raise AtochaError(
-                "Error: field '%s' being rendered more than once." %
-                field.name)
-        self._rendered.add(field.name)
+        if self._rendered is not None:
+            self._mark_rendered(field.name)
 
         # Return output from the field-specific rendering code.
         return output
@@ -0,0 +1,669 @@
+# pylint: disable-msg=W0611
+#
+# $Id$
+#
+#  Atocha -- A web forms rendering and handling Python library.
+#  Copyright (C) 2005  Martin Blais
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""
+Renderer for forms using ElementTree.
+
+This renderer builds trees of nodes like the htmlout renderer, but it only
+depends on the ElementTree library, which comes with the standard library since
+Python 2.5.  The iterator methods (render_iter(), render_into(), etc.) serialize
+the form one table row at a time, so that the tree of the entire form never
+needs to be built.
+"""
+
+# stdlib imports
+import codecs
+from os.path import join
+
+# atocha imports
+from atocha import AtochaError, AtochaInternalError
+import atocha.render
+from atocha.field import *
+from atocha.fields import *
+from atocha.messages import msg_type
+
+# elementtree imports
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    try:
+        from elementtree import ElementTree
+    except ImportError:
+        raise ImportError(
+            'Error: You need the ElementTree library to use this module.')
+
+
+__all__ = ('EtreeFormRenderer', 'node', 'add_children',)
+
+
+
+def node(tag, *children, **attribs):
+    """
+    Create an element with the given tag, children and attributes.  See
+    add_children() for the children that are accepted.  Like for htmlout, the
+    attribute names are lowercased, so that you can use CLASS for the class
+    attribute, and the attributes with a value of None are left out.
+    """
+    elem = ElementTree.Element(tag)
+    for name, value in attribs.iteritems():
+        if value is not None:
+            elem.set(name.lower(), value)
+    add_children(elem, children)
+    return elem
+
+def add_children(elem, children):
+    """
+    Append the given list of children to the element.  The children can be
+    elements, strings, which are added to the text of the element or to the tail
+    of its last child, or nested lists of those.
+    """
+    for child in children:
+        if not child and not ElementTree.iselement(child):
+            # Skip None, empty strings and empty lists.
+            continue
+        elif isinstance(child, basestring):
+            if len(elem):
+                last = elem[-1]
+                last.tail = last.tail and last.tail + child or child
+            else:
+                elem.text = elem.text and elem.text + child or child
+        elif isinstance(child, (list, tuple)):
+            add_children(elem, child)
+        else:
+            elem.append(child)
+
+
+
+class EtreeRenderer(atocha.render.FormRenderer):
+    """
+    Base class for all renderers that will output to ElementTree.
+    """
+
+    # Default encoding for output.
+    default_encoding = None # Default: to unicode.
+
+    # CSS classes.
+    css_errors = u'atoerr'
+    css_table = u'atotbl'
+    css_label = u'atolbl'
+
+    # Default value.
+    label_semicolon = False
+
+    def __init__(self, *args, **kwds):
+        """
+        Grab the encoding parameter on top of the basic form renderer
+        construction parameters.
+        """
+
+        self.outenc = kwds.pop('output_encoding', self.default_encoding)
+        """Encoding for the serialized chunks produced by the iterator methods.
+        The other methods return elements."""
+
+        self.label_semicolon = kwds.pop('labelsemi',
+                                        EtreeRenderer.label_semicolon)
+        """Whether we automatically add a semicolon to the labels or not."""
+
+        atocha.render.FormRenderer.__init__(self, *args, **kwds)
+
+
+    def do_table(self, pairs=(), extra=None, css_class=None):
+        """
+        Implementation of instance method version of table().
+        """
+        return self.do_table_imp(self, pairs, extra, css_class)
+
+    def do_ctable(cls, pairs=(), extra=None, css_class=None):
+        """
+        Class method version of table().
+        """
+        return cls.do_table_imp(cls, pairs, extra, css_class)
+
+    do_ctable = classmethod(do_ctable)
+
+    def do_table_imp(rdr, pairs=(), extra=None, css_class=None):
+        """
+        Static method version of table().
+        """
+        table = rdr.table_node(rdr, css_class)
+        for label, inputs in pairs:
+            table.append(rdr.row_node(rdr, label, inputs))
+        if extra:
+            assert isinstance(extra, list)
+            add_children(table, extra)
+        return table
+
+    do_table_imp = staticmethod(do_table_imp)
+
+    def table_node(rdr, css_class=None):
+        """
+        Create the (empty) table element for table().
+        """
+        css = [rdr.css_table]
+        if css_class:
+            css.append(css_class)
+        return node('table', CLASS=' '.join(css))
+
+    table_node = staticmethod(table_node)
+
+    def row_node(rdr, label, inputs):
+        """
+        Create a row of the table for the given label and inputs.
+        """
+        assert isinstance(label, (unicode, list))
+        assert isinstance(inputs, (unicode, list))
+
+        tdlabel = node('td', label, CLASS=rdr.css_label)
+        if rdr.label_semicolon:
+            add_children(tdlabel, [u':'])
+        return node('tr', tdlabel, node('td', inputs, CLASS=rdr.css_input))
+
+    row_node = staticmethod(row_node)
+
+    #---------------------------------------------------------------------------
+    # Serialization.
+    #
+    # Note: the chunks are first serialized to UTF-8, which never adds an XML
+    # declaration, and then converted to the output encoding.
+
+    def _tostring(self, elem):
+        """
+        Serialize the given element and its children to UTF-8.
+        """
+        return ElementTree.tostring(elem, 'utf-8')
+
+    def _start_tag(self, elem):
+        """
+        Serialize the start tag of the given element to UTF-8, without its
+        children.
+        """
+        empty = ElementTree.Element(elem.tag, dict(elem.items()))
+        s = ElementTree.tostring(empty, 'utf-8')
+        assert s.endswith(' />')
+        return s[:-3] + '>'
+
+    def _end_tag(self, elem):
+        """
+        Serialize the end tag of the given element to UTF-8.
+        """
+        return '</%s>' % elem.tag
+
+    def _encode_chunks(self, chunks):
+        """
+        Returns an iterator over the given serialized chunks converted to the
+        output encoding, or to unicode if there is no output encoding.
+        """
+        if self.outenc is None:
+            return (chunk.decode('utf-8') for chunk in chunks)
+        elif codecs.lookup(self.outenc).name == 'utf-8':
+            return iter(chunks)
+        return self._encode_stateful(chunks)
+
+    def _encode_stateful(self, chunks):
+        encoder = codecs.getincrementalencoder(self.outenc)()
+        for chunk in chunks:
+            yield encoder.encode(chunk.decode('utf-8'))
+
+
+
+
+class EtreeFormRenderer(EtreeRenderer):
+    """
+    Form renderer that outputs ElementTree elements, or serializes them
+    incrementally from its iterator methods.
+
+    See FormRenderer class for full details.
+    """
+
+    # Registry for renderer.
+    renderers_registry = {}
+
+    # CSS classes.
+    css_input = u'atoinp'
+    css_submit = u'atosub'
+    css_required = u'atoreq'
+    css_vertical = u'atomini'
+
+    scriptsdir = None
+
+    def _geterror(self, renctx):
+        if renctx.errmsg:
+            assert isinstance(renctx.errmsg, unicode)
+            return [node('span', renctx.errmsg, CLASS=self.css_errors),
+                    node('br')]
+        else:
+            return []
+
+    def do_render(self, ofields, action=None, submit=None):
+        # Create the form container.
+        form = self.render_container(action)
+
+        # Create and append the table contained inside.
+        add_children(form, [self.do_render_table(ofields)])
+
+        # Create and append the submit buttons.
+        form.append(self.render_submit(submit))
+
+        # Note: we don't do anything explicit about the scripts and notices.
+
+        # Return the form container.
+        return form
+
+    def do_render_iter(self, ofields, action=None, submit=None):
+        action_url = self.eval_action(action or self._form.action)
+        return self._encode_chunks(self._iter_form(ofields, action_url, submit))
+
+    def _iter_form(self, ofields, action_url, submit):
+        """
+        Serialize the entire form, in the same order as do_render().
+        """
+        form = self.do_render_container(action_url)
+        yield self._start_tag(form)
+        for chunk in self._iter_table(ofields):
+            yield chunk
+        yield self._tostring(
+            self.do_render_submit(submit or self._form.submit,
+                                  self._form.reset))
+        yield self._end_tag(form)
+
+    def do_render_container(self, action_url):
+        form = self._form
+
+        if action_url is None:
+            raise AtochaError('Error: You must specify a non-null action '
+                               'for rendering this form.')
+
+        # Other options.
+        opts = [('id', form.name),
+                ('name', form.name),
+                ('action', action_url),
+                ('method', form.method),]
+        if form.accept_charset is not None:
+            opts.append(('accept-charset', form.accept_charset))
+        if form.enctype is not None:
+            opts.append(('enctype', form.enctype))
+
+        return node('form', **dict(opts))
+
+    def do_render_container_iter(self, action_url):
+        """
+        Serialize the start tag of the form container only.  You need to output
+        close_container() after its contents.
+        """
+        form = self.do_render_container(action_url)
+        return self._encode_chunks([self._start_tag(form)])
+
+    def close_container(self):
+        return u'</form>'
+
+    def do_render_table(self, fields, css_class=None):
+        hidden, visible = [], []
+        for field in fields:
+            rendered = self._render_field(field, field.state)
+            if field.ishidden():
+                hidden.extend(rendered)
+            else:
+                visible.append( (self._label_nodes(field), rendered) )
+
+        # Don't render a table if there are no visible widgets.
+        if visible:
+            return self.do_table(visible, hidden, css_class=css_class)
+        else:
+            return hidden
+
+    def do_render_table_iter(self, fields, css_class=None):
+        return self._encode_chunks(self._iter_table(fields, css_class))
+
+    def _iter_table(self, fields, css_class=None):
+        """
+        Serialize the table for the given fields, one chunk per visible field,
+        without ever building the entire table.  The hidden fields are
+        accumulated and produced after the last row, like in do_render_table().
+        """
+        table = self.table_node(self, css_class)
+
+        hidden = []
+        opened = False
+        for field in fields:
+            rendered = self._render_field(field, field.state)
+            if field.ishidden():
+                hidden.extend(rendered)
+            else:
+                if not opened:
+                    yield self._start_tag(table)
+                    opened = True
+                yield self._tostring(
+                    self.row_node(self, self._label_nodes(field), rendered))
+
+        if hidden:
+            yield ''.join([self._tostring(x) for x in hidden])
+        if opened:
+            yield self._end_tag(table)
+
+    def _label_nodes(self, field):
+        """
+        Returns the label of a visible field, with its required marker.
+        """
+        label = self._get_label(field)
+        if field.isrequired():
+            label = [label, node('span', u'*', CLASS=self.css_required)]
+        return label
+
+    def do_render_submit(self, submit, reset):
+        nodes = []
+        if isinstance(submit, msg_type):
+            nodes.append(node('input', type='submit', value=C_(submit)))
+        else:
+            assert isinstance(submit, (list, tuple))
+            for subvalue, label in submit:
+                assert isinstance(label, msg_type)
+                nodes.append(node('input', type='submit',
+                                  name=subvalue, value=C_(label)))
+        if reset:
+            nodes.append(node('input', type='reset', value=C_(reset)))
+        return node('div', nodes, CLASS=self.css_submit)
+
+    def do_render_submit_iter(self, submit, reset):
+        return self._encode_chunks(
+            [self._tostring(self.do_render_submit(submit, reset))])
+
+    def do_render_scripts(self, scripts):
+        nodes = []
+        if not scripts:
+            return nodes
+
+        scriptsdir = self.scriptsdir or ''
+        for fn, notice in scripts.iteritems():
+            nodes.append( node('script', notice,
+                               language="JavaScript",
+                               src=join(scriptsdir, fn),
+                               type="text/javascript"))
+        return nodes
+
+    #---------------------------------------------------------------------------
+
+    def _input(self, htmltype, field, state, value,
+               checked=False, label=None, varname=None):
+        """
+        Render an html input.
+        """
+        if varname is None:
+            varname = field.varnames[0]
+
+        # Get the constraints, for the main input of the field only.
+        constraints = ()
+        if state is Field.NORMAL and varname == field.varnames[0]:
+            ctype, constraints = self._html5_attributes(field)
+            if ctype is not None and htmltype == 'text':
+                htmltype = ctype
+
+        inpu = node('input', name=varname, type=htmltype, CLASS=field.css_class)
+
+        if value:
+            inpu.set('value', value)
+        if label is not None:
+            inpu.text = label
+
+        assert isinstance(checked, bool)
+        if checked:
+            inpu.set('checked', '1')
+        if getattr(field, 'size', None):
+            inpu.set('size', str(field.size))
+        if getattr(field, 'maxlen', None):
+            inpu.set('maxlength', str(field.maxlen))
+
+        if state is Field.DISABLED:
+            inpu.set('disabled', '1')
+        elif state is Field.READONLY:
+            inpu.set('readonly', '1')
+        else:
+            assert state is Field.NORMAL
+        for name, value in constraints:
+            inpu.set(name, value)
+
+        if getattr(field, 'onchange', None):
+            # Note: we transparently translate to a more portable onclick
+            # callback.
+            inpu.set('onclick', field.onchange)
+
+        return inpu
+
+    def _single(self, htmltype, field, renctx,
+                checked=False, label=None, varname=None):
+        """
+        Render a single field.
+        Returns a list.
+        """
+        return self._geterror(renctx) + \
+               [self._input(htmltype, field,
+                            renctx.state, renctx.rvalue,
+                            checked, label, varname)]
+
+    def _orient(self, field, inputs):
+        """
+        Place the given list of inputs in a small vertical table if necessary.
+        """
+        if field.orient == ORI_VERTICAL:
+            table = node('table', CLASS=self.css_vertical)
+            for i in inputs:
+                table.append(node('tr', node('td', i)))
+            return [table]
+        elif field.orient in (ORI_HORIZONTAL, ORI_RAW):
+            return inputs
+        else:
+            assert False
+
+    def _renderMenu(self, field, renctx, multiple=None, size=None):
+        "Render a SELECT menu. 'rvalue' is expected to be a list of values."
+
+        select = node('select', name=field.varnames[0], CLASS=field.css_class)
+        if size is not None and size > 1:
+            select.set('size', str(field.size))
+        if multiple:
+            select.set('multiple', '1')
+
+        if renctx.state is Field.DISABLED:
+            select.set('disabled', '1')
+        elif renctx.state is Field.READONLY:
+            select.set('readonly', '1')
+        else:
+            assert renctx.state is Field.NORMAL
+            for name, value in self._html5_attributes(field)[1]:
+                select.set(name, value)
+
+        if getattr(field, 'onchange', None):
+            select.set('onchange', field.onchange)
+
+        for vname, label in field.choices:
+            option = node('option', C_(label), value=vname)
+            if vname in renctx.rvalue:
+                option.set('selected', 'selected')
+            select.append(option)
+        return [self._geterror(renctx), select]
+
+    def _script(self, field, renctx, script, noscript=None):
+        "Render a script widget."
+        varname = field.varnames[0]
+        # Note: setting 'name' on a SCRIPT tag is not standard, but it allows us
+        # to render the errors later on.
+        lines = [ node('script', script, name=varname, CLASS=field.css_class) ]
+        # Note: an element without children is false.
+        if noscript is not None:
+            lines.append( node('noscript', noscript, name=varname,
+                               CLASS=field.css_class) )
+        return [self._geterror(renctx)] + lines
+
+    #---------------------------------------------------------------------------
+
+    def renderHidden(self, field, rvalue):
+        inputs = []
+        # Use the first variable name.
+        varname = field.varnames[0]
+
+        if isinstance(rvalue, unicode):
+            inputs.append(
+                node('input', name=varname, type="hidden", value=rvalue))
+
+        elif isinstance(rvalue, bool):
+            inputs.append(
+                node('input', name=varname, type="hidden",
+                     value=rvalue and '1' or '0'))
+
+        elif isinstance(rvalue, list):
+            for rval in rvalue:
+                inputs.append(
+                    node('input', name=varname, type="hidden", value=rval))
+        else:
+            raise AtochaInternalError(
+                "Error: unexpected type '%s' for rendering field '%s'." %
+                (type(rvalue), field.name))
+
+        return inputs
+
+
+
+def renderStringField(rdr, field, renctx):
+    return rdr._single('text', field, renctx)
+
+def renderTextAreaField(rdr, field, renctx):
+    text = node('textarea', renctx.rvalue,
+                name=field.varnames[0],
+                CLASS=field.css_class)
+    if field.rows:
+        text.set('rows', str(field.rows))
+    if field.cols:
+        text.set('cols', str(field.cols))
+
+    if renctx.state is Field.DISABLED:
+        text.set('disabled', '1')
+    elif renctx.state is Field.READONLY:
+        text.set('readonly', '1')
+    else:
+        assert renctx.state is Field.NORMAL
+        if field.maxlen and rdr.constraints:
+            text.set('maxlength', str(field.maxlen))
+        for name, value in rdr._html5_attributes(field)[1]:
+            text.set(name, value)
+
+    return [rdr._geterror(renctx), text]
+
+def renderPasswordField(rdr, field, renctx):
+    return rdr._single('password', field, renctx)
+
+def renderBoolField(rdr, field, renctx):
+    # The render type calls for any value and for the rvalue to determine
+    # whether this will get checked or not.
+    checked, renctx.rvalue = renctx.rvalue, u'1'
+    return rdr._single('checkbox', field, renctx, checked)
+
+def renderRadioField(rdr, field, renctx):
+    assert renctx.rvalue is not None
+    inputs = []
+    for vname, label in field.choices:
+        checked = bool(vname == renctx.rvalue)
+        inputs.append(
+            rdr._input('radio', field, renctx.state,
+                        vname, checked, C_(label)))
+    output = rdr._orient(field, inputs)
+    return [rdr._geterror(renctx)] + output
+
+def renderMenuField(rdr, field, renctx):
+    renctx.rvalue = [renctx.rvalue]
+    return rdr._renderMenu(field, renctx)
+
+def renderCheckboxesField(rdr, field, renctx):
+    inputs = []
+    for vname, label in field.choices:
+        checked = vname in renctx.rvalue
+        inputs.append(
+            rdr._input('checkbox', field, renctx.state,
+                        vname, checked, C_(label)))
+    output = rdr._orient(field, inputs)
+    return [rdr._geterror(renctx)] + output
+
+def renderListboxField(rdr, field, renctx):
+    assert renctx.rvalue is not None
+    if not isinstance(renctx.rvalue, list):
+        renctx.rvalue = [renctx.rvalue] # May be a str if not multiple.
+    return rdr._renderMenu(field, renctx, field.multiple, field.size)
+
+def renderFileUploadField(rdr, field, renctx):
+    return rdr._single('file', field, renctx)
+
+def renderSetFileField(rdr, field, renctx):
+    # The rendered value tells whether the reset checkbox is checked.
+    checked, renctx.rvalue = bool(renctx.rvalue), u''
+    filew = rdr._single('file', field, renctx)
+    renctx.rvalue = u'1'
+    resetw = rdr._single('checkbox', field, renctx,
+                          checked, varname=field.varnames[1])
+    return [filew, C_(field.remlabel), resetw]
+
+def renderJSDateField(rdr, field, renctx):
+    varname = field.varnames[0]
+    fargs = (varname, renctx.rvalue and ", '%s'" % renctx.rvalue or '')
+    script = (u"DateInput('%s', true, 'YYYYMMDD' %s);"
+              u"hideInputs(this);") % fargs
+
+    # We must be able to accept both the string version and the datetime
+    # version because of the different paths of argument parsing... it's
+    # possible that we get asked to render something using values that have
+    # not been parsed previously (for example, during the automated form
+    # parsing errors).
+    noscript = node('input', name=varname, value=renctx.rvalue or '')
+
+    return rdr._script(field, renctx, script, noscript)
+
+
+
+# Register rendering routines.
+EtreeFormRenderer_routines = ((StringField, renderStringField),
+                              (TextAreaField, renderTextAreaField),
+                              (PasswordField, renderPasswordField),
+                              (DateField, renderStringField),
+                              (EmailField, renderStringField),
+                              (URLField, renderStringField),
+                              (IntField, renderStringField),
+                              (FloatField, renderStringField),
+                              (BoolField, renderBoolField),
+                              (AgreeField, renderBoolField),
+                              (RadioField, renderRadioField),
+                              (MenuField, renderMenuField),
+                              (CheckboxesField, renderCheckboxesField),
+                              (ListboxField, renderListboxField),
+                              (FileUploadField, renderFileUploadField),
+                              (SetFileField, renderSetFileField),
+                              (JSDateField, renderJSDateField),
+                              (DateMenuField, renderMenuField),)
+
+for fcls, fun in EtreeFormRenderer_routines:
+    atocha.render.register_render_routine(EtreeFormRenderer, fcls, fun)
+
+
+
+def C_(s):
+    """
+    Conditional gettext, only if the argument is a str.
+    If the argument is a unicode object, do not translate.
+    """
+    if isinstance(s, str):
+        return _(s)
+    return s
@@ -176,25 +176,85 @@ class HoutFormRenderer(HoutRenderer):
 
         return FORM(dict(opts))
 
+    def _static_nodes(self):
+        """
+        Returns a pair of dicts for the nodes that do not depend on the values
+        being rendered (the label cells of the fields and the blocks of submit
+        buttons), which are created once and cached on the form, for this
+        renderer class, language and labels option (if there is a
+        locale_evaluator).
+
+        Note that these nodes are shared between all the renders of the form, so
+        you must not modify them in the trees that are returned.
+        """
+        locale = self.eval_locale()
+        if locale is None:
+            # The nodes contain translated labels, do not cache them.
+            return ({}, {})
+        key = ('static-nodes', self.__class__, locale, self.label_semicolon)
+        return self._form.getcache(key, lambda: ({}, {}))
+
+    def _label_cell(self, labels, field):
+        """
+        Returns the cell for the label of a visible field, from the cache, or
+        create it if the field has been modified since it was cached.
+        """
+        try:
+            version, tdlabel = labels[field.name]
+            if version == field._version:
+                return tdlabel
+        except KeyError:
+            pass
+
+        label = self._get_label(field)
+        if field.isrequired():
+            label = [label, SPAN('*', CLASS=self.css_required)]
+        tdlabel = TD(label, CLASS=self.css_label)
+        if self.label_semicolon:
+            tdlabel.append(':')
+        labels[field.name] = (field._version, tdlabel)
+        return tdlabel
+
     def do_render_table(self, fields, css_class=None):
-        hidden, visible = [], []
+        labels, submits = self._static_nodes()
+
+        hidden, rows = [], []
         for field in fields:
             rendered = self._render_field(field, field.state)
             if field.ishidden():
                 hidden.extend(rendered)
             else:
-                label = self._get_label(field)
-                if field.isrequired():
-                    label = [label, SPAN('*', CLASS=self.css_required)]
-                visible.append( (label, rendered) )
+                rows.append(TR(self._label_cell(labels, field),
+                               TD(rendered, CLASS=self.css_input)))
 
         # Don't render a table if there are no visible widgets.
-        if visible:
-            return self.do_table(visible, hidden, css_class=css_class)
-        else:
+        if not rows:
             return hidden
 
+        css = [self.css_table]
+        if css_class:
+            css.append(css_class)
+        table = TABLE(CLASS=' '.join(css))
+        for row in rows:
+            table.append(row)
+        if hidden:
+            table.append(hidden)
+        return table
+
     def do_render_submit(self, submit, reset):
+        # The submit buttons are usually the same as the form's, cache them.
+        labels, submits = self._static_nodes()
+        if isinstance(submit, list):
+            key = (tuple(submit), reset)
+        else:
+            key = (submit, reset)
+        try:
+            return submits[key]
+        except KeyError:
+            div = submits[key] = self._build_submit(submit, reset)
+            return div
+
+    def _build_submit(self, submit, reset):
         nodes = []
         if isinstance(submit, msg_type):
             nodes.append(INPUT(type='submit', value=C_(submit)))
@@ -231,6 +291,13 @@ class HoutFormRenderer(HoutRenderer):
         if varname is None:
             varname = field.varnames[0]
 
+        # Get the constraints, for the main input of the field only.
+        constraints = ()
+        if state is Field.NORMAL and varname == field.varnames[0]:
+            ctype, constraints = self._html5_attributes(field)
+            if ctype is not None and htmltype == 'text':
+                htmltype = ctype
+
         inpu = INPUT(name=varname, type=htmltype, CLASS=field.css_class)
 
         if value:
@@ -252,6 +319,8 @@ class HoutFormRenderer(HoutRenderer):
             inpu.attrib['readonly'] = '1'
         else:
             assert state is Field.NORMAL
+        for name, value in constraints:
+            inpu.attrib[name] = value
 
         if getattr(field, 'onchange', None):
             # Note: we transparently translate to a more portable onclick
@@ -300,6 +369,8 @@ class HoutFormRenderer(HoutRenderer):
             select.attrib['readonly'] = '1'
         else:
             assert renctx.state is Field.NORMAL
+            for name, value in self._html5_attributes(field)[1]:
+                select.attrib[name] = value
 
         if getattr(field, 'onchange', None):
             select.attrib['onchange'] = field.onchange
@@ -368,6 +439,10 @@ def renderTextAreaField(rdr, field, renctx):
         text.attrib['readonly'] = '1'
     else:
         assert renctx.state is Field.NORMAL
+        if field.maxlen and rdr.constraints:
+            text.attrib['maxlength'] = str(field.maxlen)
+        for name, value in rdr._html5_attributes(field)[1]:
+            text.attrib[name] = value
 
     return [rdr._geterror(renctx), text]
 
@@ -415,8 +490,10 @@ def renderFileUploadField(rdr, field, renctx):
     return rdr._single('file', field, renctx)
 
 def renderSetFileField(rdr, field, renctx):
+    # The rendered value tells whether the reset checkbox is checked.
+    checked, renctx.rvalue = bool(renctx.rvalue), u''
     filew = rdr._single('file', field, renctx)
-    checked, renctx.rvalue = False, u'1'
+    renctx.rvalue = u'1'
     resetw = rdr._single('checkbox', field, renctx,
                           checked, varname=field.varnames[1])
     return [filew, C_(field.remlabel), resetw]
@@ -24,7 +24,7 @@ Simple text-based form renderers.
 """
 
 # stdlib imports
-import StringIO, codecs
+import re, StringIO, cStringIO, codecs, copy
 from os.path import join
 
 # atocha imports
@@ -32,10 +32,109 @@ from atocha import AtochaError, AtochaInternalError
 import atocha.render
 from atocha.field import *
 from atocha.fields import *
-from atocha.messages import msg_type
+from atocha.messages import msg_type, msg_registry
 
 
-__all__ = ('TextFormRenderer', 'TextDisplayRenderer',)
+__all__ = ('TextFormRenderer', 'TextDisplayRenderer', 'FormGridRenderer',
+           'Markup', 'escape_text', 'escape_attr')
+
+
+
+class Markup(unicode):
+    """
+    A unicode string that contains markup that is safe to output as it is.  The
+    text renderers do not escape the values, labels and messages of this type.
+    """
+
+
+_text_specials = re.compile(u'[&<>]')
+_attr_specials = re.compile(u'[&<>"\']')
+
+_text_entities = ((u'&', u'&amp;'), (u'<', u'&lt;'), (u'>', u'&gt;'))
+_attr_entities = _text_entities + ((u'"', u'&quot;'), (u"'", u'&#39;'))
+
+def _encode_entities(entities):
+    return tuple((c.encode('ascii'), e.encode('ascii')) for c, e in entities)
+
+_text_entities_str = _encode_entities(_text_entities)
+_attr_entities_str = _encode_entities(_attr_entities)
+
+def _escape(text, specials, entities, entities_str):
+    if isinstance(text, Markup) or not specials.search(text):
+        # Fast path: return the very same object.
+        return text
+    if not isinstance(text, unicode):
+        entities = entities_str
+    # Note: a replace() per special character is much faster than
+    # unicode.translate() with a table, which matters for large texts.
+    for c, e in entities:
+        text = text.replace(c, e)
+    return text
+
+def escape_text(text):
+    """
+    Escape the HTML special characters of the given text, for output as the
+    contents of an element.  Markup strings and strings without special
+    characters are returned unchanged.
+    """
+    return _escape(text, _text_specials, _text_entities, _text_entities_str)
+
+def escape_attr(text):
+    """
+    Escape the HTML special characters of the given text, for output as the
+    value of an attribute, between quotes.  Markup strings and strings without
+    special characters are returned unchanged.
+    """
+    return _escape(text, _attr_specials, _attr_entities, _attr_entities_str)
+
+def _noescape(text):
+    return text
+
+
+
+class EncodedBuffer:
+    """
+    Output file that encodes the unicode strings that get written to it into a
+    buffer of bytes (or into a given file object).  Strings that are already
+    encoded are written as they are.  We use this rather than the stream
+    writers of the codecs module, because the renderers write many small
+    fragments and most of them have been encoded in advance.  This only works
+    for encodings without state (see is_ascii_compatible()).
+    """
+    def __init__(self, encoding, fp=None):
+        self.encoding = encoding
+        if fp is None:
+            fp = cStringIO.StringIO()
+        self.fp = fp
+
+    def write(self, text):
+        if isinstance(text, unicode):
+            text = text.encode(self.encoding)
+        self.fp.write(text)
+
+    def getvalue(self):
+        return self.fp.getvalue()
+
+
+_ascii_compatible = {}
+
+def is_ascii_compatible(encoding):
+    """
+    Returns true if strings of ASCII characters are encoded to themselves in the
+    given encoding.  Such strings can then be output without conversion, and
+    separately encoded fragments can be concatenated (this is not the case for
+    UTF-16, for example, because of the byte-order mark).
+    """
+    try:
+        return _ascii_compatible[encoding]
+    except KeyError:
+        chars = ''.join(map(chr, xrange(128)))
+        try:
+            compat = chars.decode('ascii').encode(encoding) == chars
+        except UnicodeError:
+            compat = False
+        _ascii_compatible[encoding] = compat
+        return compat
 
 
 
@@ -55,6 +154,10 @@ class TextRenderer(atocha.render.FormRenderer):
     # Default value.
     label_semicolon = False
 
+    # Whether the values, labels and messages get escaped on output.  You
+    # should only disable this if you escape them yourself.
+    autoescape = True
+
     def __init__(self, *args, **kwds):
         """
         Grab the encoding parameter on top of the basic form renderer
@@ -64,10 +167,23 @@ class TextRenderer(atocha.render.FormRenderer):
         self.outenc = kwds.pop('output_encoding', self.default_encoding)
         """Encoding for output strings produced by this renderer."""
 
+        self._preenc = None
+        """The output encoding, if the static fragments can be encoded in
+        advance and written without conversion."""
+        if self.outenc is not None and is_ascii_compatible(self.outenc):
+            self._preenc = self.outenc
+
         self.label_semicolon = kwds.pop('labelsemi',
                                         TextRenderer.label_semicolon)
         """Whether we automatically add a semicolon to the labels or not."""
 
+        self.autoescape = kwds.pop('autoescape', self.autoescape)
+        """Whether we escape the text that we output, see escape_text()."""
+        if self.autoescape:
+            self._esc, self._escattr = escape_text, escape_attr
+        else:
+            self._esc = self._escattr = _noescape
+
         self.ofile = None
         """Output file object."""
 
@@ -78,12 +194,49 @@ class TextRenderer(atocha.render.FormRenderer):
         """
         Create the default file for output.
         """
+        if self._preenc is not None:
+            return EncodedBuffer(self._preenc)
         sio = StringIO.StringIO()
         if self.outenc is not None:
             Writer = codecs.getwriter(self.outenc)
             sio = Writer(sio)
         return sio
 
+    def _get_label(self, field):
+        return self._esc(atocha.render.FormRenderer._get_label(self, field))
+
+    def _encode(self, text):
+        """
+        Convert the given unicode text to the output encoding, if it can be
+        encoded in advance.
+        """
+        if self._preenc is None:
+            return text
+        return text.encode(self._preenc)
+
+    def encode(self, text):
+        """
+        Convert the given unicode text to the type of the fragments of this
+        renderer: it is encoded to the output encoding if it can be encoded in
+        advance, and is returned unchanged otherwise, to be given to
+        encode_chunks() with the other fragments.
+        """
+        return self._encode(text)
+
+    def encode_chunks(self, chunks):
+        """
+        Returns an iterator over the given chunks encoded to the output
+        encoding, for the chunks that have not been encoded in advance.
+        """
+        if self.outenc is None or self._preenc is not None:
+            return chunks
+        return self._encode_stateful(chunks)
+
+    def _encode_stateful(self, chunks):
+        encoder = codecs.getincrementalencoder(self.outenc)()
+        for chunk in chunks:
+            yield encoder.encode(chunk)
+
     def do_table(self, pairs=(), extra=None, css_class=None):
         """
         Implementation of instance method version of table().
@@ -99,14 +252,16 @@ class TextRenderer(atocha.render.FormRenderer):
         """
         Class method version of table().
         """
-        sio = StringIO.StringIO()
-        if outenc is not None:
-            Writer = codecs.getwriter(self.outenc)
-            sio = Writer(sio)
+        if outenc is None:
+            f = StringIO.StringIO()
+        elif is_ascii_compatible(outenc):
+            f = EncodedBuffer(outenc)
+        else:
+            f = codecs.getwriter(outenc)(StringIO.StringIO())
 
         cls.do_table_imp(cls, pairs, extra, css_class, f)
 
-        return sio.getvalue()
+        return f.getvalue()
 
     do_ctable = classmethod(do_ctable)
 
@@ -155,11 +310,83 @@ class TextFormRenderer(TextRenderer):
 
     scriptsdir = None
 
+    def compile(self):
+        """
+        Returns the skeleton of pre-rendered static fragments for the form of
+        this renderer (see class FormSkeleton).  The skeleton is computed once
+        and cached on the form for this renderer class, language, labels option
+        and output encoding, so that rendering a form only has to fill in the
+        inputs.  The fragments are encoded in advance if there is an output
+        encoding.  The skeleton contains the translated labels, so it is not
+        cached if there is no locale_evaluator.
+        """
+        locale = self.eval_locale()
+        if locale is None:
+            return self._build_skeleton()
+        key = ('skeleton', self.__class__,
+               locale, self.label_semicolon, self._preenc,
+               self.autoescape)
+        return self._form.getcache(key, self._build_skeleton)
+
+    def _build_skeleton(self):
+        """
+        Create a new skeleton for the form of this renderer.
+        """
+        form = self._form
+        skel = FormSkeleton()
+
+        # Other options, the action is rendered between the head and tail.
+        opts = [('method', form.method)]
+        if form.accept_charset is not None:
+            opts.append(('accept-charset', form.accept_charset))
+        if form.enctype is not None:
+            opts.append(('enctype', form.enctype))
+
+        opts = ' '.join(['%s="%s"' % x for x in opts])
+        enc = self._encode
+        skel.container = (
+            enc(('<form id="%s" name="%s" action="' %
+                 (form.name, form.name)).decode('ascii')),
+            enc(u'" %s>\n' % opts.decode('ascii')))
+
+        skel.table_open = enc(u'<table class=%s>' % self.css_table)
+        skel.row_close = enc(skel.row_close)
+        skel.table_close = enc(skel.table_close)
+        skel.empty = enc(skel.empty)
+
+        # Whether the action URL can be output without conversion.
+        skel.ascii_action = self._preenc is not None
+        return skel
+
+    def _row_prefix(self, skel, field):
+        """
+        Returns the fragment that comes before the inputs of a visible field in
+        a table, computing it if the field has been modified since it was
+        cached in the skeleton.
+        """
+        try:
+            version, prefix = skel.rows[field.name]
+            if version == field._version:
+                return prefix
+        except KeyError:
+            pass
+
+        label = self._get_label(field)
+        if field.isrequired():
+            label += u'<span class="%s">*</span>' % self.css_required
+        if self.label_semicolon:
+            label += ':'
+        prefix = self._encode((u'<tr><td class="%s">%s</td>\n'
+                               u'    <td class="%s">') %
+                              (self.css_label, label, self.css_input))
+        skel.rows[field.name] = (field._version, prefix)
+        return prefix
+
     def _geterror(self, renctx):
         if renctx.errmsg:
             assert isinstance(renctx.errmsg, unicode)
             return (u'<span class="%s">%s</span><br/>' %
-                    (self.css_errors, renctx.errmsg))
+                    (self.css_errors, self._esc(renctx.errmsg)))
         else:
             return u''
 
@@ -188,69 +415,146 @@ class TextFormRenderer(TextRenderer):
         # Return the string for the entire form.
         return f.getvalue()
 
+    def do_render_iter(self, ofields, action=None, submit=None):
+        action_url = self.eval_action(action or self._form.action)
+        return self.encode_chunks(self._iter_form(ofields, action_url, submit))
+
+    def _iter_form(self, ofields, action_url, submit):
+        """
+        Generate the entire form, in the same order as do_render().
+        """
+        for chunk in self._iter_container(action_url):
+            yield chunk
+        for chunk in self._iter_table(ofields):
+            yield chunk
+        yield self._submit_block(submit or self._form.submit, self._form.reset)
+        yield self._encode(self.close_container())
+
 
     def do_render_container(self, action_url):
         # Use side-effect for efficiency if requested.
         f = self.ofile or self._create_buffer()
-        form = self._form
 
+        for chunk in self._iter_container(action_url):
+            f.write(chunk)
+
+        if self.ofile is None: return f.getvalue()
+
+    def do_render_container_iter(self, action_url):
+        return self.encode_chunks(self._iter_container(action_url))
+
+    def _iter_container(self, action_url):
         if action_url is None:
             raise AtochaError('Error: You must specify a non-null action '
                                'for rendering this form.')
 
-        # Other options.
-        opts = [('id', form.name),
-                ('name', form.name),
-                ('action', action_url),
-                ('method', form.method),]
-        if form.accept_charset is not None:
-            opts.append(('accept-charset', form.accept_charset))
-        if form.enctype is not None:
-            opts.append(('enctype', form.enctype))
-
-        f.write(u'<form %s>\n' %
-                ' '.join(['%s="%s"' % x for x in opts]).decode('ascii'))
-
-        if self.ofile is None: return f.getvalue()
+        skel = self.compile()
+        head, tail = skel.container
+        if isinstance(action_url, unicode):
+            action = self._encode(action_url)
+        elif skel.ascii_action:
+            action = action_url
+        else:
+            action = self._encode(action_url.decode('ascii'))
+        yield skel.empty.join((head, action, tail))
 
     def close_container(self):
         return u'</form>'
 
     def do_render_table(self, fields, css_class=None):
-        hidden, visible = [], []
+        # Render all the fields before producing any output.
+        chunks = list(self._iter_table(fields, css_class))
+
+        # Use side-effect for efficiency if requested.
+        f = self.ofile or self._create_buffer()
+        for chunk in chunks:
+            f.write(chunk)
+
+        if self.ofile is None: return f.getvalue()
+
+    def do_render_table_iter(self, fields, css_class=None):
+        return self.encode_chunks(self._iter_table(fields, css_class))
+
+    def _iter_table(self, fields, css_class=None):
+        """
+        Generate the table for the given fields, one chunk per visible field.
+        The hidden fields are accumulated and produced after the last row.
+        """
+        skel = self.compile()
+
+        if css_class:
+            yield self._encode(u'<table class=%s>' %
+                               ' '.join([self.css_table, css_class]))
+        else:
+            yield skel.table_open
+
+        hidden = []
         for field in fields:
             rendered = self._render_field(field, field.state)
             if field.ishidden():
                 hidden.append(rendered)
             else:
-                label = self._get_label(field)
-                if field.isrequired():
-                    label += u'<span class="%s">*</span>' % self.css_required
-                visible.append( (label, rendered) )
-
-        value = self.do_table(visible, u'\n'.join(hidden), css_class=css_class)
+                assert isinstance(rendered, unicode)
+                yield skel.empty.join((self._row_prefix(skel, field),
+                                       self._encode(rendered),
+                                       skel.row_close))
 
-        return value
+        extra = u'\n'.join(hidden)
+        if extra:
+            yield self._encode(extra + u'\n')
+        yield skel.table_close
 
     def do_render_submit(self, submit, reset):
         # Use side-effect for efficiency if requested.
         f = self.ofile or self._create_buffer()
-        f.write(u'<div class="%s">\n' % self.css_submit)
+        f.write(self._submit_block(submit, reset))
+
+        if self.ofile is None: return f.getvalue()
+
+    def do_render_submit_iter(self, submit, reset):
+        return self.encode_chunks([self._submit_block(submit, reset)])
+
+    def _submit_block(self, submit, reset):
+        """
+        Returns the rendered block of submit buttons.
+        """
+        # Submit buttons are usually the same as the form's, cache them.
+        if isinstance(submit, list):
+            key = (tuple(submit), reset)
+        else:
+            key = (submit, reset)
+        skel = self.compile()
+        try:
+            return skel.submits[key]
+        except KeyError:
+            block = skel.submits[key] = self._encode(
+                self._build_submit(submit, reset))
+            return block
+
+    def _build_submit(self, submit, reset):
+        """
+        Render the block of submit buttons.
+        """
+        esc = self._escattr
+        lines = [u'<div class="%s">\n' % self.css_submit]
 
         if isinstance(submit, msg_type):
-            f.write(u'<input type="submit" value="%s" />\n' % (C_(submit)))
+            lines.append(u'<input type="submit" value="%s" />\n' %
+                         esc(C_(submit)))
         else:
             assert isinstance(submit, (list, tuple))
             for subvalue, label in submit:
                 assert isinstance(label, msg_type)
-                f.write((u'<input type="submit" name="%s" value="%s" />\n') %
-                        (subvalue, C_(label)))
+                lines.append(
+                    u'<input type="submit" name="%s" value="%s" />\n' %
+                    (subvalue, esc(C_(label))))
 
         if reset:
-            f.write(u'<input type="reset" value="%s" />\n' % C_(reset))
+            lines.append(u'<input type="reset" value="%s" />\n' %
+                         esc(C_(reset)))
 
-        f.write(u'</div>\n')
-        if self.ofile is None: return f.getvalue()
+        lines.append(u'</div>\n')
+        return u''.join(lines)
 
     def do_render_scripts(self, scripts):
         if not scripts:
@@ -275,17 +579,47 @@ class TextFormRenderer(TextRenderer):
         """
         Render an html input.
         """
+        assert isinstance(checked, bool)
+        key = ('input', self.__class__, htmltype, state,
+               varname or field.varnames[0], self.constraints)
+        try:
+            head, tail = field._caches[key]
+        except KeyError:
+            head, tail = field._caches[key] = \
+                         self._input_attributes(htmltype, field, state, varname)
+
+        o = head
+        if checked:
+            o += u' checked="1"'
+        o += tail
+        if value:
+            o += u' value="%s"' % self._escattr(value)
+        if label is not None:
+            o += u'>%s</input>' % self._esc(label)
+        else:
+            o += u'/>'
+        return o
+
+    def _input_attributes(self, htmltype, field, state, varname):
+        """
+        Returns the static parts of an html input, before and after the
+        'checked' attribute, which only depend on the field definition.
+        """
         if varname is None:
             varname = field.varnames[0]
 
-        opts = [('name', varname),
+        # Get the constraints, for the main input of the field only.
+        constraints = ()
+        if state is Field.NORMAL and varname == field.varnames[0]:
+            ctype, constraints = self._html5_attributes(field)
+            if ctype is not None and htmltype == 'text':
+                htmltype = ctype
+
+        head = [('name', varname),
                 ('type', htmltype),
                 ('class', field.css_class),]
 
-        assert isinstance(checked, bool)
-        if checked:
-            opts.append( ('checked', '1') )
-
+        opts = []
         if getattr(field, 'size', None):
             opts.append( ('size', field.size) )
         if getattr(field, 'maxlen', None):
@@ -297,20 +631,17 @@ class TextFormRenderer(TextRenderer):
             opts.append( ('readonly', '1') )
         else:
             assert state is Field.NORMAL
+        opts.extend(constraints)
 
         if getattr(field, 'onchange', None):
             # Note: we transparently translate to a more portable onclick
             # callback.
             opts.append( ('onclick', field.onchange) )
 
-        o = u'<input ' + ' '.join(['%s="%s"' % x for x in opts]).decode('ascii')
-        if value:
-            o += u' value="%s"' % value
-        if label is not None:
-            o += u'>%s</input>' % label
-        else:
-            o += u'/>'
-        return o
+        head = ('<input ' + ' '.join(['%s="%s"' % x
+                                      for x in head])).decode('ascii')
+        tail = ''.join([' %s="%s"' % x for x in opts]).decode('ascii')
+        return head, tail
 
     def _single(self, htmltype, field, renctx,
                 checked=False, label=None, varname=None):
@@ -341,34 +672,105 @@ class TextFormRenderer(TextRenderer):
     def _renderMenu(self, field, renctx, multiple=None, size=None):
         "Render a SELECT menu. 'rvalue' is expected to be a list of values."
 
+        key = ('select', self.__class__, field.varnames[0], renctx.state,
+               multiple, size, self.constraints)
+        try:
+            opening = field._caches[key]
+        except KeyError:
+            opening = field._caches[key] = \
+                      self._select_opening(field, renctx.state, multiple, size)
+
+        lines = [opening]
+        if field.choices:
+            choices = self._choices(field, 'option', None)
+            lines.append(choices.splice(renctx.rvalue))
+        lines.append(u'</select>')
+        return self._geterror(renctx) + u'\n'.join(lines)
+
+    def _select_opening(self, field, state, multiple, size):
+        """
+        Returns the opening tag of a SELECT menu.
+        """
         selopts = []
         if size is not None and size > 1:
             selopts.append('size="%d"' % field.size)
         if multiple:
             selopts.append('multiple="1"')
 
-        if renctx.state is Field.DISABLED:
+        if state is Field.DISABLED:
             selopts.append( ('disabled="1"') )
-        elif renctx.state is Field.READONLY:
+        elif state is Field.READONLY:
             selopts.append( ('readonly="1"') )
         else:
-            assert renctx.state is Field.NORMAL
+            assert state is Field.NORMAL
+            selopts.extend(['%s="%s"' % x
+                            for x in self._html5_attributes(field)[1]])
 
         if getattr(field, 'onchange', None):
-            selopts.append( ('onchange', field.onchange) )
-
-        lines = []
-        lines.append(
-            u'<select name="%s" %s class="%s">' %
-            (field.varnames[0], ' '.join(selopts), field.css_class))
-        for vname, label in field.choices:
-            selstr = u''
-            if vname in renctx.rvalue:
-                selstr = u'selected="selected"'
-            lines.append(u'<option value="%s" %s>%s</option>' %
-                         (vname, selstr, C_(label)))
-        lines.append(u'</select>')
-        return self._geterror(renctx) + u'\n'.join(lines)
+            selopts.append('onchange="%s"' % field.onchange)
+
+        return ('<select name="%s" %s class="%s">' %
+                (field.varnames[0], ' '.join(selopts),
+                 field.css_class)).decode('ascii')
+
+    def _choices(self, field, htmltype, state):
+        """
+        Returns the rendered list of the choices of a multiple field, as a
+        ChoicesFragment.  'htmltype' is 'option' for the options of a menu, or
+        the type of the inputs to render otherwise.  This is cached on the
+        field for the renderer class, language and state of the field, and gets
+        invalidated when the choices are changed.  The labels of the choices
+        are translated, so this is not cached if there is no locale_evaluator.
+
+        Note that the inputs contain the variable name of the field, but the
+        cache key does not: the choices are spliced with the current variable
+        name of the field (see FormGridRenderer).
+        """
+        locale = self.eval_locale()
+        key = (htmltype, self.__class__, locale, state,
+               self.autoescape, self.constraints)
+        try:
+            return field._caches[key]
+        except KeyError:
+            pass
+
+        unselected, selected, index = [], [], {}
+        for i, (value, label) in enumerate(field.choices):
+            label = C_(label)
+            vname = value
+            if isinstance(vname, str):
+                vname = vname.decode('ascii')
+            if htmltype == 'option':
+                opt = u'<option value="%s" %s>%s</option>'
+                vname, label = self._escattr(vname), self._esc(label)
+                unselected.append(opt % (vname, u'', label))
+                selected.append(opt % (vname, u'selected="selected"', label))
+            else:
+                unselected.append(self._input(htmltype, field, state,
+                                              vname, False, label))
+                selected.append(self._input(htmltype, field, state,
+                                            vname, True, label))
+            index.setdefault(value, []).append(i)
+
+        if htmltype == 'option':
+            block = u'\n'.join(unselected)
+        else:
+            block = self._orient(field, unselected)
+
+        # Find the position of each of the choices within the list.
+        offsets, pos = [], 0
+        for frag in unselected:
+            start = block.index(frag, pos)
+            pos = start + len(frag)
+            offsets.append( (start, pos) )
+
+        varname = None
+        if htmltype != 'option':
+            varname = field.varnames[0]
+        choices = ChoicesFragment(block, offsets, selected, index, varname)
+        if locale is not None:
+            field._caches[key] = choices
+        return choices
 
     def _script(self, field, renctx, script, noscript=None):
         """
@@ -398,11 +800,11 @@ class TextFormRenderer(TextRenderer):
 
         if isinstance(rvalue, unicode):
             inputs.append(u'<input name="%s" type="hidden" value="%s" />' %
-                          (varname.decode('ascii'), rvalue))
+                          (varname.decode('ascii'), self._escattr(rvalue)))
         elif isinstance(rvalue, list):
             for rval in rvalue:
                 inputs.append(u'<input name="%s" type="hidden" value="%s" />' %
-                              (varname.decode('ascii'), rval))
+                              (varname.decode('ascii'), self._escattr(rval)))
         else:
             raise AtochaInternalError(
                 "Error: unexpected type '%s' for rendering." % type(rvalue))
@@ -410,28 +812,304 @@ class TextFormRenderer(TextRenderer):
         return u'\n'.join(inputs)
 
 
+
+class FormGridRenderer(TextFormRenderer):
+    """
+    Form renderer that renders the same form for many records, in a single
+    table, with one row per record and one column per visible field.  The
+    variable names of the inputs are suffixed with the index of their row, e.g.
+    'name_0', 'name_1', etc.  Use FormParser.parse_grid() to parse the
+    submitted arguments back into a list of records.
+
+    The 'rows' argument is an iterable of dicts of values, or of (values,
+    errors) pairs.  It is only iterated over once, while rendering, so it can
+    be a generator.  The static fragments of the table and of the fields are
+    shared between the rows (only the fragments that contain the variable names
+    are rebuilt for each row), and render_iter() produces one chunk per row.
+
+    Note that the completeness of the rendering is not checked for this
+    renderer.
+    """
+
+    css_grid = u'atogrid'
+
+    def __init__(self, form, rows, *args, **kwds):
+        kwds['incomplete'] = True
+        TextFormRenderer.__init__(self, form, None, None, *args, **kwds)
+
+        self._rows = rows
+        "The iterable of values or (values, errors) pairs for each row."
+
+        self._grid_locale = None
+        """A key for the language while the rows are being rendered, if there
+        is no locale_evaluator (see eval_locale())."""
+
+    def eval_locale(self):
+        """
+        The language does not change while the rows are rendered, so the fields
+        of the grid, which are only used for one render, can cache their
+        translated choices even if there is no locale_evaluator.
+        """
+        locale = TextFormRenderer.eval_locale(self)
+        if locale is None:
+            locale = self._grid_locale
+        return locale
+
+    def fingerprint(self, *args, **kwds):
+        """
+        The rows can only be iterated over once, so the output of this renderer
+        cannot be fingerprinted.
+        """
+        raise AtochaError("Error: The output of a grid cannot be fingerprinted.")
+
+    def do_render(self, ofields, action=None, submit=None):
+        f = self._create_buffer()
+        for chunk in self._iter_form(ofields,
+                                     self.eval_action(action or
+                                                      self._form.action),
+                                     submit):
+            f.write(chunk)
+        return f.getvalue()
+
+    def do_render_table(self, fields, css_class=None):
+        f = self.ofile or self._create_buffer()
+        for chunk in self._iter_table(fields, css_class):
+            f.write(chunk)
+
+        if self.ofile is None: return f.getvalue()
+
+    def _iter_table(self, fields, css_class=None):
+        """
+        Generate the table, one chunk per row.
+        """
+        skel = self.compile()
+        enc = self._encode
+        if TextFormRenderer.eval_locale(self) is None:
+            self._grid_locale = object()
+
+        # Render copies of the fields, to which we give the variable names of
+        # each row.  The copies have their own caches (see Field.__getstate__),
+        # which keep the fragments that do not depend on the variable names,
+        # e.g. the lists of choices, for all the rows.  The fragments keyed by
+        # the variable names of the previous row are dropped.
+        visible, hidden, proxies = [], [], []
+        for field in fields:
+            proxy = copy.copy(field)
+            proxies.append( (proxy, field.varnames) )
+            if field.ishidden():
+                hidden.append(proxy)
+            else:
+                visible.append(proxy)
+
+        css = [self.css_table, self.css_grid]
+        if css_class:
+            css.append(css_class)
+        header = [u'<table class="%s">\n<tr>' % u' '.join(css)]
+        for field in visible:
+            header.append(u'<th class="%s">%s</th>' %
+                          (self.css_label, self._get_label(field)))
+        if hidden:
+            header.append(u'<th></th>')
+        header.append(u'</tr>\n')
+        yield enc(u''.join(header))
+
+        cell_open = u'<td class="%s">' % self.css_input
+        for index, row in enumerate(self._rows):
+            if isinstance(row, tuple):
+                self._values, self._errors = row
+            else:
+                self._values, self._errors = row, None
+            if self._rendered is not None:
+                self._rendered[:] = bytearray(len(self._rendered))
+
+            suffix = '_%d' % index
+            for proxy, varnames in proxies:
+                caches, old = proxy._caches, proxy.varnames
+                for key in [k for k in caches if isinstance(k, tuple)]:
+                    for name in old:
+                        if name in key:
+                            del caches[key]
+                            break
+                proxy.varnames = [x + suffix for x in varnames]
+
+            cells = [u'<tr>']
+            for field in visible:
+                cells.append(cell_open)
+                cells.append(self._render_field(field, field.state))
+                cells.append(u'</td>')
+            if hidden:
+                cells.append(u'<td>')
+                for field in hidden:
+                    cells.append(self._render_field(field, field.state))
+                cells.append(u'</td>')
+            cells.append(u'</tr>\n')
+            yield enc(u''.join(cells))
+
+        self._values = self._errors = None
+        self._grid_locale = None
+        yield skel.table_close
+
+
+
+class FormSkeleton:
+    """
+    The static parts of the rendering of a form, joined in advance.  Renders of
+    a form then consist in writing these fragments around the slots, that is,
+    the action and the inputs for the field values and errors.  All the
+    fragments are encoded in the output encoding of the renderer, if it has
+    one that allows it (see is_ascii_compatible()).
+
+    Instances of this class are created and cached by
+    TextFormRenderer.compile()
+    """
+    def __init__(self):
+
+        self.container = None
+        """The (head, tail) pair of fragments of the form tag, which go around
+        the action."""
+
+        self.table_open = None
+        "The opening tag of the table, without a custom CSS class."
+
+        self.row_close = u'</td></tr>\n'
+        "The fragment that closes the row of a visible field."
+
+        self.table_close = u'</table>\n'
+        "The closing tag of the table."
+
+        self.empty = u''
+        "An empty fragment, for joining the others."
+
+        self.ascii_action = False
+        """True if an ASCII str action URL can be output as it is, i.e. if the
+        output encoding is compatible with ASCII.  Unicode actions are always
+        encoded."""
+
+        self.rows = {}
+        """A dict of field names to (field version, prefix) pairs, where the
+        prefix is the fragment that comes before the inputs in the table, with
+        the label cell.  The rows are filled in lazily."""
+
+        self.submits = {}
+        """A dict of (submit, reset) pairs to the block of submit buttons."""
+
+
+
+class ChoicesFragment:
+    """
+    The rendered list of the choices of a multiple field, with none of them
+    selected, and the alternate fragments to use for the choices that are
+    selected.  Rendering the field then only consists in splicing these in.
+    """
+    def __init__(self, block, offsets, selected, index, varname=None):
+
+        self.block = block
+        "The rendered list of choices, with none of them selected."
+
+        self.offsets = offsets
+        "A list of the (start, end) positions of each choice in the block."
+
+        self.selected = selected
+        "A list of the fragments for each choice when it is selected."
+
+        self.index = index
+        "A dict of choice values to the list of their indices."
+
+        self.varname = varname
+        """The variable name at the start of each choice, if they are inputs
+        (the options of a menu have none)."""
+
+        self._pieces = None
+        """The pieces of the block between the name attributes of the inputs,
+        computed when the choices are first spliced with another name."""
+
+    def splice(self, values, varname=None):
+        """
+        Returns the list of choices with the given values selected.  Values that
+        are not among the choices are ignored.  If 'varname' is given, the
+        inputs are renamed to it.
+        """
+        indices = set()
+        for value in values:
+            indices.update(self.index.get(value, ()))
+        if varname is not None and varname != self.varname:
+            return self._splice_renamed(indices, varname)
+        if not indices:
+            return self.block
+
+        block, parts, pos = self.block, [], 0
+        for i in sorted(indices):
+            start, end = self.offsets[i]
+            parts.append(block[pos:start])
+            parts.append(self.selected[i])
+            pos = end
+        parts.append(block[pos:])
+        return u''.join(parts)
+
+    def _splice_renamed(self, indices, varname):
+        """
+        Splice the choices at the given indices, with the name attribute at the
+        start of each input replaced, which cannot affect the values and labels.
+        """
+        head = ('<input name="%s"' % self.varname).decode('ascii')
+        n = len(head)
+        if self._pieces is None:
+            block, pieces, pos = self.block, [], 0
+            for start, end in self.offsets:
+                assert block.startswith(head, start)
+                pieces.append(block[pos:start])
+                pos = start + n
+            pieces.append(block[pos:])
+            self._pieces = pieces
+
+        pieces = self._pieces
+        if indices:
+            pieces = list(pieces)
+            for i in indices:
+                start, end = self.offsets[i]
+                pieces[i+1] = self.selected[i][n:] + pieces[i+1][end-start-n:]
+        return ('<input name="%s"' % varname).decode('ascii').join(pieces)
+
+
+
 def renderStringField(rdr, field, renctx):
     return rdr._single('text', field, renctx)
 
 def renderTextAreaField(rdr, field, renctx):
+    key = ('textarea', rdr.__class__, field.varnames[0], renctx.state,
+           rdr.constraints)
+    try:
+        opening = field._caches[key]
+    except KeyError:
+        opening = field._caches[key] = _textarea_opening(rdr, field,
+                                                         renctx.state)
+    return (rdr._geterror(renctx) + opening +
+            rdr._esc(renctx.rvalue or u'') + u'</textarea>')
+
+def _textarea_opening(rdr, field, state):
+    """
+    Returns the opening tag of a TEXTAREA.
+    """
     opts = []
     if field.rows:
         opts.append( ('rows', field.rows) )
     if field.cols:
         opts.append( ('cols', field.cols) )
 
-    if renctx.state is Field.DISABLED:
+    if state is Field.DISABLED:
         opts.append( ('disabled', 1) )
-    elif renctx.state is Field.READONLY:
+    elif state is Field.READONLY:
         opts.append( ('readonly', 1) )
     else:
-        assert renctx.state is Field.NORMAL
+        assert state is Field.NORMAL
+        if field.maxlen and rdr.constraints:
+            opts.append( ('maxlength', field.maxlen) )
+        opts.extend(rdr._html5_attributes(field)[1])
 
-    return (rdr._geterror(renctx) +
-            u'<textarea name="%s" %s class="%s">%s</textarea>' %
+    return (u'<textarea name="%s" %s class="%s">' %
             (field.varnames[0].decode('ascii'),
-             ' '.join(['%s="%d"' % x for x in opts]).decode('ascii'),
-             field.css_class.decode('ascii'), renctx.rvalue or u''))
+             ' '.join(['%s="%s"' % x for x in opts]).decode('ascii'),
+             field.css_class.decode('ascii')))
 
 def renderPasswordField(rdr, field, renctx):
     return rdr._single('password', field, renctx)
@@ -444,28 +1122,18 @@ def renderBoolField(rdr, field, renctx):
 
 def renderRadioField(rdr, field, renctx):
     assert renctx.rvalue is not None
-    inputs = []
-    for vname, label in field.choices:
-        checked = bool(vname == renctx.rvalue)
-        inputs.append(
-            rdr._input('radio', field, renctx.state,
-                        vname, checked, C_(label)))
-    output = rdr._orient(field, inputs)
-    return rdr._geterror(renctx) + output
+    choices = rdr._choices(field, 'radio', renctx.state)
+    return rdr._geterror(renctx) + choices.splice([renctx.rvalue],
+                                                  field.varnames[0])
 
 def renderMenuField(rdr, field, renctx):
     renctx.rvalue = [renctx.rvalue]
     return rdr._renderMenu(field, renctx)
 
 def renderCheckboxesField(rdr, field, renctx):
-    inputs = []
-    for vname, label in field.choices:
-        checked = vname in renctx.rvalue
-        inputs.append(
-            rdr._input('checkbox', field, renctx.state,
-                        vname, checked, C_(label)))
-    output = rdr._orient(field, inputs)
-    return rdr._geterror(renctx) + output
+    choices = rdr._choices(field, 'checkbox', renctx.state)
+    return rdr._geterror(renctx) + choices.splice(renctx.rvalue,
+                                                  field.varnames[0])
 
 def renderListboxField(rdr, field, renctx):
     assert renctx.rvalue is not None
@@ -477,11 +1145,14 @@ def renderFileUploadField(rdr, field, renctx):
     return rdr._single('file', field, renctx)
 
 def renderSetFileField(rdr, field, renctx):
+    # The rendered value tells whether the reset checkbox is checked.
+    checked, renctx.rvalue = bool(renctx.rvalue), u''
     filew = rdr._single('file', field, renctx)
-    checked, renctx.rvalue = renctx.rvalue, u'1'
+    renctx.rvalue = u'1'
     resetw = rdr._single('checkbox', field, renctx,
                           checked, varname=field.varnames[1])
-    return u'\n'.join([filew, '&nbsp;' + C_(field.remlabel) + resetw])
+    return u'\n'.join([filew,
+                       '&nbsp;' + rdr._esc(C_(field.remlabel)) + resetw])
 
 def renderJSDateField(rdr, field, renctx):
     varname = field.varnames[0]
@@ -495,7 +1166,7 @@ def renderJSDateField(rdr, field, renctx):
     # not been parsed previously (for example, during the automated form
     # parsing errors).
     noscript = (u'<input name="%s" value="%s"/>' %
-                (varname, renctx.rvalue or ''))
+                (varname, rdr._escattr(renctx.rvalue or u'')))
 
     return rdr._script(field, renctx, script, noscript)
 
@@ -541,11 +1212,185 @@ class TextDisplayRenderer(TextRenderer, atocha.render.DisplayRendererBase):
     # CSS classes.
     css_label = u'atodlbl'
     css_input = u'atodval'
+    css_report = u'atoreport'
+
+    # Types of fields whose displayed values are memoized in reports, because
+    # they usually have few distinct values.
+    report_memo_types = (BoolField, AgreeField, RadioField, MenuField,
+                         CheckboxesField, ListboxField, DateField,
+                         DateMenuField)
+
+    # Maximum number of memoized values per column in reports.
+    report_memo_size = 256
 
     def __init__(self, *args, **kwds):
         atocha.render.DisplayRendererBase.__init__(self, kwds)
         TextRenderer.__init__(self, *args, **kwds)
 
+    def render_report(self, records, only=None, ignore=None, css_class=None):
+        """
+        Render many records of values for the form as a single table, with a
+        header row of the labels of the fields, and one row per record.
+        'records' is an iterable of dicts of values, which is iterated over only
+        once.  See the documentation for method Form.select_fields() for the
+        meaning of the 'only' and 'ignore' arguments.
+
+        The labels and rendering routines are computed once, and for the fields
+        that have few distinct values (see report_memo_types) the displayed
+        values are memoized, in tables of bounded size.  The values and errors
+        of the renderer itself are not used.
+        """
+        f = self._create_buffer()
+        for chunk in self.render_report_iter(records, only, ignore, css_class):
+            f.write(chunk)
+        return f.getvalue()
+
+    def render_report_iter(self, records, only=None, ignore=None,
+                           css_class=None):
+        """
+        Iterator version of render_report(), which produces one chunk per
+        record.  Use this for reports of unbounded size.
+        """
+        ofields = self._form.select_fields(only, ignore)
+        return self.encode_chunks(self._iter_report(ofields, records,
+                                                     css_class))
+
+    def _iter_report(self, ofields, records, css_class):
+        columns = self._report_columns(ofields)
+        yield self.report_header(columns, css_class)
+        for chunk in self.report_rows(columns, records):
+            yield chunk
+        yield self.report_footer()
+
+        # The report counts as a rendering of the selected fields.
+        if self._rendered is not None:
+            self.ignore(*[field.name for field in ofields])
+
+    #---------------------------------------------------------------------------
+    # The parts of a report, for the code that assembles its own reports (e.g.
+    # the bulk and CSV import modules).  The fragments are returned in the type
+    # of encode(), so they must go through encode_chunks() at the end.
+
+    def report_columns(self, only=None, ignore=None):
+        """
+        Returns the columns of a report for the selected fields, to give to the
+        other report methods.  See the documentation for method
+        Form.select_fields() for the meaning of the 'only' and 'ignore'
+        arguments.
+        """
+        return self._report_columns(self._form.select_fields(only, ignore))
+
+    def _report_columns(self, ofields):
+        """
+        Select the columns of a report, as a list of (field, name, memo)
+        triples, where 'memo' is a dict of memoized cells, or None.
+        """
+        columns = []
+        for field in ofields:
+            if field.ishidden() and not self.show_hidden:
+                continue
+            # Never display a file upload. Don't even try.
+            if isinstance(field, FileUploadField):
+                continue
+            if isinstance(field, self.report_memo_types):
+                memo = {}
+            else:
+                memo = None
+            columns.append( (field, field.name, memo) )
+        return columns
+
+    def report_header(self, columns, css_class=None):
+        """
+        Returns the opening of the table of a report, with its header row.
+        """
+        css = [self.css_table, self.css_report]
+        if css_class:
+            css.append(css_class)
+        header = [u'<table class="%s">\n<tr>' % u' '.join(css)]
+        for field, name, memo in columns:
+            header.append(u'<th class="%s">%s</th>' %
+                          (self.css_label, self._get_label(field)))
+        header.append(u'</tr>\n')
+        return self._encode(u''.join(header))
+
+    def report_footer(self):
+        """
+        Returns the closing of the table of a report.
+        """
+        return self._encode(u'</table>\n')
+
+    def report_errors(self, columns, errors, prefix=u'', css_class=None):
+        """
+        Returns a row of a report which spans all the columns, with the messages
+        of 'errors', a dict of field names to error tuples as returned by
+        FormParser.geterrors(), in the order of the fields of the form.  The
+        row starts with 'prefix'.
+        """
+        form = self._form
+        names = sorted(errors.iterkeys(), key=form.getposition)
+        messages = [u'%s: %s' % (self._get_label(form[name]),
+                                 self._esc(errors[name][0]))
+                    for name in names]
+        if prefix:
+            messages.insert(0, prefix)
+        return self._encode(u'<tr><td class="%s" colspan="%d">%s</td></tr>\n' %
+                            (css_class or self.css_errors, len(columns),
+                             u' '.join(messages)))
+
+    def report_rows(self, columns, records):
+        """
+        Generate the encoded rows of a report for the given 'records'.  The
+        memoized cells are kept in the columns, so they can be reused across
+        many calls.
+        """
+        enc = self._encode
+        cell = u'<td class="%s">%%s</td>' % self.css_input
+        unset = cell % msg_registry['display-unset']
+        empty = cell % u''
+        memo_size = self.report_memo_size
+        for values in records:
+            cells = [u'<tr>']
+            for field, name, memo in columns:
+                try:
+                    dvalue = values[name]
+                except KeyError:
+                    cells.append(self.show_unset and unset or empty)
+                    continue
+                if not self.show_empty and not dvalue:
+                    cells.append(empty)
+                    continue
+
+                if memo is None:
+                    cells.append(cell % self._report_value(field, dvalue))
+                    continue
+
+                # Note: we include the type in the key, so that e.g. 1 and True
+                # are not confused.
+                if isinstance(dvalue, list):
+                    key = (list, tuple(dvalue))
+                else:
+                    key = (dvalue.__class__, dvalue)
+                try:
+                    cells.append(memo[key])
+                except KeyError:
+                    rendered = cell % self._report_value(field, dvalue)
+                    if len(memo) < memo_size:
+                        memo[key] = rendered
+                    cells.append(rendered)
+            cells.append(u'</tr>\n')
+            yield enc(u''.join(cells))
+
+    def _report_value(self, field, dvalue):
+        """
+        Returns the displayed value for a cell of a report.
+        """
+        if not isinstance(dvalue, field.types_data):
+            raise AtochaError(
+                "dvalue %s for field %s of illegal type, expecting one of %s" %
+                (repr(dvalue), field.name, str(field.types_data)))
+        uvalue = field.display_value(dvalue)
+        return self._dispatch_render(field, uvalue, None, Field.NORMAL)
+
     def do_render(self, ofields, action_url=None, submit=None):
         form = self._form
         try:
@@ -556,7 +1401,7 @@ class TextDisplayRenderer(TextRenderer, atocha.render.DisplayRendererBase):
             self.do_render_table(ofields)
 
             # Close the form (the container rendering only outputs the header.
-            f.write('</form>\n')
+            f.write(u'</form>\n')
         finally:
             self.ofile = None
 
@@ -585,21 +1430,21 @@ class TextDisplayRenderer(TextRenderer, atocha.render.DisplayRendererBase):
 
 
 def displayValue(rdr, field, renctx):
-    return renctx.rvalue
+    return rdr._esc(renctx.rvalue)
 
 def displayTextAreaField(rdr, field, renctx):
-    return u'<pre>%s</pre>' % renctx.rvalue
+    return u'<pre>%s</pre>' % rdr._esc(renctx.rvalue)
 
 def displayEmailField(rdr, field, renctx):
     if renctx.rvalue:
-        return u'<a href="mailto:%s">%s</a>' % (renctx.rvalue,
-                                                renctx.rvalue)
+        return u'<a href="mailto:%s">%s</a>' % (rdr._escattr(renctx.rvalue),
+                                                rdr._esc(renctx.rvalue))
     return u''
 
 def displayURLField(rdr, field, renctx):
     if renctx.rvalue:
-        return u'<a href="%s">%s</a>' % (renctx.rvalue,
-                                         renctx.rvalue)
+        return u'<a href="%s">%s</a>' % (rdr._escattr(renctx.rvalue),
+                                         rdr._esc(renctx.rvalue))
     return u''
 
 def displayFileUploadField(rdr, field, renctx):
@@ -0,0 +1,147 @@
+#
+# $Id$
+#
+#  Atocha -- A web forms rendering and handling Python library.
+#  Copyright (C) 2005  Martin Blais
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+
+"""
+Page templates, into which the outputs of the renderers get injected.
+"""
+
+# stdlib imports
+import re
+
+# atocha imports
+from atocha import AtochaError
+
+
+__all__ = ('PageTemplate',)
+
+
+
+class PageTemplate:
+    """
+    A page with named slots, into which the outputs of a renderer (e.g. from
+    render_container(), render_table(), render_submit() and render_scripts())
+    get injected.
+
+    The slots are the elements of the page that have the given ids, e.g.::
+
+      <div id="login-form">(login form goes here)</div>
+
+    and their contents get replaced by the values that you provide.  The page is
+    searched only once, when the template is created, and it is then output as
+    the sequence of its fixed pieces and of the values, without building any
+    intermediate copy of the page.  You would normally create the template once
+    and reuse it for all the requests.
+
+    Note: the contents of the slot elements should not contain other elements
+    with the same tag, e.g. a div slot may not contain another div.
+    """
+
+    _slot_fmt = (r'<(?P<tag>\w+)\b[^>]*?\sid\s*=\s*["\'](?:%s)["\'][^>]*>'
+                 r'(?P<contents>.*?)</(?P=tag)\s*>')
+
+    def __init__(self, text, slots):
+        """
+        'text' is the page, a str or a unicode object, and 'slots' is a list of
+        the ids of the elements to be filled in.  Each of them must appear
+        exactly once in the page.
+        """
+        self.slots = tuple(slots)
+        "The ids of the slots, in the order that they appear in the page."
+
+        self._pieces = []
+        """The fixed pieces of the page, there is one more piece than slots,
+        they are output alternately."""
+
+        self._contents = {}
+        """The original contents of the slot elements, which are output for the
+        slots for which no value is provided."""
+
+        self._empty = text[:0]
+        "An empty string of the type of the page."
+
+        # Note: we use a group for each slot to find which slot has matched,
+        # to keep the ids that were given to us, as str or unicode.
+        pattern = self._slot_fmt % '|'.join(
+            ['(?P<slot%d>%s)' % (i, re.escape(x))
+             for i, x in enumerate(self.slots)])
+        found, pos = [], 0
+        for mo in re.finditer(pattern, text, re.S):
+            for i, slot in enumerate(self.slots):
+                if mo.group('slot%d' % i) is not None:
+                    break
+            if slot in self._contents:
+                raise AtochaError(
+                    "Error: Slot '%s' appears more than once in the page." %
+                    slot)
+            start, end = mo.span('contents')
+            self._pieces.append(text[pos:start])
+            self._contents[slot] = text[start:end]
+            found.append(slot)
+            pos = end
+        self._pieces.append(text[pos:])
+
+        missing = [x for x in self.slots if x not in self._contents]
+        if missing:
+            raise AtochaError("Error: Slots not found in the page: %s." %
+                              ', '.join(missing))
+        self.slots = tuple(found)
+
+    def render_iter(self, values):
+        """
+        Returns an iterator over the pieces of the page, with the slots filled
+        in from the 'values' dict of slot ids to outputs.  An output can be a
+        string or an iterable of strings, e.g. the iterator returned by a
+        renderer's render_iter(), and it must be of the same type as the page.
+        The original contents are output for the slots that are not in
+        'values'.
+        """
+        for slot in values:
+            if slot not in self._contents:
+                raise AtochaError("Error: Slot '%s' is not in the page." % slot)
+        return self._iter(values)
+
+    def _iter(self, values):
+        pieces = self._pieces
+        yield pieces[0]
+        for i, slot in enumerate(self.slots):
+            output = values.get(slot, self._contents[slot])
+            if isinstance(output, basestring):
+                yield output
+            elif output is not None:
+                for chunk in output:
+                    yield chunk
+            yield pieces[i+1]
+
+    def render_into(self, fp, values):
+        """
+        Write the page into the given file object, with the slots filled in.
+        See render_iter().
+        """
+        write = fp.write
+        for piece in self.render_iter(values):
+            write(piece)
+
+    def render(self, values):
+        """
+        Returns the page with the slots filled in.  See render_iter().
+        """
+        return self._empty.join(list(self.render_iter(values)))
+
@@ -27,12 +27,13 @@ Run these tests using the codespeak py.test tool.
 """
 
 # stdlib imports
-import sys, os, datetime, StringIO, webbrowser
+import sys, os, re, datetime, StringIO, webbrowser, codecs
 import unittest 
 from pprint import pprint, pformat
 
 
 # form imports
+import atocha
 from atocha import *
 
 
@@ -82,6 +83,22 @@ class TestForm(Test):
 
     # FIXME: we need to check the basic form functionalities here.
 
+    def test_addfield(self):
+        'Test adding fields and the indexes of the form.'
+
+        f = Form('test-form', StringField('name'), IntField('age'))
+        self.assert_(f.varnames() == ['name', 'age'])
+        self.assert_(f.getposition('age') == 1)
+        self.assert_(f.getposition('nonexistent') is None)
+
+        f.addfield(SetFileField('photo'))
+        self.assert_(f.varnames() == ['name', 'age', 'photo', 'photo_reset'])
+        f.varnames().append('other')
+        self.assert_(f.varnames() == ['name', 'age', 'photo', 'photo_reset'])
+        self.assert_(f.getposition('photo') == 2)
+        self.assertRaises(AtochaError, f.addfield, StringField('photo_reset'))
+        self.assertRaises(AtochaError, f.addfield, IntField('age'))
+
 
 
 class TestRender(Test):
@@ -118,10 +135,74 @@ class TestRender(Test):
         args = {}
         p = TextFormRenderer(f, incomplete=1)
         p.render(only=['name'], action='bli')
-        
-        # Note: we cannot really test the destructor failure, because the
-        # exception is ignored from there, due to its presence in the __del__()
-        # call, and all it does is output a message to stderr.
+
+        # Check the completeness errors.
+        atocha._completeness_errors = True
+        try:
+            f = Form('test-form', StringField('name'), IntField('age'),
+                     action='handle.cgi')
+            r = TextFormRenderer(f, incomplete=1)
+            self.assert_(r.finish() is None)
+
+            r = TextFormRenderer(f)
+            r.render(only=['name'])
+            self.assertRaises(AtochaError, r.finish)
+            self.assertRaises(AtochaError, r.render, only=['name'])
+            r.ignore('age')
+            self.assert_(r.finish() is None)
+
+            # The fields added after the renderer was created are checked.
+            g = Form('test-form', StringField('name'), action='handle.cgi')
+            r = TextFormRenderer(g)
+            g.addfield(IntField('age'))
+            r.render(only=['name'])
+            self.assertRaises(AtochaError, r.finish)
+
+            def render_partial():
+                with TextFormRenderer(f) as r:
+                    r.render(only=['age'])
+            self.assertRaises(AtochaError, render_partial)
+            with TextFormRenderer(f) as r:
+                r.render()
+
+            def parse_unended():
+                with FormParser(f, {}) as p:
+                    pass
+            self.assertRaises(AtochaError, parse_unended)
+            with FormParser(f, {}) as p:
+                p.cancel()
+            p = FormParser(f, {})
+            self.assertRaises(AtochaError, p.finish)
+            p.end()
+            self.assert_(p.finish() is None)
+
+            # The renderers and parsers destroyed without being finished warn.
+            import warnings, gc
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                r = TextFormRenderer(f)
+                r.render(only=['name'])
+                r = FormParser(f, {})
+                r = TextFormRenderer(f)
+                r.render()
+                r.finish()
+                r = FormParser(f, {})
+                r.cancel()
+                del r
+                gc.collect()
+            messages = [str(x.message) for x in caught]
+            self.assert_(len(messages) == 2)
+            self.assert_('renderer' in messages[0] and
+                         'missing: age.' in messages[0])
+            self.assert_('parser' in messages[1])
+        finally:
+            atocha._completeness_errors = False
+
+        # Without the checks, no tracking is done at all.
+        r = TextFormRenderer(f)
+        self.assert_(r._rendered is None)
+        r.render(only=['name'])
+        self.assert_(r.finish() is None)
 
     def test_nonexistent(self):
         'Test rendering fields that do not exist.'
@@ -145,6 +226,387 @@ class TestRender(Test):
         r = TextFormRenderer(f, args, output_encoding='latin-1')
         self.assert_(isinstance(r.render(), str))
 
+        # Unicode actions are encoded as well.
+        r = TextFormRenderer(f, args, output_encoding='utf-8')
+        out = r.render(action=u'/caf\xe9.cgi')
+        self.assert_(isinstance(out, str))
+        self.assert_('action="/caf\xc3\xa9.cgi"' in out)
+        chunks = list(r.render_container_iter(u'/caf\xe9.cgi'))
+        self.assert_([x for x in chunks if isinstance(x, str)] == chunks)
+
+    def test_skeleton(self):
+        'Test the caching of compiled render skeletons.'
+
+        f = Form('test-form', StringField('name', N_('Name')),
+                 action='handle.cgi')
+        args = {'name': u'Martin'}
+
+        # Without a locale key, the translated fragments are not cached.
+        self.assert_(TextFormRenderer(f, args).compile() is not
+                     TextFormRenderer(f, args).compile())
+
+        class LocaleRenderer(TextFormRenderer):
+            def locale_evaluator(self):
+                return 'en'
+        r = LocaleRenderer(f, args)
+        skel = r.compile()
+        self.assert_(r.compile() is skel)
+        out = r.render()
+        self.assert_(LocaleRenderer(f, args).render() == out)
+
+        # Modifying a field must invalidate its cached row.
+        f['name'].label = N_('Full Name')
+        f['name'].touch()
+        out2 = LocaleRenderer(f, args).render()
+        self.assert_(u'Full Name' in out2)
+        self.assert_(LocaleRenderer(f, args).compile() is skel)
+
+        # Modifying the form must invalidate the whole skeleton.
+        f.addfield(IntField('age'))
+        self.assert_(LocaleRenderer(f, args).compile() is not skel)
+
+    def test_languages(self):
+        'Test rendering a form in the language of each request.'
+        import __builtin__
+        f = Form('test-form', StringField('name', N_('Name')),
+                 MenuField('drink', [('tea', N_('Tea'))]),
+                 RadioField('size', [('big', N_('Big'))]),
+                 action='handle.cgi')
+        french = {'Name': u'Nom', 'Tea': u'Th\xe9', 'Big': u'Grand',
+                  'Submit': u'Soumettre'}
+        language = ['en']
+        def gettext(text):
+            if language[0] == 'fr':
+                return french.get(text, text.decode('latin-1'))
+            return text.decode('latin-1')
+
+        class LocaleRenderer(TextFormRenderer):
+            def locale_evaluator(self):
+                return language[0]
+
+        oldfun = __builtin__._
+        __builtin__._ = gettext
+        try:
+            for renderer in TextFormRenderer, LocaleRenderer:
+                language[0] = 'en'
+                out = renderer(f).render()
+                self.assert_(u'Tea' in out and u'Big' in out)
+                language[0] = 'fr'
+                out = renderer(f).render()
+                for word in u'Nom', u'Th\xe9', u'Grand':
+                    self.assert_(word in out)
+                self.assert_(u'>Tea<' not in out and u'Name' not in out)
+        finally:
+            __builtin__._ = oldfun
+
+    def test_render_iter(self):
+        'Test rendering a form incrementally.'
+
+        f = Form('test-form',
+                 StringField('name', N_('Name')),
+                 IntField('age', N_('Age')),
+                 StringField('secret', state=Field.HIDDEN),
+                 action='handle.cgi')
+        args = {'name': u'M\xe9lanie', 'age': 17, 'secret': u'x'}
+
+        out = TextFormRenderer(f, args).render()
+        r = TextFormRenderer(f, args)
+        chunks = list(r.render_iter())
+        self.assert_(len(chunks) > 3)
+        self.assert_(u''.join(chunks) == out)
+
+        # Check that the fields get rendered lazily.
+        atocha._completeness_errors = True
+        try:
+            r = TextFormRenderer(f, args, incomplete=1)
+            it = r.render_iter()
+            it.next(); it.next(); it.next()
+            self.assert_(list(r._rendered) == [1, 0, 0])
+            list(it)
+            self.assert_(list(r._rendered) == [1, 1, 1])
+        finally:
+            atocha._completeness_errors = False
+
+        # Check the encoded chunks.
+        r = TextFormRenderer(f, args, output_encoding='latin-1')
+        chunks = list(r.render_iter())
+        for chunk in chunks:
+            self.assert_(isinstance(chunk, str))
+        self.assert_(''.join(chunks) == out.encode('latin-1'))
+
+    def test_render_into(self):
+        'Test rendering encoded output directly into a file.'
+
+        f = Form('test-form',
+                 StringField('name', N_('Name')),
+                 action='handle.cgi')
+        args = {'name': u'M\xe9lanie'}
+        out = TextFormRenderer(f, args).render()
+
+        for enc in 'utf-8', 'latin-1', 'utf-16':
+            r = TextFormRenderer(f, args, output_encoding=enc)
+            self.assert_(r.render() == out.encode(enc))
+
+            sio = StringIO.StringIO()
+            r = TextFormRenderer(f, args, output_encoding=enc)
+            r.render_into(sio)
+            self.assert_(sio.getvalue() == out.encode(enc))
+
+        # Check the table class method with an encoding.
+        table = TextFormRenderer.do_ctable([(u'\xe9', u'x')],
+                                           outenc='latin-1')
+        self.assert_(isinstance(table, str) and '\xe9' in table)
+
+    def test_choices_cache(self):
+        'Test the caching of the rendered choices of multiple fields.'
+
+        f = Form('test-form',
+                 MenuField('coffee', ('latte', 'expresso', 'moccha')),
+                 CheckboxesField('sugar', ('white', 'brown', 'none'),
+                                 orient=ORI_VERTICAL),
+                 action='handle.cgi')
+
+        def render(values):
+            r = TextFormRenderer(f, values)
+            return r.render_field('coffee'), r.render_field('sugar')
+
+        menu, boxes = render({'coffee': 'expresso', 'sugar': ['white']})
+        self.assert_(menu.count(u'selected="selected"') == 1)
+        self.assert_(u'"expresso" selected' in menu)
+        self.assert_(boxes.count(u'checked') == 1)
+
+        menu, boxes = render({'coffee': 'moccha',
+                              'sugar': ['none', 'white', 'none']})
+        self.assert_(menu.count(u'selected="selected"') == 1)
+        self.assert_(u'"moccha" selected' in menu)
+        self.assert_(boxes.count(u'checked') == 2)
+        self.assert_(boxes.index(u'white') < boxes.index(u'none'))
+
+        # Check that changing the choices invalidates the cache.
+        f['coffee'].setchoices(['tea', 'moccha'])
+        menu, boxes = render({'coffee': 'tea', 'sugar': []})
+        self.assert_(u'latte' not in menu and u'"tea" selected' in menu)
+        self.assert_(u'checked' not in boxes)
+
+    def test_attributes_cache(self):
+        'Test the caching of the static attributes of the inputs.'
+
+        f = Form('test-form',
+                 StringField('name', size=10),
+                 TextAreaField('comments', rows=3),
+                 MenuField('coffee', ('latte', 'expresso'),
+                           onchange='go()'),
+                 action='handle.cgi')
+        args = {'name': u'blais', 'comments': u'<hi>'}
+        out = TextFormRenderer(f, args).render()
+        self.assert_(u'size="10"' in out and u'value="blais"' in out)
+        self.assert_(u'rows="3"' in out and u'&lt;hi&gt;</textarea>' in out)
+        self.assert_(u'onchange="go()"' in out)
+        self.assert_(TextFormRenderer(f, args).render() == out)
+
+        # Modifying a field and touching it must invalidate the attributes.
+        f['name'].size = 20
+        f['name'].touch()
+        out = TextFormRenderer(f, args).render()
+        self.assert_(u'size="20"' in out and u'size="10"' not in out)
+
+    def test_dispatch(self):
+        'Test the dispatch of fields to their rendering routines.'
+
+        import atocha.render
+
+        class NameField(StringField):
+            pass
+
+        class PlainField(StringField):
+            pass
+
+        f = Form('test-form', NameField('name'), PlainField('nick'),
+                 action='handle.cgi')
+        args = {'name': u'Martin', 'nick': u'blais'}
+
+        # The routine is found from the base class of the field.
+        out = TextFormRenderer(f, args).render()
+        self.assert_(u'value="Martin"' in out)
+
+        # Registering a new routine invalidates the dispatch tables.
+        def renderNameField(rdr, field, renctx):
+            return u'<name/>'
+        atocha.render.register_render_routine(TextFormRenderer, NameField,
+                                              renderNameField)
+        out = TextFormRenderer(f, args).render()
+        self.assert_(u'<name/>' in out and u'value="blais"' in out)
+
+    def test_grid(self):
+        'Test rendering and parsing a form for many records.'
+
+        f = Form('test-form',
+                 StringField('name', N_('Name')),
+                 MenuField('coffee', ('latte', 'expresso')),
+                 StringField('id', state=Field.HIDDEN),
+                 action='handle.cgi')
+        rows = [{'name': u'Martin', 'coffee': 'latte', 'id': u'1'},
+                ({'name': u'Guido', 'coffee': 'expresso', 'id': u'2'},
+                 {'name': u'Bad name'})]
+        r = FormGridRenderer(f, iter(rows))
+        chunks = list(r.render_iter())
+        out = u''.join(chunks)
+        for name in (u'name_0', u'coffee_0', u'id_0', u'name_1', u'id_1'):
+            self.assert_(u'name="%s"' % name in out)
+        self.assert_(out.count(u'<tr>') == 3)
+        self.assert_(u'Bad name' in out)
+        self.assert_(u'\x00' not in out)
+
+        # The values are rendered as they are, and the fields are unchanged.
+        out = FormGridRenderer(f, [{'name': u'a_\x00b', 'id': u'3'}]).render()
+        self.assert_(u'value="a_\x00b"' in out and u'a_0b' not in out)
+        self.assert_(f['name'].varnames == ['name'])
+
+        # The choices are shared between the rows and renamed for each of them.
+        choices = [('a', N_('A')), ('b', N_('B')), ('c', N_('C'))]
+        h = Form('test-form',
+                 RadioField('size', choices),
+                 CheckboxesField('extras', choices),
+                 MenuField('coffee', choices))
+        rows = [{'size': 'a', 'extras': ['b', 'c'], 'coffee': 'c'},
+                {'size': 'c', 'extras': [], 'coffee': 'a'},
+                {'size': 'b', 'extras': ['a'], 'coffee': 'b'}]
+        out = FormGridRenderer(h, rows).render_table('size', 'extras', 'coffee')
+        for index, values in enumerate(rows):
+            g = Form('row-form',
+                     RadioField('size_%d' % index, choices),
+                     CheckboxesField('extras_%d' % index, choices),
+                     MenuField('coffee_%d' % index, choices))
+            values = dict(('%s_%d' % (k, index), v) for k, v in values.items())
+            r = TextFormRenderer(g, values)
+            for field in g.fields():
+                self.assert_(r.render_field(field.name) in out)
+
+        # Parse the submitted values back.
+        args = {'name_0': 'Martin', 'coffee_0': 'latte', 'id_0': '1',
+                'name_1': 'Guido\x01', 'coffee_1': 'expresso', 'id_1': '2',
+                'other_0': 'ignored'}
+        p = FormParser(f)
+        results = p.parse_grid(args)
+        p.end()
+        self.assert_(len(results) == 2)
+        values, errors = results[0]
+        self.assert_(values == {'name': u'Martin', 'coffee': 'latte',
+                                'id': u'1'} and not errors)
+        values, errors = results[1]
+        self.assert_('name' in errors and values['id'] == u'2')
+        self.assert_(p.haserrors())
+
+    def test_report(self):
+        'Test rendering a report of many records.'
+
+        f = Form('test-form',
+                 StringField('name', N_('Name')),
+                 MenuField('coffee', [('latte', N_('Latte')),
+                                      ('expresso', N_('Expresso'))]),
+                 BoolField('sugar', N_('Sugar')))
+        records = [{'name': u'Martin', 'coffee': 'latte', 'sugar': True},
+                   {'name': u'Guido', 'coffee': 'latte'},
+                   {'name': u'Mark', 'coffee': 'expresso', 'sugar': False}]
+
+        r = TextDisplayRenderer(f, incomplete=1)
+        r.report_memo_size = 1
+        chunks = list(r.render_report_iter(iter(records)))
+        self.assert_(len(chunks) == 5)
+        self.assert_(u'<th class="atodlbl">Sugar</th>' in chunks[0])
+        self.assert_(chunks[1].count(u'Latte') == 1)
+        self.assert_(chunks[2].count(u'Latte') == 1)
+        self.assert_(u'Not set' in chunks[2])
+        self.assert_(u'Expresso' in chunks[3])
+
+        r = TextDisplayRenderer(f, output_encoding='utf-8', incomplete=1)
+        out = r.render_report(records, only=['name'])
+        self.assert_(isinstance(out, str) and 'Latte' not in out)
+        self.assert_(out.count('<tr>') == 4)
+
+        # The parts of a report, for assembling custom reports.
+        r = TextDisplayRenderer(f, output_encoding='utf-16', incomplete=1)
+        columns = r.report_columns(only=['name'])
+        chunks = [r.report_header(columns)]
+        chunks.extend(r.report_rows(columns, records))
+        chunks.append(r.report_errors(columns, {'name': (u'Bad <name>', None)},
+                                      u'Row 2:'))
+        chunks.append(r.report_footer())
+        self.assert_(isinstance(r.encode(u''), unicode))
+        custom = ''.join(r.encode_chunks(chunks)).decode('utf-16')
+        self.assert_(custom.replace(u'<tr><td class="atoerr" colspan="1">'
+                                    u'Row 2: Name: Bad &lt;name&gt;</td></tr>\n',
+                                    u'') == out.decode('utf-8'))
+
+    def test_report_bulk(self):
+        'Test rendering a report in a pool of processes.'
+
+        from atocha.bulk import render_report_bulk, render_report_bulk_iter
+
+        f = Form('test-form',
+                 StringField('name', N_('Name')),
+                 MenuField('coffee', [('latte', N_('Latte')),
+                                      ('expresso', N_('Expresso'))]),
+                 IntField('cups', N_('Cups')))
+        records = [{'name': u'M\xe9lanie %d' % x,
+                    'coffee': ('latte', 'expresso')[x % 2],
+                    'cups': x} for x in xrange(50)]
+
+        out = TextDisplayRenderer(f, incomplete=1).render_report(records)
+        chunks = list(render_report_bulk_iter(f, iter(records), processes=2,
+                                              chunksize=7))
+        self.assert_(len(chunks) == 10)
+        self.assert_(u''.join(chunks) == out)
+        self.assertRaises(AtochaError, render_report_bulk_iter, f, records,
+                          chunksize=0)
+
+        out = render_report_bulk(f, records, only=['name'], processes=2,
+                                 output_encoding='latin-1')
+        self.assert_(isinstance(out, str) and 'Latte' not in out)
+        self.assert_(out.count('<tr>') == 51)
+        self.assert_('M\xe9lanie 49' in out)
+
+        # The encoding of the renderer class is used as well.
+        class UTF8Renderer(TextDisplayRenderer):
+            default_encoding = 'utf-8'
+        out = render_report_bulk(f, records, renderer=UTF8Renderer,
+                                 processes=2, incomplete=1)
+        self.assert_(isinstance(out, str) and 'M\xc3\xa9lanie 49' in out)
+
+    def test_escape(self):
+        'Test the escaping of the rendered text.'
+
+        text = u'plain text'
+        self.assert_(escape_text(text) is text and escape_attr(text) is text)
+        self.assert_(escape_text(u'<a & "b">') == u'&lt;a &amp; "b"&gt;')
+        self.assert_(escape_attr(u'<a & "b">') ==
+                     u'&lt;a &amp; &quot;b&quot;&gt;')
+        self.assert_(escape_attr('"b"') == '&quot;b&quot;')
+        text = Markup(u'<b>bold</b>')
+        self.assert_(escape_text(text) is text)
+
+        f = Form('test-form',
+                 StringField('name', N_('Name')),
+                 MenuField('op', [('<', N_('Less')), ('>', N_('More'))]),
+                 StringField('secret', state=Field.HIDDEN),
+                 action='handle.cgi')
+        args = {'name': u'<script>', 'op': '<', 'secret': u'"x"'}
+        out = TextFormRenderer(f, args).render()
+        self.assert_(u'<script>' not in out and u'&lt;script&gt;' in out)
+        self.assert_(u'value="&lt;" selected' in out)
+        self.assert_(u'value="&quot;x&quot;"' in out)
+
+        args['name'] = Markup(u'<b>')
+        out = TextFormRenderer(f, args).render()
+        self.assert_(u'value="<b>"' in out)
+
+        out = TextFormRenderer(f, args, autoescape=False).render()
+        self.assert_(u'value=""x""' in out)
+
+        out = TextDisplayRenderer(f, {'name': u'a&b'}, incomplete=1).render(
+            only=['name'])
+        self.assert_(u'a&amp;b' in out)
+
 
     #---------------------------------------------------------------------------
 
@@ -181,6 +643,201 @@ class TestRender(Test):
             # Open it automatically in the web browser.
             webbrowser.open(self.tmpfilename)
 
+    def test_constraints(self):
+        'Test the HTML5 attributes and manifest of the field constraints.'
+
+        f = Form('test-form',
+                 StringField('name', N_('Name'), required=1,
+                             minlen=2, maxlen=20),
+                 IntField('age', N_('Age'), minval=0, maxval=150),
+                 FloatField('height', N_('Height')),
+                 TextAreaField('comments', maxlen=100),
+                 AgreeField('agree', N_('Agree')),
+                 CheckboxesField('sugar', ('white', 'brown'), atleast=1),
+                 StringField('ro', state=Field.READONLY, required=1),
+                 StringField('secret', state=Field.HIDDEN, required=1),
+                 action='handle.cgi')
+        args = {'ro': u'x', 'secret': u'x'}
+
+        out = TextFormRenderer(f, args, constraints=True).render()
+        for attrs in (u'name="name" type="text" class="string" size="20" '
+                      u'maxlength="20" required="required" minlength="2"',
+                      u'name="age" type="number" class="int" min="0" '
+                      u'max="150"',
+                      u'type="number" class="float" step="any"',
+                      u'maxlength="100"',
+                      u'class="agree" required="required"',
+                      u'name="ro" type="text" class="string" readonly="1" '
+                      u'value="x"/>'):
+            self.assert_(attrs in out)
+
+        # The constraints are not output by default.
+        out = TextFormRenderer(f, args).render()
+        self.assert_(u'required=' not in out and u'type="number"' not in out)
+
+        manifest = f.get_constraints_manifest()
+        self.assert_(manifest is f.get_constraints_manifest())
+        self.assert_(manifest.startswith(
+            '{"fields":[{"constraints":{"maxlength":20,"minlength":2,'
+            '"required":true},"name":"name","varnames":["name"]},'))
+        self.assert_('"constraints":{"atleast":1},"name":"sugar"' in manifest)
+        self.assert_('"name":"ro"' in manifest)
+        self.assert_('"name":"secret"' not in manifest)
+        self.assert_(manifest.endswith('"form":"test-form"}'))
+
+        # The manifest gets updated when a field is modified.
+        f['age'].maxval = 120
+        f['age'].touch()
+        self.assert_('"max":120' in f.get_constraints_manifest())
+
+    def test_fingerprint(self):
+        'Test the fingerprints and cache headers of the rendered forms.'
+
+        f = Form('test-form',
+                 StringField('name', N_('Name')),
+                 MenuField('coffee', ('latte', 'expresso')),
+                 action='handle.cgi')
+        args = {'name': u'M\xe9lanie', 'coffee': 'latte'}
+
+        fp = TextFormRenderer(f, args).fingerprint()
+        self.assert_(TextFormRenderer(f, dict(args)).fingerprint() == fp)
+        for r in (TextFormRenderer(f, {'name': u'Guido'}),
+                  TextFormRenderer(f, args, {'name': u'Bad name'}),
+                  TextFormRenderer(f, args, labelsemi=1),
+                  TextDisplayRenderer(f, args)):
+            self.assert_(r.fingerprint() != fp)
+        r = TextFormRenderer(f, args)
+        self.assert_(r.fingerprint(action='other.cgi') != fp)
+        self.assert_(r.fingerprint(only=['name']) != fp)
+
+        # Modifying the form changes the fingerprint.
+        f['coffee'].setchoices(('latte', 'moccha'))
+        self.assert_(r.fingerprint() != fp)
+
+        headers = dict(r.cache_headers())
+        etag = headers['ETag']
+        self.assert_(etag == '"%s"' % r.fingerprint())
+        self.assert_(headers['Vary'] == 'Accept-Language')
+        self.assert_(r.not_modified('"abc", W/%s' % etag))
+        self.assert_(r.not_modified('*'))
+        self.assert_(not r.not_modified('"abc"'))
+        self.assert_(not r.not_modified(None))
+        r.render()
+
+        g = FormGridRenderer(f, [])
+        self.assertRaises(AtochaError, g.fingerprint)
+
+        # The ETags are the same in all processes.
+        import subprocess
+        script = '\n'.join((
+            'import sys',
+            'sys.path.insert(0, %r)' % os.path.dirname(atocha.__path__[0]),
+            'from atocha import *',
+            'f = Form("test-form", StringField("name", N_("Name")),',
+            '         action="handle.cgi")',
+            'print TextFormRenderer(f, {"name": u"Martin"}).etag()'))
+        etags = set()
+        for i in xrange(2):
+            proc = subprocess.Popen([sys.executable, '-c', script],
+                                    stdout=subprocess.PIPE)
+            etags.add(proc.communicate()[0])
+            self.assert_(proc.returncode == 0)
+        self.assert_(len(etags) == 1)
+
+        # Translations are identified by their language.
+        import __builtin__, gettext
+        class Translations(gettext.NullTranslations):
+            def __init__(self, language):
+                gettext.NullTranslations.__init__(self)
+                self._info['language'] = language
+        oldfun = __builtin__._
+        try:
+            fps = []
+            for language in 'fr', 'fr', 'en':
+                __builtin__._ = Translations(language).ugettext
+                fps.append(TextFormRenderer(f, args).fingerprint())
+            self.assert_(fps[0] == fps[1] != fps[2])
+
+            # Other translation functions need a locale key.
+            __builtin__._ = lambda text: text.decode('latin-1')
+            r = TextFormRenderer(f, args)
+            self.assertRaises(AtochaError, r.fingerprint)
+            class LocaleRenderer(TextFormRenderer):
+                def locale_evaluator(self):
+                    return language
+            fps = []
+            for language in 'fr', 'en':
+                fps.append(LocaleRenderer(f, args).fingerprint())
+            self.assert_(fps[0] != fps[1])
+        finally:
+            __builtin__._ = oldfun
+
+    def test_etree(self):
+        'Test the ElementTree renderer and its incremental serialization.'
+
+        from atocha.renderers.retree import EtreeFormRenderer, ElementTree
+
+        # Note: ElementTree relies on the default encoding internally.
+        sys.setdefaultencoding('ascii')
+        try:
+            self._test_etree(EtreeFormRenderer, ElementTree)
+        finally:
+            sys.setdefaultencoding('undefined')
+
+    def _test_etree(self, EtreeFormRenderer, ElementTree):
+        f = Form('test-form',
+                 StringField('name', N_('Name'), required=1),
+                 RadioField('coffee', ('latte', 'expresso'),
+                            orient=ORI_VERTICAL),
+                 TextAreaField('comments'),
+                 StringField('secret', state=Field.HIDDEN),
+                 action='handle.cgi')
+        args = {'name': u'M\xe9lanie <m>', 'coffee': 'latte',
+                'secret': u'x'}
+        errors = {'comments': u'Too short'}
+
+        tree = EtreeFormRenderer(f, args, errors).render()
+        self.assert_(tree.tag == 'form')
+        out = ElementTree.tostring(tree, 'utf-8').decode('utf-8')
+        self.assert_(u'M\xe9lanie &lt;m&gt;' in out)
+
+        # The incremental output must be the same as the serialized tree.
+        r = EtreeFormRenderer(f, args, errors)
+        chunks = list(r.render_iter())
+        self.assert_(len(chunks) > 4)
+        self.assert_(u''.join(chunks) == out)
+
+        for enc in 'utf-8', 'latin-1', 'utf-16':
+            sio = StringIO.StringIO()
+            EtreeFormRenderer(f, args, errors,
+                              output_encoding=enc).render_into(sio)
+            self.assert_(sio.getvalue() == out.encode(enc))
+
+        # Without visible fields, only the hidden inputs get output.
+        r = EtreeFormRenderer(f, args, incomplete=1)
+        out = u''.join(r.render_table_iter('secret'))
+        self.assert_(out == u'<input name="secret" type="hidden" value="x" />')
+
+        # The inputs and scripts are the same as those of the text renderer.
+        def widgets(text):
+            inputs = [sorted(re.findall(r'(\w+)="([^"]*)"', x))
+                      for x in re.findall(r'<input [^>]*>', text)]
+            scripts = [x.strip() for x in
+                       re.findall(r'<script [^>]*>(.*?)</script>', text, re.S)]
+            return inputs, scripts
+
+        f = Form('test-form',
+                 SetFileField('photo', N_('Photo')),
+                 JSDateField('date', N_('Date')),
+                 action='handle.cgi')
+        for args in ({'photo': False, 'date': datetime.date(2008, 2, 29)},
+                     {'photo': None, 'date': None}):
+            text = TextFormRenderer(f, args).render_table('photo', 'date')
+            r = EtreeFormRenderer(f, args)
+            tree = u''.join(r.render_table_iter('photo', 'date'))
+            self.assert_(widgets(tree) == widgets(text))
+            self.assert_(('checked' in text) == (args['photo'] is False))
+
     def test_visual(self):
         'Visual tests examining the output of the renderer.'
         
@@ -324,6 +981,32 @@ class TestFields(Test):
             self.assert_(o is not None)
             self.assert_(o.quote)
 
+        # Test the control chars, the replacement value is cleaned.
+        fi = f['quote']
+        self.assert_(fi.parse_value(u'a\r\nb c') == u'a\r\nb c')
+        try:
+            fi.parse_value(u'a\x00b\r\nc\t\x1f')
+            self.fail()
+        except FieldError, e:
+            self.assert_(e.args[1] == u'ab\r\nc')
+
+        fi = TextAreaField('latin', encoding='latin-1', maxlen=5)
+        try:
+            fi.parse_value(u'\xe9\x01')
+            self.fail()
+        except FieldError, e:
+            self.assert_(e.args[1] == u'\xe9')
+        try:
+            fi.parse_value(u'\x01' * 6)
+            self.fail()
+        except FieldError, e:
+            self.assert_(e.args[0] == atocha_messages['text-maxlen'])
+
+        # Test the newlines on rendering.
+        self.assert_(fi.render_value('a\r\nb\rc') == u'a\nb\rc')
+        rvalue = u'a\nb'
+        self.assert_(f['quote'].render_value(rvalue) is rvalue)
+
         
     def test_date(self):
         'DateField tests.'
@@ -695,6 +1378,44 @@ class TestFields(Test):
 
 
 
+class TestTemplate(Test):
+    """
+    Tests for the page templates.
+    """
+
+    def test_template(self):
+        'Test injecting rendered forms into a page template.'
+
+        page = (u'<html><body><div class="x" id="form">Form</div>\n'
+                u'<p id="note"><b>Note</b></p><div id="footer"></div>'
+                u'</body></html>')
+        t = PageTemplate(page, ('note', 'form'))
+        self.assert_(t.slots == ('form', 'note'))
+
+        f = Form('test-form',
+                 StringField('name', N_('Name')),
+                 action='handle.cgi')
+        out = TextFormRenderer(f).render()
+        r = TextFormRenderer(f)
+        html = t.render({'form': r.render_iter()})
+        self.assert_(html == page.replace(u'>Form<', u'>%s<' % out))
+
+        sio = StringIO.StringIO()
+        t.render_into(sio, {'form': u'F', 'note': [u'N', u'1']})
+        self.assert_(u'id="form">F</div>' in sio.getvalue())
+        self.assert_(u'<p id="note">N1</p>' in sio.getvalue())
+
+        self.assertRaises(AtochaError, t.render, {'footer': u''})
+        self.assertRaises(AtochaError, PageTemplate, page, ['nothere'])
+
+        # Other attributes ending with 'id' are not taken as the id.
+        page = u'<p data-id="form">No</p><div id="form">Yes</div>'
+        t = PageTemplate(page, ['form'])
+        self.assert_(t.render({'form': u'F'}) ==
+                     u'<p data-id="form">No</p><div id="form">F</div>')
+
+
+
 class TestParser(Test):
     """
     Tests for parser.
@@ -715,3 +1436,303 @@ class TestParser(Test):
         p = FormParser(f, {})
         p.error("Some error message!", numbah=1)
         self.assert_(p.haserrors() is True)
+
+    def test_parse_batch(self):
+        "Test parsing many submissions at once."
+        from atocha.batch import parse_batch
+
+        f = Form('test-form',
+                 IntField('age', minval=0, maxval=150, required=1),
+                 FloatField('weight'),
+                 BoolField('member'),
+                 MenuField('coffee', ('latte', 'expresso')),
+                 StringField('name', strip=True, minlen=2, maxlen=10),
+                 TextAreaField('comments'),
+                 DateField('birth'),
+                 SetFileField('photo'))
+        samples = {
+            'age': ['42', '', '-1', '151', 'abc', '1e3', ' 7 ', None],
+            'weight': ['1.5', '', 'x', '2', None],
+            'member': ['1', '0', '', 'on', None],
+            'coffee': ['latte', 'expresso', '', None],
+            'name': ['Martin', '  Guido  ', 'M', 'Bl\x01ais', 'a\nb',
+                     'x' * 11, '', '   ', 'M\xc3\xa9lanie', '\xff', None],
+            'comments': ['a\r\nb', 'bad\x02', '', None],
+            'birth': ['2001-09-11', 'never', None],
+            }
+        rows = []
+        for i in xrange(30):
+            args = {}
+            for name, values in samples.iteritems():
+                value = values[(i * 7 + len(name)) % len(values)]
+                if value is not None:
+                    args[name] = value
+            rows.append(args)
+
+        res = parse_batch(f, rows)
+        self.assert_(res.nrows == 30 and res.haserrors())
+        for i, args in enumerate(rows):
+            values, errors = res.row(i)
+            for fi in f.fields():
+                has_error, retvalue = f.parse_field(fi, args)
+                if has_error:
+                    self.assert_(errors[fi.name] == retvalue)
+                else:
+                    self.assert_(values[fi.name] == retvalue)
+                    self.assert_(type(values[fi.name]) is type(retvalue))
+
+        # Check the columnar input.
+        columns = {'age': ['1', 'x', None], 'member': ['1', None, '0']}
+        res = parse_batch(f, columns=columns, only=['age', 'member'])
+        self.assert_(res.values['member'] == [True, False, False])
+        self.assert_(list(res.array('age')) == [1, 0, 0])
+        self.assert_(sorted(res.errors['age'].keys()) == [1, 2])
+
+    def test_import_csv(self):
+        "Test importing a CSV file with a form as the schema."
+        from atocha.csvimport import import_csv, ErrorReport
+
+        f = Form('test-form',
+                 StringField('name', N_('Name'), required=1),
+                 IntField('age', N_('Age'), minval=0),
+                 BoolField('member'))
+        data = ('name,age,member,other\n'
+                'Martin,37,1,x\n'
+                'M\xc3\xa9lanie,-3,0,y\n'
+                '"Guido\nvan Rossum",,,\n'
+                ',12,1,z\n')
+
+        calls = []
+        out = StringIO.StringIO()
+        report = ErrorReport(f, out, output_encoding='utf-8')
+        results = list(import_csv(f, StringIO.StringIO(data),
+                                  progress=calls.append, progress_every=3,
+                                  error_sink=report))
+        report.close()
+
+        self.assert_(calls == [3, 4])
+        self.assert_([x[0] for x in results] == [2, 3, 5, 6])
+        line, values, errors = results[0]
+        self.assert_(values == {'name': u'Martin', 'age': 37, 'member': True})
+        self.assert_(not errors)
+        self.assert_(results[1][1]['name'] == u'M\xe9lanie')
+        self.assert_(results[1][2].keys() == ['age'])
+        self.assert_(results[2][2].keys() == ['name'])
+        self.assert_(results[3][2].keys() == ['name'])
+
+        html = out.getvalue()
+        self.assert_(report.count == 3 and html.count('<tr>') == 7)
+        self.assert_('Line 3: Age: Value too small.' in html)
+        self.assert_('M\xc3\xa9lanie' in html)
+
+        # Check TSV files with explicit columns.
+        data = 'Martin\t37\nGuido\tx\n'
+        results = list(import_csv(f, StringIO.StringIO(data),
+                                  varnames=['name', 'age'],
+                                  dialect='excel-tab'))
+        self.assert_(len(results) == 2 and results[1][2].keys() == ['age'])
+
+        # The errors are the same as those of the parser.
+        p = FormParser(f)
+        grid = p.parse_grid({'name_0': 'Guido', 'age_0': 'x'})
+        p.cancel()
+        self.assert_(results[1][1:] == grid[0])
+
+        # A byte order mark at the start of the file is ignored.
+        data = codecs.BOM_UTF8 + 'name,age\nMartin,37\n'
+        results = list(import_csv(f, StringIO.StringIO(data)))
+        self.assert_(results[0][1] == {'name': u'Martin', 'age': 37,
+                                       'member': False})
+
+    def test_validate_bulk(self):
+        "Test parsing many submissions in a pool of processes."
+        from atocha.bulk import validate_bulk
+
+        f = Form('test-form',
+                 StringField('name', maxlen=5),
+                 IntField('age', minval=0),
+                 MenuField('coffee', ('latte', 'expresso')))
+        records = [{'name': 'x' * (i % 7), 'age': str(i % 5 - 1),
+                    'coffee': ('latte', 'expresso')[i % 2]}
+                   for i in xrange(40)]
+        results, counts = validate_bulk(f, iter(records), processes=2,
+                                        chunksize=6)
+        self.assert_(len(results) == 40)
+        for args, (values, errors) in zip(records, results):
+            for fi in f.fields():
+                has_error, retvalue = f.parse_field(fi, args)
+                if has_error:
+                    self.assert_(errors[fi.name] == retvalue)
+                else:
+                    self.assert_(values[fi.name] == retvalue)
+        self.assert_(counts == {'name': 5, 'age': 8})
+
+        # An invalid chunk size is reported when the iterator is created.
+        from atocha.bulk import validate_bulk_iter
+        self.assertRaises(AtochaError, validate_bulk_iter, f, records,
+                          chunksize=0)
+
+    def test_pickle(self):
+        "Test pickling forms."
+        import pickle
+
+        f = Form('test-form',
+                 StringField('name'),
+                 MenuField('coffee', ('latte', 'expresso')),
+                 DateMenuField('when', extra_choices=[('never', N_('Never'))]),
+                 FileUploadField('photo'), action='handle.cgi')
+        args = {'when': 'never'}
+        TextFormRenderer(f, args).render()
+        self.assert_(f._caches and len(f['when'].choices) > 1)
+
+        g = pickle.loads(pickle.dumps(f, 2))
+        self.assert_(not g._caches)
+        self.assert_(g.varnames() == f.varnames())
+        self.assert_(g.getposition('photo') == 3)
+        self.assert_(g['coffee'].choiceset == f['coffee'].choiceset)
+        self.assert_(g['coffee'] is g.fields()[1])
+        self.assert_(g['when'].choices == [('never', N_('Never'))])
+        self.assert_(g['when'].choiceset == {'never': N_('Never')})
+        out = TextFormRenderer(g, args).render()
+        self.assert_(out == TextFormRenderer(f, args).render())
+
+    def test_decoded_args(self):
+        "Test decoding the arguments only once."
+        f = Form('test-form', StringField('name'), IntField('age'),
+                 accept_charset='utf8')
+        g = Form('other-form', StringField('name'), accept_charset='UTF-8')
+
+        args = DecodedArgs({'name': 'M\xc3\xa9lanie', 'age': '17',
+                            'tags': ['a', '\xc3\xa9']}, 'utf-8')
+        self.assert_(args.charset == 'utf-8' and args['age'] == '17')
+        self.assert_(f.decode_args(args) is args)
+        self.assert_(args.getdecoded('tags') == [u'a', u'\xe9'])
+        self.assert_(args.getdecoded('nothing') is None)
+
+        p = FormParser(f)
+        p.parse_args(args, only=['name'])
+        p.parse_args(args, only=['age'])
+        self.assert_(p['name'] == u'M\xe9lanie' and p['age'] == 17)
+        self.assert_(FormParser(g, args)['name'] == u'M\xe9lanie')
+        self.assert_(sorted(args._decoded.keys()) == ['age', 'name', 'nothing',
+                                                      'tags'])
+
+        # The changes to a plain dict between calls are taken into account.
+        raw = {'name': 'M\xc3\xa9lanie'}
+        p = FormParser(f)
+        p.parse_args(raw, only=['name'])
+        raw['age'] = '\xff'
+        p.parse_args(raw, only=['age'])
+        self.assert_(p['name'] == u'M\xe9lanie' and p.haserror('age'))
+
+        # Check other charsets.
+        h = Form('latin-form', StringField('name'), accept_charset='latin-1')
+        self.assert_(FormParser(h, raw)['name'] == u'M\xc3\xa9lanie')
+
+    def test_lazy(self):
+        "Test parsing the fields on access."
+        f = Form('test-form', IntField('age'), StringField('name'),
+                 IntField('count'), action='handle.cgi')
+        args = {'age': '17', 'name': 'Martin', 'count': 'many'}
+
+        p = FormParser(f, args, lazy=True)
+        self.assert_(p._pending and not p._values and not p._errors)
+        self.assert_(p['age'] == 17 and p.o.name == u'Martin')
+        self.assert_(p._pending.keys() == ['count'] and not p._errors)
+        self.assert_(p['count'] is None and p._errors.keys() == ['count'])
+
+        # The results are the same as the eager parsing.
+        for calls in ([], [('error', u'Custom')], [('parse_args', 'age')]):
+            results = []
+            for lazy in False, True:
+                p = FormParser(f, args, lazy=lazy)
+                for method, arg in calls:
+                    if method == 'error':
+                        p.error(arg)
+                    else:
+                        p.parse_args({'age': 'old'}, only=[arg])
+                p.end()
+                results.append((p.getvalues(), p.geterrors(), p._status,
+                                p._message))
+            self.assert_(results[0] == results[1])
+
+    def test_revalidate(self):
+        "Test the incremental validation of changed arguments."
+        f = Form('test-form', IntField('age'), StringField('name'),
+                 IntField('count'), action='handle.cgi')
+
+        self.assert_(f.validate_field('age', '17') == (0, 17))
+        self.assert_(f.validate_field('age', 'old')[0] == 1)
+        self.assert_(f.validate_field('name', None) == (0, u''))
+
+        p = FormParser(f, {'age': '17', 'name': 'Martin', 'count': 'many'})
+        values, errors = p.getvalues(), dict(p.geterrors())
+        self.assert_(errors.keys() == ['count'])
+
+        changed = p.revalidate(values, errors, {'count': '3'})
+        self.assert_(changed == {'count': None} and not errors)
+        self.assert_(values['count'] == 3 and values['age'] == 17)
+
+        changed = p.revalidate(values, errors, {'age': 'old', 'name': 'Blais'})
+        self.assert_(changed.keys() == ['age'] and errors.keys() == ['age'])
+        self.assert_('age' not in values and values['name'] == u'Blais')
+
+        # An unchanged error is not reported again.
+        self.assert_(p.revalidate(values, errors, {'age': 'old'}) == {})
+
+        # The results are the same as parsing all the arguments again.
+        p = FormParser(f, {'age': 'old', 'name': 'Blais', 'count': '3'})
+        self.assert_(p.getvalues() == values and p.geterrors() == errors)
+
+        # The deltas go through the normalizer of the parser.
+        import cgi
+        from atocha.norms.ncgi import normalize_args
+        class CGIParser(FormParser):
+            normalizer = normalize_args
+        fs = cgi.FieldStorage(environ={'REQUEST_METHOD': 'GET',
+                                       'QUERY_STRING': 'age=42'})
+        changed = CGIParser(f).revalidate(values, errors, fs)
+        self.assert_(changed == {'age': None} and values['age'] == 42)
+
+        # The fields with many variables need all of them.
+        f = Form('test-form', SetFileField('photo'), StringField('name'),
+                 action='handle.cgi')
+        reset = f['photo'].varnames[1]
+        args = {'name': 'Martin', reset: '1'}
+        p = FormParser(f, args)
+        values, errors = p.getvalues(), dict(p.geterrors())
+        self.assert_(values['photo'] is False)
+
+        skipped = []
+        p.revalidate(values, errors, {reset: ''}, skipped=skipped)
+        self.assert_(skipped == ['photo'] and values['photo'] is False)
+        p.revalidate(values, errors, {reset: ''}, base=args)
+        self.assert_(values['photo'] is None and not errors)
+
+    def test_parse_plan(self):
+        "Test the cached parse plans."
+        # The charset is only needed when there is something to decode.
+        f = Form('test-form', StringField('name'), accept_charset=None)
+        self.assert_(FormParser(f, {})['name'] == u'')
+        self.assert_(f.validate_field('name', None) == (0, u''))
+        self.assert_(f.decode_args({}).charset is None)
+        self.assertRaises(TypeError, FormParser, f, {'name': 'Martin'})
+
+        f = Form('test-form', IntField('numbah'), StringField('name'),
+                 accept_charset='latin-1')
+
+        plan = f.get_parse_plan(ignore=['name'])
+        self.assert_(f.get_parse_plan(ignore=('name',)) is plan)
+        self.assert_([x[0].name for x in plan] == ['numbah'])
+        self.assert_(f.select_fields(['name']) is f.select_fields(['name']))
+
+        p = FormParser(f, {'numbah': '42', 'name': 'M\xe9lanie'})
+        self.assert_(p['numbah'] == 42)
+        self.assert_(p['name'] == u'M\xe9lanie')
+
+        # Adding a field must invalidate the plans.
+        f.addfield(StringField('other'))
+        self.assert_(f.get_parse_plan(ignore=['name']) is not plan)
+        p = FormParser(f)
+        p.parse_args({'other': 'x'}, only=['other'])
+        self.assert_(p['other'] == u'x' and not p.haserrors())
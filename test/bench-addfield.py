@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+
+"""
+Time the construction of forms with many fields, to check that it scales
+linearly with the number of fields.
+"""
+
+import sys, time
+from atocha import *
+
+def build(nfields):
+    fields = [StringField('field%d' % x) for x in xrange(nfields)]
+    start = time.time()
+    Form('bench-form', fields, action='handle.cgi')
+    return time.time() - start
+
+def main():
+    sizes = map(int, sys.argv[1:]) or [1000, 5000, 10000, 50000]
+    print '%8s %10s %12s' % ('fields', 'seconds', 'usecs/field')
+    for nfields in sizes:
+        elapsed = build(nfields)
+        print '%8d %10.3f %12.2f' % (nfields, elapsed, elapsed * 1e6 / nfields)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+"""
+Time the rendering of a grid of many rows with FormGridRenderer, against the
+rendering of the same rows with one TextFormRenderer per row, to check that the
+grid reuses the lists of choices of its fields between the rows.
+"""
+
+import sys, time
+from atocha import *
+
+FIELDS = ('name', 'menu', 'radio')
+
+def build(nchoices):
+    menu = [('m%d' % x, 'Menu choice %d' % x) for x in xrange(nchoices[0])]
+    radio = [('r%d' % x, 'Radio choice %d' % x) for x in xrange(nchoices[1])]
+    return Form('bench-form',
+                StringField('name'),
+                MenuField('menu', menu),
+                RadioField('radio', radio),
+                action='handle.cgi')
+
+def rows(nrows):
+    return [{'name': u'Row %d' % x, 'menu': 'm%d' % (x % 300),
+             'radio': 'r%d' % (x % 50)} for x in xrange(nrows)]
+
+def render_grid(form, values):
+    start = time.time()
+    FormGridRenderer(form, values).render_table(*FIELDS)
+    return time.time() - start
+
+class LocaleRenderer(TextFormRenderer):
+    "A renderer which caches the choices, like those of real applications."
+    def locale_evaluator(self):
+        return 'en'
+
+def render_rows(form, values, cls=TextFormRenderer):
+    start = time.time()
+    u''.join([cls(form, row).render_table(*FIELDS) for row in values])
+    return time.time() - start
+
+def main():
+    sizes = map(int, sys.argv[1:]) or [100, 500, 2000]
+    form = build((300, 50))
+    print '%8s %12s %12s %12s' % ('rows', 'grid', 'per-row', 'cached')
+    for nrows in sizes:
+        values = rows(nrows)
+        print '%8d %12.3f %12.3f %12.3f' % (
+            nrows, render_grid(form, values), render_rows(form, values),
+            render_rows(form, values, LocaleRenderer))
+
+if __name__ == '__main__':
+    main()